@@ -0,0 +1,227 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+import asyncio
+import threading
+
+from pygas.alignercpu import AlignerCpu
+from pygas.classes import AlignmentBatch
+from pygas.progress import Progress
+
+_WORKER_ALIGNER = None  # aligner of a process pool worker
+
+
+def _init_worker(aligner: AlignerCpu):  # pragma: no cover (runs in worker process)
+    global _WORKER_ALIGNER
+    _WORKER_ALIGNER = aligner
+
+
+def _align_in_worker(queries: List[str], keep_matrix: bool, chunk_size: int) -> AlignmentBatch:  # pragma: no cover
+    return _WORKER_ALIGNER.align_queries(queries, keep_matrix=keep_matrix, progress=Progress(), chunk_size=chunk_size)
+
+
+class _BatchCancelled(Exception):
+    pass
+
+
+def split_batch(ab: AlignmentBatch, queries: List[str]) -> AlignmentBatch:
+    """
+    Results for a subset of the queries of an AlignmentBatch, in the order of queries.
+    """
+    by_query = {results[0].sm.original_seq: results for results in ab.mapped}
+    exceeded = set(ab.budget_exceeded)
+    unmapped = []
+    mapped = []
+    for query in queries:
+        if query in by_query:
+            mapped.append(by_query[query])
+        else:
+            unmapped.append(query)
+    return AlignmentBatch(
+        unmapped=unmapped,
+        mapped=mapped,
+        budget_exceeded=[query for query in queries if query in exceeded],
+    )
+
+
+@dataclass
+class AsyncAligner:
+    """
+    asyncio front end for an AlignerCpu, alignment runs in an executor so the event loop is not blocked.
+
+    Requests made while the engine is busy, or within batch_delay of each other, are combined into one engine call of
+    up to max_batch queries (identical queries are aligned once) and the results split back per request.
+
+    A cancelled request is dropped if its batch has not started.  With a thread executor a running batch stops after
+    the current chunk of chunk_size queries once every request in it is cancelled, a process pool finishes the batch.
+
+    executor:
+        Executor for engine calls, defaults to a single thread.  The aligner is shared by the threads so engine calls
+        are made one at a time.
+    processes:
+        When set, a process pool of this size is created with a copy of the aligner in each worker, targets added or
+        retired afterwards are not seen by the workers.  Keeps CPU bound alignment away from the event loop thread and
+        up to processes batches run at the same time.
+    """
+
+    aligner: AlignerCpu
+    executor: Optional[Executor] = None
+    processes: int = 0
+    max_batch: int = 10000
+    batch_delay: float = 0.002
+    chunk_size: int = 1000
+    keep_matrix: bool = False
+
+    def __post_init__(self):
+        if self.processes and self.executor is not None:
+            raise ValueError("Provide executor or processes, not both")
+        self._own_executor = None
+        if self.processes:
+            self._own_executor = ProcessPoolExecutor(
+                max_workers=self.processes, initializer=_init_worker, initargs=(self.aligner,)
+            )
+        elif self.executor is None:
+            self._own_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pygas")
+        self._pool = self.executor or self._own_executor
+        self._pending = []  # (queries, future) waiting for a batch
+        self._running = set()  # tasks of batches in the executor
+        self._dispatcher = None
+        self.engine_calls = 0
+        self.peak_batches = 0  # most batches in the executor at once
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_exc_info):
+        await self.aclose()
+
+    async def align_queries(self, queries: List[str]) -> AlignmentBatch:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((list(queries), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+        return await future
+
+    async def aclose(self):
+        """
+        Stop dispatching and release an executor created by this object, pending requests are cancelled.
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        for _, future in self._pending:
+            future.cancel()
+        self._pending = []
+        if self._own_executor is not None:
+            self._own_executor.shutdown(wait=False, cancel_futures=True)
+            self._own_executor = None
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        slots = self.processes or 1
+        while self._pending:
+            if len(self._running) >= slots:
+                # requests made meanwhile join the next batch
+                await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            await asyncio.sleep(self.batch_delay)  # let concurrent requests join the batch
+            batch = self._next_batch()
+            if not batch:
+                continue
+            task = loop.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            self.peak_batches = max(self.peak_batches, len(self._running))
+
+    def _next_batch(self) -> List[tuple]:
+        batch = []
+        n_queries = 0
+        while self._pending and (not batch or n_queries + len(self._pending[0][0]) <= self.max_batch):
+            (queries, future) = self._pending.pop(0)
+            if future.cancelled():
+                continue
+            batch.append((queries, future))
+            n_queries += len(queries)
+        return batch
+
+    async def _run_batch(self, batch: List[tuple]):
+        loop = asyncio.get_running_loop()
+        queries = list(dict.fromkeys(query for (r_queries, _) in batch for query in r_queries))
+        futures = [future for (_, future) in batch]
+        # asyncio futures are only read on the loop, the worker sees cancellation through this event
+        cancelled = threading.Event()
+
+        def on_done(_):
+            if all(future.cancelled() for future in futures):
+                cancelled.set()
+
+        for future in futures:
+            future.add_done_callback(on_done)
+        self.engine_calls += 1
+        try:
+            if self.processes:
+                ab = await loop.run_in_executor(
+                    self._pool, _align_in_worker, queries, self.keep_matrix, self.chunk_size
+                )
+            else:
+                ab = await loop.run_in_executor(self._pool, self._align, queries, cancelled)
+        except _BatchCancelled:
+            return
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (r_queries, future) in batch:
+            if not future.done():
+                future.set_result(split_batch(ab, r_queries))
+
+    def _align(self, queries: List[str], cancelled: threading.Event) -> AlignmentBatch:
+        def check_cancelled(_):
+            if cancelled.is_set():
+                raise _BatchCancelled()
+
+        progress = Progress(interval=0, callback=check_cancelled)
+        return self.aligner.align_queries(
+            queries, keep_matrix=self.keep_matrix, progress=progress, chunk_size=self.chunk_size
+        )
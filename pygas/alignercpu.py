@@ -28,17 +28,121 @@
 # identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
 # 2009, 2010, 2011, 2012’.
 from pygas.aligner import Aligner
-from typing import List
+from typing import Dict, List
 from dataclasses import dataclass
 from pygas.matrix import map_queries
+from pygas.library import TargetLibrary
 from pygas.classes import AlignmentBatch
+from pygas.constants import STRATEGY_TRIE
+from pygas.progress import Progress
 
 
 @dataclass
 class AlignerCpu(Aligner):
-    def align_queries(self, queries: List[str], keep_matrix=True) -> AlignmentBatch:
-        self.alignment_batch = map_queries(
-            targets=self.targets,
+    """
+    use_trie:
+        Build a TargetTrie over the targets so the matrix stage only visits targets that can reach min_score, results
+        are unchanged.  Disable to trade alignment speed for a smaller memory footprint.
+
+    budget:
+        Maximum DP cells computed per query, 0 for no limit.  Queries that reach it are listed in budget_exceeded of
+        the AlignmentBatch with the hits found so far.  Only cells of fill() are counted, the direct/substring scan and
+        the trie search are not charged.
+
+    cluster_radius:
+        Cluster targets within this many substitutions so the matrix stage can skip whole clusters, results are
+        unchanged (see TargetLibrary).
+
+    auto_plan:
+        Choose the matrix stage strategy of each target length by timing the alternatives on queries derived from the
+        library (see pygas.planner), the plan is kept in engine_plan.  Results are unchanged.  When no length uses the
+        trie it is dropped, unless the library was given.
+
+    t_offset:
+        Added to every reported t_id, used when the full target set is split into shards aligned separately (see
+        pygas.results.merge_batches).  targets is still indexed from 0.
+
+    targets may be a TargetLibrary, which is then shared rather than rebuilt (use_trie and cluster_radius are
+    ignored), e.g. by aligners with different rules over the same targets.
+
+    Targets can be added or retired after construction with add_targets()/remove_targets(), lookup structures are
+    updated in place and t_id values are stable (retired targets are left as None in targets).
+    """
+
+    use_trie: bool = True
+    t_offset: int = 0
+    budget: int = 0
+    cluster_radius: int = 0
+    auto_plan: bool = False
+
+    def __post_init__(self):
+        super().__post_init__()
+        shared = isinstance(self.targets, TargetLibrary)
+        if shared:
+            self._library = self.targets
+        else:
+            self._library = TargetLibrary(self.targets, use_trie=self.use_trie, cluster_radius=self.cluster_radius)
+        self.targets = self._library.targets
+        self.strategies = None
+        self.engine_plan = None
+        if self.auto_plan:
+            from pygas.planner import plan_engine
+
+            self.engine_plan = plan_engine(self)
+            self.strategies = self.engine_plan.strategies
+            if not shared and STRATEGY_TRIE not in self.strategies.values():
+                self._library.drop_trie()
+                self.engine_plan.profile.has_trie = False
+
+    @property
+    def library(self) -> TargetLibrary:
+        return self._library
+
+    def __getstate__(self):
+        # the last AlignmentBatch isn't needed by a copy, e.g. in a worker process
+        state = self.__dict__.copy()
+        state.pop("alignment_batch", None)
+        return state
+
+    def add_targets(self, targets: List[str]) -> List[int]:
+        """
+        Returns the t_id assigned to each new target.
+        """
+        return [t_id + self.t_offset for t_id in self._library.add(targets)]
+
+    def remove_targets(self, t_ids: List[int]):
+        self._library.remove([t_id - self.t_offset for t_id in t_ids])
+
+    def align_queries(
+        self, queries: List[str], keep_matrix=True, progress: Progress = None, chunk_size: int = 10000
+    ) -> AlignmentBatch:
+        """
+        progress:
+            Queries are aligned chunk_size at a time and each chunk is passed to progress.update().  Results are
+            unchanged, except that queries rejected by match_type during backtrack are listed after the unmapped
+            queries of their own chunk.
+        """
+        if progress is None:
+            self.alignment_batch = self._align(queries, keep_matrix)
+            return self.alignment_batch
+
+        if progress.total == 0:
+            progress.total = len(queries)
+        unmapped = []
+        mapped = []
+        budget_exceeded = []
+        for c_start in range(0, len(queries), chunk_size):
+            ab = self._align(queries[c_start : c_start + chunk_size], keep_matrix)
+            progress.update(ab)
+            unmapped.extend(ab.unmapped)
+            mapped.extend(ab.mapped)
+            budget_exceeded.extend(ab.budget_exceeded)
+        self.alignment_batch = AlignmentBatch(unmapped=unmapped, mapped=mapped, budget_exceeded=budget_exceeded)
+        return self.alignment_batch
+
+    def _align(self, queries: List[str], keep_matrix: bool, strategies: Dict[int, str] = None) -> AlignmentBatch:
+        ab = map_queries(
+            targets=self._library,
             penalty_max=self.max_penalty,
             hard_min=self.score_min,
             queries=queries,
@@ -46,5 +150,15 @@ class AlignerCpu(Aligner):
             do_revcomp=self.rev_comp,
             exact_only=self.exact_only,
             match_type=self.match_type,
+            budget=self.budget,
+            strategies=self.strategies if strategies is None else strategies,
         )
-        return self.alignment_batch
+        if self.t_offset:
+            done = set()  # identical queries share the same result list, offset each list once
+            for results in ab.mapped:
+                if id(results) in done:
+                    continue
+                done.add(id(results))
+                for bt in results:
+                    bt.sm.target_id += self.t_offset
+        return ab
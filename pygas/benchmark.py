@@ -0,0 +1,264 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pygas.classes import Backtrack, ScoreMatrix
+from pygas.library import TargetLibrary
+from pygas.matrix import fill, map_queries
+
+BASELINE_VERSION = 1
+# seconds allowed for each command from a new interpreter, see startup_times()
+STARTUP_BUDGET = {"version": 0.5, "run": 1.0}
+
+
+@dataclass
+class BenchDataset:
+    """
+    Fixed synthetic data set, the same seed always gives the same targets and queries.
+
+    t_lengths:
+        Target lengths are drawn from these, more than one value enables substring matching for every query.
+    """
+
+    name: str
+    seed: int
+    n_targets: int
+    n_queries: int
+    t_lengths: Tuple[int, ...] = (20,)
+    penalty_max: int = 4
+    hard_min: int = 15
+
+    def generate(self, scale: float = 1.0) -> Tuple[List[str], List[str]]:
+        rng = random.Random(self.seed)
+        n_targets = max(1, int(self.n_targets * scale))
+        n_queries = max(1, int(self.n_queries * scale))
+        targets = ["".join(rng.choice("ACGT") for _ in range(rng.choice(self.t_lengths))) for _ in range(n_targets)]
+        queries = []
+        for _ in range(n_queries):
+            q = list(rng.choice(targets))
+            for _ in range(rng.randint(0, 2)):
+                p = rng.randrange(len(q))
+                op = rng.randint(0, 2)
+                if op == 0:
+                    q[p] = rng.choice("ACGT")
+                elif op == 1:
+                    q.insert(p, rng.choice("ACGT"))
+                else:
+                    del q[p]
+            queries.append("".join(q))
+        return (targets, queries)
+
+
+DATASETS = [
+    BenchDataset(name="uniform", seed=1, n_targets=10000, n_queries=300),
+    BenchDataset(name="mixed_lengths", seed=2, n_targets=5000, n_queries=200, t_lengths=(19, 20, 21)),
+]
+
+
+def _measure(func: Callable, repeat: int, min_time: float = 0.1) -> Dict[str, float]:
+    """
+    Median and median absolute deviation of wall time per call over repeat samples, peak traced allocation of an
+    extra untimed call (tracing slows allocation heavy code).  Short stages are called several times per sample so
+    each sample lasts at least min_time.
+    """
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    func()
+    loops = max(1, int(min_time / max(time.perf_counter() - start, 1e-9)) + 1)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        times.append((time.perf_counter() - start) / loops)
+    median = statistics.median(times)
+    return {
+        "median_s": median,
+        "mad_s": statistics.median([abs(t - median) for t in times]),
+        "peak_bytes": peak,
+        "repeat": repeat,
+        "loops": loops,
+    }
+
+
+def run_benchmarks(repeat: int = 5, scale: float = 1.0) -> Dict[str, dict]:
+    """
+    Time each stage over the fixed data sets, keys are "<dataset>/<stage>".
+
+    Stages are building the TargetLibrary, fill() and Backtrack on every pair reported by map_queries, and
+    map_queries end to end.  tracemalloc only sees allocations made through the Python allocator, so peak_bytes
+    excludes the C arrays of the trie and packed sequence store.
+    """
+    results = {}
+    for dataset in DATASETS:
+        (targets, queries) = dataset.generate(scale)
+        library = TargetLibrary(targets)
+        ab = map_queries(library, queries, dataset.penalty_max, dataset.hard_min)
+        pairs = [(bt.sm.target, bt.sm.query) for results_set in ab.mapped for bt in results_set]
+        matrices = [
+            ScoreMatrix(query=q, target=t, target_id=0, score=score, reversed=False, original_seq=q, matrix=matrix)
+            for (t, q) in pairs
+            for (matrix, score) in [fill(t, q, 0)]
+        ]
+        stages = {
+            "library": (lambda: TargetLibrary(targets), len(targets)),
+            "map_queries": (lambda: map_queries(library, queries, dataset.penalty_max, dataset.hard_min), len(queries)),
+            "fill": (lambda: [fill(t, q, 0) for (t, q) in pairs], len(pairs)),
+            "backtrack": (lambda: [Backtrack(sm) for sm in matrices], len(matrices)),
+        }
+        for (stage, (func, items)) in stages.items():
+            result = _measure(func, repeat)
+            result["items"] = items
+            result["items_per_s"] = items / result["median_s"] if result["median_s"] > 0 else 0.0
+            results[f"{dataset.name}/{stage}"] = result
+    return results
+
+
+def compare(
+    baseline: Dict[str, dict],
+    current: Dict[str, dict],
+    time_tolerance: float = 0.1,
+    mem_tolerance: float = 0.1,
+    noise_factor: float = 3.0,
+) -> Tuple[List[List[str]], bool]:
+    """
+    Compare stage results against a baseline, returns table rows and whether any stage regressed.
+
+    A stage is slower when its median exceeds the baseline median by time_tolerance (relative) plus noise_factor times
+    the larger MAD of the two runs, so noisy stages need a bigger change to fail.  Memory fails above mem_tolerance.
+    """
+    rows = [["stage", "base_s", "new_s", "change", "base_bytes", "new_bytes", "status"]]
+    regressed = False
+    for stage in sorted(set(baseline) | set(current)):
+        if stage not in current or stage not in baseline:
+            rows.append([stage, "", "", "", "", "", "missing" if stage not in current else "new"])
+            continue
+        base = baseline[stage]
+        new = current[stage]
+        noise = noise_factor * max(base["mad_s"], new["mad_s"])
+        time_limit = base["median_s"] * (1 + time_tolerance) + noise
+        mem_limit = base["peak_bytes"] * (1 + mem_tolerance)
+        status = []
+        if new["median_s"] > time_limit:
+            status.append("SLOWER")
+        if new["peak_bytes"] > mem_limit:
+            status.append("MEMORY")
+        regressed = regressed or bool(status)
+        change = (new["median_s"] / base["median_s"] - 1) if base["median_s"] > 0 else 0.0
+        rows.append(
+            [
+                stage,
+                f"{base['median_s']:.4f}",
+                f"{new['median_s']:.4f}",
+                f"{change:+.1%}",
+                str(base["peak_bytes"]),
+                str(new["peak_bytes"]),
+                ",".join(status) if status else "ok",
+            ]
+        )
+    return (rows, regressed)
+
+
+def startup_times(repeat: int = 5) -> Dict[str, float]:
+    """
+    Best wall time in seconds of "python -m pygas --version" and of "python -m pygas run" with one target and one query,
+    both are dominated by interpreter start up and imports.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        seqs = os.path.join(tmp, "seqs.txt")
+        with open(seqs, "w") as ofh:
+            print("ACGT" * 5, file=ofh)
+        commands = {
+            "version": ["--version"],
+            "run": ["run", "-t", seqs, "-q", seqs, "-o", os.path.join(tmp, "out.tsv"), "-l", "WARNING"],
+        }
+        times = {}
+        for (name, args) in commands.items():
+            elapsed = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, "-m", "pygas", *args], check=True, capture_output=True)
+                elapsed.append(time.perf_counter() - start)
+            times[name] = min(elapsed)
+    return times
+
+
+def check_startup(times: Dict[str, float], budget: Dict[str, float] = STARTUP_BUDGET) -> Tuple[List[List[str]], bool]:
+    """
+    Returns table rows and whether any command exceeded its budget.
+    """
+    rows = [["command", "seconds", "budget", "status"]]
+    over = False
+    for (name, seconds) in times.items():
+        status = "ok"
+        if seconds > budget[name]:
+            status = "OVER BUDGET"
+            over = True
+        rows.append([name, f"{seconds:.3f}", f"{budget[name]:.3f}", status])
+    return rows, over
+
+
+def format_table(rows: List[List[str]]) -> str:
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(col.ljust(widths[i]) for i, col in enumerate(row)).rstrip() for row in rows)
+
+
+def save_baseline(path: str, results: Dict[str, dict], scale: float):
+    data = {
+        "version": BASELINE_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "scale": scale,
+        "stages": results,
+    }
+    with open(path, "w") as ofh:
+        json.dump(data, ofh, indent=2, sort_keys=True)
+
+
+def load_baseline(path: str) -> dict:
+    with open(path) as ifh:
+        data = json.load(ifh)
+    if data.get("version") != BASELINE_VERSION:
+        raise ValueError(f"{path} is not a version {BASELINE_VERSION} baseline, record it again")
+    return data
@@ -0,0 +1,180 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional, TextIO
+import hashlib
+import json
+import os
+import shutil
+
+from pygas.alignercpu import AlignerCpu
+from pygas.progress import Progress
+from pygas.results import ResultRow, batch_rows, write_rows
+
+CHECKPOINT_VERSION = 1
+STATE_FILE = "checkpoint.json"
+
+
+def fingerprint(seqs: List[str]) -> str:
+    digest = hashlib.sha1()
+    for seq in seqs:
+        digest.update(seq.encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def _durable_write(path: str, write: Callable[[TextIO], None]):
+    """
+    Replace path with the content written by write(), it is on disk (fsync) before the rename so a crash leaves the
+    old or the new file.
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as ofh:
+        write(ofh)
+        ofh.flush()
+        os.fsync(ofh.fileno())
+    os.replace(tmp, path)
+
+
+@dataclass
+class CheckpointRun:
+    """
+    Aligns queries in chunks of chunk_size, the rows of each chunk are written to directory followed by a checkpoint
+    record so an interrupted run can be resumed at the first incomplete chunk.  Once complete rows() gives the output
+    in the same order as a single align_queries() call.
+
+    settings:
+        Anything else that must match for a resume to be valid (e.g. input paths and aligner options), stored in the
+        checkpoint record along with fingerprints of the queries and the aligner targets.
+    resume:
+        Continue from an existing checkpoint in directory, otherwise an existing checkpoint is an error.
+    """
+
+    aligner: AlignerCpu
+    queries: List[str]
+    directory: str
+    chunk_size: int = 100000
+    settings: dict = field(default_factory=dict)
+    resume: bool = False
+
+    def __post_init__(self):
+        if self.chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self._state = {
+            "version": CHECKPOINT_VERSION,
+            "settings": json.loads(json.dumps(self.settings)),  # as read back, e.g. tuples become lists
+            "chunk_size": self.chunk_size,
+            "n_queries": len(self.queries),
+            "queries_sha1": fingerprint(self.queries),
+            "targets_sha1": fingerprint([t for t in self.aligner.targets if t is not None]),
+            "completed": 0,
+            "budget_exceeded": 0,
+        }
+        path = os.path.join(self.directory, STATE_FILE)
+        if os.path.exists(path):
+            if not self.resume:
+                raise ValueError(f"{self.directory} holds a checkpoint, resume it or remove the directory")
+            with open(path) as ifh:
+                saved = json.load(ifh)
+            for (key, value) in self._state.items():
+                if key not in ("completed", "budget_exceeded") and saved.get(key) != value:
+                    raise ValueError(f"Checkpoint in {self.directory} was made with a different {key}")
+            self._state = saved
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            self._save()
+
+    @property
+    def n_chunks(self) -> int:
+        return -(-len(self.queries) // self.chunk_size)
+
+    @property
+    def completed(self) -> int:
+        """
+        Chunks aligned and on disk.
+        """
+        return self._state["completed"]
+
+    @property
+    def remaining(self) -> int:
+        """
+        Queries still to be aligned.
+        """
+        return max(len(self.queries) - self.completed * self.chunk_size, 0)
+
+    @property
+    def budget_exceeded(self) -> int:
+        return self._state["budget_exceeded"]
+
+    def run(self, progress: Optional[Progress] = None, max_chunks: int = 0):
+        """
+        Align the remaining chunks, max_chunks limits how many are aligned by this call.
+        """
+        last = self.n_chunks if max_chunks <= 0 else min(self.n_chunks, self.completed + max_chunks)
+        for c_idx in range(self.completed, last):
+            chunk = self.queries[c_idx * self.chunk_size : (c_idx + 1) * self.chunk_size]
+            ab = self.aligner.align_queries(chunk, keep_matrix=False, progress=progress)
+            rows = batch_rows(ab)
+            _durable_write(
+                self._chunk_path(c_idx), lambda ofh: write_rows(rows, ofh, with_score=True, with_status=True)
+            )
+            self._state["completed"] = c_idx + 1
+            self._state["budget_exceeded"] += len(ab.budget_exceeded)
+            self._save()
+
+    def rows(self) -> Iterator[ResultRow]:
+        """
+        Rows of every chunk read back from disk, unmapped then mapped as for batch_rows().
+        """
+        if self.completed < self.n_chunks:
+            raise ValueError(f"Only {self.completed} of {self.n_chunks} chunks are complete")
+        for mapped in (False, True):
+            for c_idx in range(self.n_chunks):
+                with open(self._chunk_path(c_idx)) as ifh:
+                    ifh.readline()
+                    for line in ifh:
+                        row = ResultRow.parse(line, with_status=True)
+                        if row.mapped == mapped:
+                            yield row
+
+    def write(self, ofh: TextIO, with_score=False, with_status=False):
+        write_rows(self.rows(), ofh, with_score=with_score, with_status=with_status)
+
+    def remove(self):
+        """
+        Delete the checkpoint directory, once the output has been written.
+        """
+        shutil.rmtree(self.directory)
+
+    def _chunk_path(self, c_idx: int) -> str:
+        return os.path.join(self.directory, f"chunk_{c_idx:06d}.tsv")
+
+    def _save(self):
+        _durable_write(os.path.join(self.directory, STATE_FILE), lambda ofh: json.dump(self._state, ofh, indent=2))
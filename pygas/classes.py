@@ -27,8 +27,8 @@
 # statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
 # identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
 # 2009, 2010, 2011, 2012’.
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import List, Tuple
 from pygas.constants import GAP
 
 BACKTRACK_STR_FMT = "Score: {score}, Cigar: {cigar}, MD: {md}, TargetId: {tid}, TargetPos: {tpos}\nEvents (D/I/M): {d}/{i}/{m}\nT: {tseq}\nM: {match}\nQ: {qseq}"
@@ -336,8 +336,15 @@ class Backtrack:
 
 @dataclass
 class AlignmentBatch:
+    """
+    budget_exceeded:
+        Queries whose alignment stopped at the per-query budget, they are still listed in mapped (hits found so far) or
+        unmapped.
+    """
+
     unmapped: List[str]
     mapped: List[List[Backtrack]]
+    budget_exceeded: List[str] = field(default_factory=list)
 
     def __post_init__(self):
         self.total_reads = len(self.mapped) + len(self.unmapped)
@@ -347,3 +354,62 @@ class AlignmentBatch:
 
     def unmapped_fraction(self):
         return len(self.unmapped) / self.total_reads
+
+
+@dataclass
+class PairHit:
+    """
+    Alignments of both halves of a dual-guide read to an allowed pair of targets.
+    """
+
+    pair_id: int
+    first: Backtrack
+    second: Backtrack
+
+    @property
+    def score(self) -> int:
+        return self.first.sm.score + self.second.sm.score
+
+
+@dataclass
+class PairedBatch:
+    """
+    Reads are (half_1, half_2) tuples.  mapped holds the PairHits at the best combined score of each read.
+
+    budget_exceeded:
+        Reads where either half stopped at the per-query budget.
+    """
+
+    unmapped: List[Tuple[str, str]]
+    mapped: List[List[PairHit]]
+    budget_exceeded: List[Tuple[str, str]] = field(default_factory=list)
+
+
+@dataclass
+class GuideHit:
+    """
+    A guide found within a longer read, offset is the 0-based start of the guide on the forward strand of read,
+    including guide bases at either end that don't align.  cigar and md cover the guide bases only.
+    """
+
+    read: str
+    t_id: int
+    offset: int
+    reversed: bool
+    score: int
+    cigar: str
+    md: str
+
+
+@dataclass
+class ExtractBatch:
+    """
+    mapped holds the GuideHits at the best score of each read.
+
+    exact:
+        Reads resolved by window lookup, the rest of mapped needed fuzzy alignment near an anchor.
+    """
+
+    unmapped: List[str]
+    mapped: List[List[GuideHit]]
+    exact: int = 0
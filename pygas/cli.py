@@ -30,8 +30,9 @@
 import click
 from click_option_group import OptionGroup
 import logging
-import pkg_resources  # part of setuptools
-from pygas.main import run as pygas_run
+import sys
+
+# pygas.main is imported by each command so that --help and --version don't load the aligner
 
 LOG_LEVELS = ("WARNING", "INFO", "DEBUG")
 
@@ -78,7 +79,7 @@ def io_opts(function):  # pragma: no cover
             readable=True,
             resolve_path=True,
         ),
-        help="Output to file, omit for stdout",
+        help="Output to file, omit for stdout.  A .gz path is written as BGZF, a .pgr path as a binary result store",
     )(function)
     function = click.option(
         "-m",
@@ -106,7 +107,7 @@ optgroup_debug = OptionGroup("\nDebug options", help="Options specific to troubl
 
 
 @click.group()
-@click.version_option(pkg_resources.require(__name__.split(".")[0])[0].version)
+@click.version_option(package_name="pygas")
 def cli():  # pragma: no cover
     pass
 
@@ -121,6 +122,111 @@ def cli():  # pragma: no cover
     help="Try both orientations of reads",
     show_default=True,
 )
+@click.option(
+    "--trie",
+    required=False,
+    default=True,
+    type=bool,
+    help="Index targets in a radix tree to limit the matrix stage to targets that can reach the minimum score",
+    show_default=True,
+)
+@click.option(
+    "--plan",
+    required=False,
+    default=False,
+    type=bool,
+    help="Time the matrix stage strategies on queries derived from the targets and use the fastest for each length",
+    show_default=True,
+)
+@click.option(
+    "--cluster-radius",
+    required=False,
+    default=0,
+    type=click.IntRange(min=0, max=3),
+    help="Cluster targets within this many substitutions so the matrix stage can skip whole clusters, 0 to disable",
+    show_default=True,
+)
+@click.option(
+    "--t-offset",
+    required=False,
+    default=0,
+    type=int,
+    help="Added to reported t_id, the line number of the first target of this shard in the full target set",
+    show_default=True,
+)
+@click.option(
+    "--score",
+    required=False,
+    default=False,
+    type=bool,
+    help="Include the best score of each query as column 2, required by merge",
+    show_default=True,
+)
+@click.option(
+    "--status",
+    required=False,
+    default=False,
+    type=bool,
+    help="Include a status column after the query (and score): mapped, unmapped or budget_exceeded",
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help="Worker threads decompressing BGZF input and compressing .gz output, 0 to use the reading/writing thread",
+    show_default=True,
+)
+@click.option(
+    "--budget",
+    required=False,
+    default=0,
+    type=click.IntRange(min=0),
+    help="Maximum DP fill cells computed per query, queries reaching it report the hits found so far, 0 for no limit",
+    show_default=True,
+)
+@click.option(
+    "--progress",
+    required=False,
+    default=60.0,
+    type=float,
+    help="Seconds between progress reports (throughput, mapping rates, ETA, peak RSS) at INFO level, 0 to disable",
+    show_default=True,
+)
+@click.option(
+    "--metrics",
+    required=False,
+    type=click.Path(
+        exists=False,
+        file_okay=True,
+        dir_okay=False,
+        readable=True,
+        resolve_path=True,
+    ),
+    help="Write final run metrics to this file as JSON",
+)
+@click.option(
+    "--checkpoint",
+    required=False,
+    default=0,
+    type=click.IntRange(min=0),
+    help="Align in chunks of this many queries, each written to OUTPUT.ckpt/ with a checkpoint record, 0 to disable",
+    show_default=True,
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue an interrupted --checkpoint run from its last completed chunk",
+)
+@click.option(
+    "--max-memory",
+    required=False,
+    default=None,
+    type=str,
+    help="Stream queries and spill finished rows to a temporary file near this memory use, e.g. 4G",
+)
 @optgroup_debug.option(
     "-l",
     "--loglevel",
@@ -130,9 +236,862 @@ def cli():  # pragma: no cover
     type=click.Choice(LOG_LEVELS, case_sensitive=False),
     help="Set logging verbosity",
 )
-def run(loglevel, targets, queries, output, minscore, rules, rc):  # pragma: no cover
+def run(
+    loglevel,
+    targets,
+    queries,
+    output,
+    minscore,
+    rules,
+    rc,
+    trie,
+    plan,
+    cluster_radius,
+    t_offset,
+    score,
+    status,
+    threads,
+    budget,
+    progress,
+    metrics,
+    checkpoint,
+    resume,
+    max_memory,
+):  # pragma: no cover
     """
     Very basic command line for limited use cases, packages is intended to be used as an API
     """
     _log_setup(loglevel)
-    pygas_run(targets, queries, output, minscore, rules, rc)
+    from pygas.main import run as pygas_run
+
+    pygas_run(
+        targets,
+        queries,
+        output,
+        minscore,
+        rules,
+        rc,
+        use_trie=trie,
+        cluster_radius=cluster_radius,
+        t_offset=t_offset,
+        with_score=score,
+        progress_interval=progress,
+        metrics=metrics,
+        budget=budget,
+        with_status=status,
+        threads=threads,
+        checkpoint=checkpoint,
+        resume=resume,
+        auto_plan=plan,
+        max_memory=max_memory,
+    )
+
+
+@cli.command()
+@click.option(
+    "-q",
+    "--queries",
+    required=True,
+    type=click.Path(
+        exists=True,
+        file_okay=True,
+        dir_okay=False,
+        readable=True,
+        resolve_path=True,
+    ),
+    help="Query/read sequences used for every shard, one per line",
+)
+@click.option(
+    "-o",
+    "--output",
+    required=False,
+    type=click.Path(
+        exists=False,
+        file_okay=True,
+        dir_okay=False,
+        readable=True,
+        resolve_path=True,
+    ),
+    help="Output to file, omit for stdout.  A .gz path is written as BGZF",
+)
+@click.option(
+    "--score",
+    required=False,
+    default=False,
+    type=bool,
+    help="Include the score column, allows the output to be merged again",
+    show_default=True,
+)
+@click.option(
+    "--status",
+    required=False,
+    default=False,
+    type=bool,
+    help="Include a status column after the query (and score): mapped, unmapped or budget_exceeded",
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help="Worker threads decompressing BGZF input and compressing .gz output, 0 to use the reading/writing thread",
+    show_default=True,
+)
+@click.argument(
+    "shards",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+)
+@optgroup_debug.option(
+    "-l",
+    "--loglevel",
+    required=False,
+    default="INFO",
+    show_default=True,
+    type=click.Choice(LOG_LEVELS, case_sensitive=False),
+    help="Set logging verbosity",
+)
+def merge(loglevel, queries, output, score, status, threads, shards):  # pragma: no cover
+    """
+    Merge the output of "pygas run --score True" over shards of the target set, keeping hits at the best score of each
+    query
+    """
+    _log_setup(loglevel)
+    from pygas.main import merge as pygas_merge
+
+    pygas_merge(queries, shards, output, with_score=score, with_status=status, threads=threads)
+
+
+@cli.command()
+@click.option(
+    "-o",
+    "--output",
+    required=False,
+    type=click.Path(
+        exists=False,
+        file_okay=True,
+        dir_okay=False,
+        readable=True,
+        resolve_path=True,
+    ),
+    help="Output to file, omit for stdout.  A .gz path is written as BGZF",
+)
+@click.option(
+    "--score",
+    required=False,
+    default=False,
+    type=bool,
+    help="Include the score column, allows the output to be merged",
+    show_default=True,
+)
+@click.option(
+    "--status",
+    required=False,
+    default=False,
+    type=bool,
+    help="Include a status column after the query (and score): mapped, unmapped or budget_exceeded",
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help="Worker threads compressing .gz output, 0 to use the writing thread",
+    show_default=True,
+)
+@click.argument(
+    "store",
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+)
+@optgroup_debug.option(
+    "-l",
+    "--loglevel",
+    required=False,
+    default="INFO",
+    show_default=True,
+    type=click.Choice(LOG_LEVELS, case_sensitive=False),
+    help="Set logging verbosity",
+)
+def convert(loglevel, output, score, status, threads, store):  # pragma: no cover
+    """
+    Write a binary result store (pygas run -o result.pgr) as TSV
+    """
+    _log_setup(loglevel)
+    from pygas.main import convert as pygas_convert
+
+    pygas_convert(store, output, with_score=score, with_status=status, threads=threads)
+
+
+@cli.command()
+@click.option(
+    "-b",
+    "--baseline",
+    required=True,
+    type=click.Path(
+        file_okay=True,
+        dir_okay=False,
+        resolve_path=True,
+    ),
+    help="Baseline JSON file, compared against unless --record",
+)
+@click.option(
+    "--record",
+    is_flag=True,
+    default=False,
+    help="Write this run as the baseline instead of comparing",
+)
+@click.option(
+    "--repeat",
+    required=False,
+    default=5,
+    type=click.IntRange(min=1),
+    help="Timed runs per stage, the median is compared",
+    show_default=True,
+)
+@click.option(
+    "--scale",
+    required=False,
+    default=1.0,
+    type=float,
+    help="Multiplier for the size of the synthetic data sets, must match the baseline",
+    show_default=True,
+)
+@click.option(
+    "--time-tolerance",
+    required=False,
+    default=0.1,
+    type=float,
+    help="Allowed relative slowdown of a stage, in addition to 3x the run to run deviation",
+    show_default=True,
+)
+@click.option(
+    "--mem-tolerance",
+    required=False,
+    default=0.1,
+    type=float,
+    help="Allowed relative increase of peak traced memory of a stage",
+    show_default=True,
+)
+@optgroup_debug.option(
+    "-l",
+    "--loglevel",
+    required=False,
+    default="INFO",
+    show_default=True,
+    type=click.Choice(LOG_LEVELS, case_sensitive=False),
+    help="Set logging verbosity",
+)
+def benchmark(loglevel, baseline, record, repeat, scale, time_tolerance, mem_tolerance):  # pragma: no cover
+    """
+    Time fixed synthetic workloads per stage, exits 1 if any stage is slower or uses more memory than the baseline,
+    or start up of pygas --version/run is over budget
+    """
+    _log_setup(loglevel)
+    from pygas.main import benchmark as pygas_benchmark
+
+    if pygas_benchmark(baseline, record, repeat, scale, time_tolerance, mem_tolerance):
+        sys.exit(1)
+
+
+@cli.command()
+@click.option(
+    "-o",
+    "--output",
+    required=True,
+    type=str,
+    help="Output prefix, writes <prefix>.targets.txt, <prefix>.queries.txt and <prefix>.truth.tsv",
+)
+@click.option(
+    "--targets",
+    "n_targets",
+    required=False,
+    default=10000,
+    type=click.IntRange(min=1),
+    help="Number of unique targets",
+    show_default=True,
+)
+@click.option(
+    "--lengths",
+    required=False,
+    default="20",
+    type=str,
+    help="Target length distribution, e.g. 20 or 19:0.1,20:0.8,21:0.1 (length:relative weight)",
+    show_default=True,
+)
+@click.option(
+    "--prefixes",
+    "n_prefixes",
+    required=False,
+    default=0,
+    type=click.IntRange(min=0),
+    help="Number of shared prefixes targets are built on, 0 for fully random targets",
+    show_default=True,
+)
+@click.option(
+    "--prefix-length",
+    required=False,
+    default=8,
+    type=click.IntRange(min=1),
+    help="Length of shared prefixes",
+    show_default=True,
+)
+@click.option(
+    "--reads",
+    "n_reads",
+    required=False,
+    default=100000,
+    type=click.IntRange(min=0),
+    help="Number of reads",
+    show_default=True,
+)
+@click.option(
+    "--sub-rate",
+    required=False,
+    default=0.0,
+    type=click.FloatRange(0, 1),
+    help="Substitutions per base",
+    show_default=True,
+)
+@click.option(
+    "--ins-rate",
+    required=False,
+    default=0.0,
+    type=click.FloatRange(0, 1),
+    help="Insertions per base",
+    show_default=True,
+)
+@click.option(
+    "--del-rate",
+    required=False,
+    default=0.0,
+    type=click.FloatRange(0, 1),
+    help="Deletions per base",
+    show_default=True,
+)
+@click.option(
+    "--rc-rate",
+    required=False,
+    default=0.0,
+    type=click.FloatRange(0, 1),
+    help="Fraction of reads reverse complemented",
+    show_default=True,
+)
+@click.option(
+    "--dup-rate",
+    required=False,
+    default=0.0,
+    type=click.FloatRange(0, 1),
+    help="Fraction of reads that repeat a recent read",
+    show_default=True,
+)
+@click.option(
+    "--noise-rate",
+    required=False,
+    default=0.0,
+    type=click.FloatRange(0, 1),
+    help="Fraction of reads that are random sequence, not from the library",
+    show_default=True,
+)
+@click.option(
+    "--seed",
+    required=False,
+    default=0,
+    type=int,
+    help="Random seed, the same options and seed give the same output",
+    show_default=True,
+)
+@optgroup_debug.option(
+    "-l",
+    "--loglevel",
+    required=False,
+    default="INFO",
+    show_default=True,
+    type=click.Choice(LOG_LEVELS, case_sensitive=False),
+    help="Set logging verbosity",
+)
+def simulate(
+    loglevel,
+    output,
+    n_targets,
+    lengths,
+    n_prefixes,
+    prefix_length,
+    n_reads,
+    sub_rate,
+    ins_rate,
+    del_rate,
+    rc_rate,
+    dup_rate,
+    noise_rate,
+    seed,
+):  # pragma: no cover
+    """
+    Generate a synthetic target library and reads with a truth file for scale and accuracy testing
+    """
+    _log_setup(loglevel)
+    from pygas.main import simulate as pygas_simulate
+
+    pygas_simulate(
+        output,
+        n_targets,
+        lengths,
+        n_prefixes,
+        prefix_length,
+        n_reads,
+        sub_rate,
+        ins_rate,
+        del_rate,
+        rc_rate,
+        dup_rate,
+        noise_rate,
+        seed,
+    )
+
+
+@cli.command()
+@click.option(
+    "-t",
+    "--targets",
+    "libraries",
+    required=True,
+    multiple=True,
+    type=str,
+    help="Target library to hold in memory as NAME=PATH, or PATH named by its file name, repeat for more libraries",
+)
+@click.option(
+    "-s",
+    "--socket",
+    required=False,
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True),
+    help="Listen on this Unix socket, omit to read requests from stdin and write responses to stdout",
+)
+@click.option(
+    "--trie",
+    required=False,
+    default=True,
+    type=bool,
+    help="Index targets in a radix tree to limit the matrix stage to targets that can reach the minimum score",
+    show_default=True,
+)
+@optgroup_debug.option(
+    "-l",
+    "--loglevel",
+    required=False,
+    default="INFO",
+    show_default=True,
+    type=click.Choice(LOG_LEVELS, case_sensitive=False),
+    help="Set logging verbosity",
+)
+def serve(loglevel, libraries, socket, trie):  # pragma: no cover
+    """
+    Hold target libraries in memory and align jobs sent as JSON lines, see README for the protocol
+    """
+    _log_setup(loglevel)
+    from pygas.main import serve as pygas_serve
+
+    pygas_serve(libraries, socket=socket, use_trie=trie)
+
+
+@cli.command()
+@click.option(
+    "--targets-1",
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Guide sequences for the first half of each read, one per line",
+)
+@click.option(
+    "--targets-2",
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Guide sequences for the second half of each read, one per line",
+)
+@click.option(
+    "-p",
+    "--pairs",
+    required=False,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Allowed pairs as 't_id_1<TAB>t_id_2' lines, pair_id is the line index.  Omit to allow every combination",
+)
+@click.option(
+    "-q",
+    "--queries",
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Reads as 'half_1<TAB>half_2' lines, or one sequence per line with --split",
+)
+@click.option(
+    "--split",
+    required=False,
+    default=0,
+    type=click.IntRange(min=0),
+    help="Split each read into halves at this position, 0 when reads are tab separated",
+    show_default=True,
+)
+@click.option(
+    "-o",
+    "--output",
+    required=False,
+    type=click.Path(exists=False, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Output to file, omit for stdout.  A .gz path is written as BGZF",
+)
+@click.option(
+    "-m",
+    "--minscore",
+    required=False,
+    type=int,
+    default=15,
+    help="Minimum score of each half",
+    show_default=True,
+)
+@click.option(
+    "-r",
+    "--rules",
+    required=False,
+    type=str,
+    default=["M"],
+    multiple=True,
+    help="Rules for decreasing score based on allowed differences, applied to each half",
+    show_default=True,
+)
+@click.option(
+    "--rc",
+    required=False,
+    default=True,
+    type=bool,
+    help="Try both orientations of each half",
+    show_default=True,
+)
+@click.option(
+    "--score",
+    required=False,
+    default=False,
+    type=bool,
+    help="Include the combined score of both halves",
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help="Worker threads decompressing BGZF input and compressing .gz output, 0 to use the reading/writing thread",
+    show_default=True,
+)
+@optgroup_debug.option(
+    "-l",
+    "--loglevel",
+    required=False,
+    default="INFO",
+    show_default=True,
+    type=click.Choice(LOG_LEVELS, case_sensitive=False),
+    help="Set logging verbosity",
+)
+def pair(
+    loglevel, targets_1, targets_2, pairs, queries, split, output, minscore, rules, rc, score, threads
+):  # pragma: no cover
+    """
+    Align dual-guide reads, each half against its own guide library, reporting the pair_id and both alignments
+    """
+    _log_setup(loglevel)
+    from pygas.main import pair as pygas_pair
+
+    pygas_pair(
+        targets_1,
+        targets_2,
+        pairs,
+        queries,
+        output,
+        minscore,
+        rules,
+        rc,
+        split=split,
+        with_score=score,
+        threads=threads,
+    )
+
+
+@cli.command()
+@click.option(
+    "-t",
+    "--targets",
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Guide sequences, one per line",
+)
+@click.option(
+    "-q",
+    "--queries",
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Reads holding a guide, one per line",
+)
+@click.option(
+    "-o",
+    "--output",
+    required=False,
+    type=click.Path(exists=False, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Output to file, omit for stdout.  A .gz path is written as BGZF",
+)
+@click.option(
+    "-m",
+    "--minscore",
+    required=False,
+    type=int,
+    default=15,
+    help="Minimum score of a guide hit",
+    show_default=True,
+)
+@click.option(
+    "-r",
+    "--rules",
+    required=False,
+    type=str,
+    default=["M"],
+    multiple=True,
+    help="Rules for decreasing score based on allowed differences, used near anchors only",
+    show_default=True,
+)
+@click.option(
+    "--rc",
+    required=False,
+    default=True,
+    type=bool,
+    help="Search both strands of each read",
+    show_default=True,
+)
+@click.option(
+    "--flank-5",
+    required=False,
+    default="",
+    type=str,
+    help="Backbone sequence immediately before the guide, anchors fuzzy alignment of reads without an exact hit",
+)
+@click.option(
+    "--flank-3",
+    required=False,
+    default="",
+    type=str,
+    help="Backbone sequence immediately after the guide, anchors fuzzy alignment of reads without an exact hit",
+)
+@click.option(
+    "--anchor",
+    required=False,
+    default=-1,
+    type=click.IntRange(min=-1),
+    help="0-based position of the guide in the read, used when no flank is given or found, -1 for none",
+    show_default=True,
+)
+@click.option(
+    "--slack",
+    required=False,
+    default=2,
+    type=click.IntRange(min=0),
+    help="Bases added to each end of an anchored region",
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help="Worker threads decompressing BGZF input and compressing .gz output, 0 to use the reading/writing thread",
+    show_default=True,
+)
+@optgroup_debug.option(
+    "-l",
+    "--loglevel",
+    required=False,
+    default="INFO",
+    show_default=True,
+    type=click.Choice(LOG_LEVELS, case_sensitive=False),
+    help="Set logging verbosity",
+)
+def extract(
+    loglevel, targets, queries, output, minscore, rules, rc, flank_5, flank_3, anchor, slack, threads
+):  # pragma: no cover
+    """
+    Find guides within longer reads by exact window lookup, reporting the guide and its offset in the read
+    """
+    _log_setup(loglevel)
+    from pygas.main import extract as pygas_extract
+
+    pygas_extract(
+        targets,
+        queries,
+        output,
+        minscore,
+        rules,
+        rc,
+        flank_5=flank_5,
+        flank_3=flank_3,
+        anchor=anchor,
+        slack=slack,
+        threads=threads,
+    )
+
+
+@cli.command()
+@click.option(
+    "-t",
+    "--targets",
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="target/guide sequences, one per line",
+)
+@click.option(
+    "-q",
+    "--queries",
+    required=True,
+    multiple=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Query sequences of one sample, one per line.  Repeat for each sample, named by the file name",
+)
+@click.option(
+    "-d",
+    "--output-dir",
+    required=False,
+    type=click.Path(exists=False, file_okay=False, dir_okay=True, resolve_path=True),
+    help="Write the output of each sample to DIR/SAMPLE.tsv, as a single sample run would",
+)
+@click.option(
+    "--suffix",
+    required=False,
+    default=".tsv",
+    type=str,
+    help="File suffix of per sample output, .tsv.gz is written as BGZF",
+    show_default=True,
+)
+@click.option(
+    "-c",
+    "--counts",
+    required=False,
+    type=click.Path(exists=False, file_okay=True, dir_okay=False, readable=True, resolve_path=True),
+    help="Write one row per distinct sequence with a count column per sample, stdout when neither -c nor -d is given",
+)
+@click.option(
+    "-m",
+    "--minscore",
+    required=False,
+    type=int,
+    default=15,
+    help="Minimum score to retain, regardless of rule penalties.  Perfect match has score equal to query length.",
+    show_default=True,
+)
+@click.option(
+    "-r",
+    "--rules",
+    required=False,
+    type=str,
+    default=["M"],
+    multiple=True,
+    help="Rules for decreasing score based on allowed differences, e.g. MDI allows 1 base of mismatch, deletion and insertion.",
+    show_default=True,
+)
+@click.option(
+    "--rc",
+    required=False,
+    default=True,
+    type=bool,
+    help="Try both orientations of reads",
+    show_default=True,
+)
+@click.option(
+    "--trie",
+    required=False,
+    default=True,
+    type=bool,
+    help="Index targets in a radix tree to limit the matrix stage to targets that can reach the minimum score",
+    show_default=True,
+)
+@click.option(
+    "--score",
+    required=False,
+    default=False,
+    type=bool,
+    help="Include the best score of each query after the query (and counts)",
+    show_default=True,
+)
+@click.option(
+    "--status",
+    required=False,
+    default=False,
+    type=bool,
+    help="Include a status column after the score: mapped, unmapped or budget_exceeded",
+    show_default=True,
+)
+@click.option(
+    "--budget",
+    required=False,
+    default=0,
+    type=click.IntRange(min=0),
+    help="Maximum DP fill cells computed per query, queries reaching it report the hits found so far, 0 for no limit",
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    required=False,
+    default=1,
+    type=click.IntRange(min=0),
+    help="Worker threads decompressing BGZF input and compressing .gz output, 0 to use the reading/writing thread",
+    show_default=True,
+)
+@click.option(
+    "--progress",
+    required=False,
+    default=60.0,
+    type=float,
+    help="Seconds between progress reports at INFO level, 0 to disable",
+    show_default=True,
+)
+@optgroup_debug.option(
+    "-l",
+    "--loglevel",
+    required=False,
+    default="INFO",
+    show_default=True,
+    type=click.Choice(LOG_LEVELS, case_sensitive=False),
+    help="Set logging verbosity",
+)
+def multi(
+    loglevel,
+    targets,
+    queries,
+    output_dir,
+    suffix,
+    counts,
+    minscore,
+    rules,
+    rc,
+    trie,
+    score,
+    status,
+    budget,
+    threads,
+    progress,
+):  # pragma: no cover
+    """
+    Align several samples against one library, sequences shared between samples are aligned once
+    """
+    _log_setup(loglevel)
+    from pygas.main import multi as pygas_multi
+
+    pygas_multi(
+        targets,
+        list(queries),
+        output_dir,
+        counts,
+        minscore,
+        rules,
+        rc,
+        use_trie=trie,
+        with_score=score,
+        with_status=status,
+        budget=budget,
+        suffix=suffix,
+        progress_interval=progress,
+        threads=threads,
+    )
@@ -35,3 +35,9 @@ Have not determined how to use cython for contants
 GAP = -1
 MATCH = 1
 MISMATCH = 0
+
+# matrix stage candidate search of a query length, see pygas.planner
+STRATEGY_TRIE = "trie"
+STRATEGY_SCAN = "scan"
+# no matrix stage, exact/substring lookup only
+STRATEGY_EXACT = "exact"
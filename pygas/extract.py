@@ -0,0 +1,317 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass
+import re
+from typing import Dict, Iterator, List, TextIO, Tuple
+
+from pygas.alignercpu import AlignerCpu
+from pygas.classes import Backtrack, ExtractBatch, GuideHit
+from pygas.library import TargetLibrary
+from pygas.matrix import revcomp
+from pygas.window import WindowIndex
+
+GUIDE_HEADER = ["#read", "reversed", "t_id", "offset", "cigar", "md", "repeat_2-6..."]
+CIGAR_OP = re.compile(r"(\d+)([MIDS])")
+
+
+@dataclass
+class GuideExtractor:
+    """
+    Find guides within reads longer than them, e.g. amplicons with vector backbone either side of the guide.
+
+    Every window of each target length is looked up on both strands in a WindowIndex, reads holding an exact copy
+    of a guide never fill a matrix.  Reads without one are aligned (match_type 3, using rules and score_min) only
+    over the region next to an anchor:
+
+    flank_5, flank_3:
+        Backbone sequence immediately before/after the guide, found by exact search on both strands of the read
+        (forward only when rev_comp is False).  The region runs from the end of flank_5 to the start of flank_3, or
+        for the longest target length when only one of them is found.
+
+    anchor:
+        0-based position of the guide in the read, used when neither flank is given or found, -1 for none.
+
+    slack:
+        Bases the region is widened by at each end, allowing for indels in the backbone.
+
+    Reads with no exact hit and no anchor are unmapped.  targets may be a TargetLibrary shared with other aligners,
+    later changes to it are not seen by the extractor.
+    """
+
+    targets: List[str]
+    rules: List[str]
+    score_min: int
+    rev_comp: bool = True
+    flank_5: str = ""
+    flank_3: str = ""
+    anchor: int = -1
+    slack: int = 2
+    use_trie: bool = True
+
+    def __post_init__(self):
+        if self.slack < 0:
+            raise ValueError(f"slack must be >= 0: {self.slack}")
+        self.library = (
+            self.targets if isinstance(self.targets, TargetLibrary) else TargetLibrary(self.targets, self.use_trie)
+        )
+        self.targets = self.library.targets
+        self.index = WindowIndex(self.targets)
+        # flank regions are already oriented, an anchor region may hold the guide on either strand
+        (self._oriented, self._anchored) = [
+            AlignerCpu(
+                targets=self.library,
+                rules=self.rules,
+                score_min=self.score_min,
+                rev_comp=rev_comp,
+                match_type=3,
+            )
+            for rev_comp in (False, self.rev_comp)
+        ]
+
+    def extract(self, reads: List[str]) -> ExtractBatch:
+        """
+        Reads are reported unmapped first then mapped, each in input order.
+        """
+        (found, regions) = self._scan(reads)
+        fuzzy = self._align_regions(regions)
+        for (read, hits) in fuzzy.items():
+            found[read] = _best_hits(hits)
+
+        unmapped = [read for read in reads if read not in found]
+        mapped = [found[read] for read in reads if read in found]
+        exact = sum(1 for read in reads if read in found and read not in fuzzy)
+        return ExtractBatch(unmapped=unmapped, mapped=mapped, exact=exact)
+
+    def _scan(self, reads: List[str]) -> Tuple[Dict[str, List[GuideHit]], Dict[Tuple[str, bool], list]]:
+        """
+        Exact hits of each distinct read, and the regions to align for reads without one keyed by (region, anchored).
+        """
+        found = {}
+        regions = {}
+        for read in dict.fromkeys(reads):
+            hits = self._exact_hits(read)
+            if hits:
+                found[read] = hits
+                continue
+            for (region, start, rc_read, anchored) in self._regions(read):
+                regions.setdefault((region, anchored), []).append((read, start, rc_read))
+        return found, regions
+
+    def _align_regions(self, regions: Dict[Tuple[str, bool], list]) -> Dict[str, List[GuideHit]]:
+        """
+        Align each distinct region once, hits are reported against every read the region came from.
+        """
+        fuzzy = {}
+        for anchored in (False, True):
+            queries = [region for (region, is_anchored) in regions if is_anchored == anchored]
+            if not queries:
+                continue
+            aligner = self._anchored if anchored else self._oriented
+            for results in aligner.align_queries(queries, keep_matrix=False).mapped:
+                region = results[0].sm.original_seq
+                for (read, start, rc_read) in regions[(region, anchored)]:
+                    hits = fuzzy.setdefault(read, [])
+                    hits.extend(_region_hit(bt, read, start, rc_read) for bt in results)
+        return fuzzy
+
+    def _exact_hits(self, read: str) -> List[GuideHit]:
+        hits = [
+            GuideHit(
+                read=read,
+                t_id=t_id,
+                offset=offset,
+                reversed=rev,
+                score=len(self.targets[t_id]),
+                cigar=f"{len(self.targets[t_id])}M",
+                md=str(len(self.targets[t_id])),
+            )
+            for (t_id, offset, rev) in self.index.scan(read, self.rev_comp)
+        ]
+        hits = [hit for hit in hits if hit.score >= self.score_min]
+        if not hits:
+            return hits
+        best = max(hit.score for hit in hits)
+        return [hit for hit in hits if hit.score == best]
+
+    def _regions(self, read: str) -> Iterator[Tuple[str, int, bool, bool]]:
+        """
+        (region, start, rc_read, anchored), region starts at start of read, or of its reverse complement when
+        rc_read.
+        """
+        max_len = self.library.max_length
+        found_flank = False
+        if self.flank_5 or self.flank_3:
+            strands = [(read, False)] + ([(revcomp(read), True)] if self.rev_comp else [])
+            for (seq, rc_read) in strands:
+                span = _flank_span(seq, self.flank_5, self.flank_3, max_len)
+                if span is None:
+                    continue
+                found_flank = True
+                start = max(0, span[0] - self.slack)
+                yield seq[start : span[1] + self.slack], start, rc_read, False
+        if not found_flank and self.anchor >= 0:
+            start = max(0, self.anchor - self.slack)
+            yield read[start : self.anchor + max_len + self.slack], start, False, True
+
+
+def _flank_span(seq: str, flank_5: str, flank_3: str, max_len: int):
+    """
+    (start, end) between the flanks in seq, None when neither is found.
+    """
+    p_5 = seq.find(flank_5) if flank_5 else -1
+    start = p_5 + len(flank_5) if p_5 >= 0 else -1
+    p_3 = seq.find(flank_3, max(start, 0)) if flank_3 else -1
+    if start >= 0:
+        return start, p_3 if p_3 >= 0 else start + max_len
+    if p_3 >= 0:
+        return max(0, p_3 - max_len), p_3
+    return None
+
+
+def _best_hits(hits: List[GuideHit]) -> List[GuideHit]:
+    """
+    Hits at the best score, one per (t_id, offset, reversed).
+    """
+    best = max(hit.score for hit in hits)
+    return list({(h.t_id, h.offset, h.reversed): h for h in hits if h.score == best}.values())
+
+
+def _region_hit(bt: Backtrack, read: str, start: int, rc_read: bool) -> GuideHit:
+    """
+    Hit against read of an alignment to a region of it, offset is where the guide starts including guide bases left
+    unaligned at either end (t_pos and the target bases after the alignment).  cigar and md cover the guide bases in
+    the read, region soft-clips are dropped.  Gaps at the ends of an alignment are ambiguous in backtrack, a guide
+    length window scoring as well as the alignment is reported ungapped.
+    """
+    target = bt.sm.target
+    t_len = len(target)
+    ops = [(int(n), op) for (n, op) in CIGAR_OP.findall(bt.cigar)]
+    clip_5 = ops.pop(0)[0] if ops[0][1] == "S" else 0
+    clip_3 = ops.pop()[0] if ops[-1][1] == "S" else 0
+    lead = bt.t_pos - 1
+    trail = t_len - lead - sum(n for (n, op) in ops if op in "MD")
+    (clip_5, lead) = _absorb_end_gap(ops, clip_5, lead)
+    ops.reverse()
+    (clip_3, trail) = _absorb_end_gap(ops, clip_3, trail)
+    ops.reverse()
+    # read in the orientation of the aligned query, and the position of the region in it
+    flipped = bt.sm.reversed != rc_read
+    aligned = revcomp(read) if flipped else read
+    base = len(read) - start - len(bt.sm.query) if bt.sm.reversed else start
+    g_start = base + clip_5 - lead
+    g_end = base + len(bt.sm.query) - clip_3 + trail
+
+    for w_start in dict.fromkeys((g_start, g_end - t_len)):
+        if 0 <= w_start <= len(aligned) - t_len:
+            matches = sum(a == b for (a, b) in zip(aligned[w_start : w_start + t_len], target))
+            if matches >= bt.sm.score:
+                (g_start, g_end, t_start, ops) = (w_start, w_start + t_len, 0, [(t_len, "M")])
+                break
+    else:
+        # guide bases beyond the read can't be reported
+        t_start = max(0, -g_start)
+        (lead, trail) = (lead - t_start, trail - max(0, g_end - len(aligned)))
+        (g_start, g_end) = (max(0, g_start), min(len(aligned), g_end))
+        ops = [(lead, "M")] + ops + [(trail, "M")]
+    return GuideHit(
+        read=read,
+        t_id=bt.sm.target_id,
+        offset=len(read) - g_end if flipped else g_start,
+        reversed=flipped,
+        score=bt.sm.score,
+        cigar="".join(f"{n}{op}" for (n, op) in _merge_ops(ops)),
+        md=_columns_md(aligned[g_start:g_end], target[t_start:], ops),
+    )
+
+
+def _absorb_end_gap(ops: List[Tuple[int, str]], clip: int, unaligned: int) -> Tuple[int, int]:
+    """
+    Moves an insertion at the start of ops (alone, or after matches no longer than it) into clip, the guide bases
+    it displaces become unaligned.  Pairing those guide bases with the inserted bases scores at least as well.
+    """
+    if len(ops) > 1 and ops[0][1] == "M" and ops[1][1] == "I" and ops[1][0] >= ops[0][0]:
+        (n, _) = ops.pop(0)
+        clip += n
+        unaligned += n
+    if ops and ops[0][1] == "I" and unaligned > 0:
+        clip += ops.pop(0)[0]
+    return clip, unaligned
+
+
+def _merge_ops(ops: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    merged = []
+    for (n, op) in ops:
+        if n == 0:
+            continue
+        if merged and merged[-1][1] == op:
+            merged[-1] = (merged[-1][0] + n, op)
+        else:
+            merged.append((n, op))
+    return merged
+
+
+def _columns_md(seq: str, target: str, ops: List[Tuple[int, str]]) -> str:
+    """
+    MD of seq aligned to target from their first bases as described by ops.
+    """
+    md = ""
+    run = 0
+    (s_pos, t_pos) = (0, 0)
+    for (n, op) in ops:
+        if op == "I":
+            s_pos += n
+        elif op == "D":
+            md += f"{run}^{target[t_pos : t_pos + n]}"
+            (run, t_pos) = (0, t_pos + n)
+        else:
+            for _ in range(n):
+                if seq[s_pos] == target[t_pos]:
+                    run += 1
+                else:
+                    md += f"{run}{target[t_pos]}"
+                    run = 0
+                (s_pos, t_pos) = (s_pos + 1, t_pos + 1)
+    return md + str(run)
+
+
+def write_guides(eb: ExtractBatch, ofh: TextIO, with_score=False):
+    """
+    One line per read, unmapped reads have "." as reversed.  with_score adds the score after read.
+    """
+    header = GUIDE_HEADER[:1] + (["score"] if with_score else []) + GUIDE_HEADER[1:]
+    lines = ["\t".join(header)]
+    for read in eb.unmapped:
+        lines.append("\t".join([read] + (["."] if with_score else []) + ["."]))
+    for hits in eb.mapped:
+        cols = [hits[0].read] + ([str(hits[0].score)] if with_score else [])
+        for hit in hits:
+            cols.extend([str(hit.reversed), str(hit.t_id), str(hit.offset), hit.cigar, hit.md])
+        lines.append("\t".join(cols))
+    ofh.write("\n".join(lines) + "\n")
@@ -0,0 +1,216 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from itertools import combinations, product
+from typing import Dict, Iterator, List, Tuple
+from pygas.packed import PackedTargets
+from pygas.trie import TargetTrie
+
+BASES = "ACGT"
+
+
+def substitution_neighbours(seq: str, radius: int) -> Iterator[Tuple[str, int]]:
+    """
+    Sequences with up to radius ACGT substitutions, with the number made, starting with seq itself.
+    """
+    yield seq, 0
+    for n_subs in range(1, radius + 1):
+        for positions in combinations(range(len(seq)), n_subs):
+            choices = [[b for b in BASES if b != seq[pos]] for pos in positions]
+            for bases in product(*choices):
+                chars = list(seq)
+                for (pos, base) in zip(positions, bases):
+                    chars[pos] = base
+                yield "".join(chars), n_subs
+
+
+@dataclass
+class TargetLibrary:
+    """
+    Lookup structures over the targets used by map_queries, t_id is the index of a target in targets.
+
+    Sequences are held 2-bit packed in a PackedTargets, which also provides exact lookup.  Targets can be added and
+    retired without rebuilding.  A retired target reads as None in targets so that the t_id of every other target is
+    stable.  Active targets are also partitioned by length (length_buckets) so the matrix stage can pass over every
+    target of a length at once.
+
+    use_trie:
+        Maintain a TargetTrie over the targets.
+
+    cluster_radius:
+        Group targets within this many substitutions of a cluster center (greedy, in t_id order).  The matrix stage
+        aligns a query to the center first, its score plus the cluster radius bounds the score of every member so a
+        whole cluster that can't change the result is skipped.  Building costs a lookup per neighbour, (3 x length) ^
+        radius per target, 0 disables.
+    """
+
+    targets: List[str]
+    use_trie: bool = True
+    cluster_radius: int = 0
+
+    def __post_init__(self):
+        seqs = self.targets
+        self.targets = PackedTargets()
+        self._buckets = {}
+        self.trie = TargetTrie() if self.use_trie else None
+        # per t_id: center t_id of its cluster, and for centers the member count and largest distance of a member
+        self.cluster_of = array("i")
+        self.cluster_size = array("i")
+        self.cluster_radii = array("i")
+        self.add(seqs)
+
+    def __getstate__(self):
+        # the trie is rebuilt on unpickling
+        state = self.__dict__.copy()
+        state["trie"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.use_trie:
+            self.trie = TargetTrie()
+            for t_id, target in enumerate(self.targets):
+                if target is not None:
+                    self.trie.add(target, t_id)
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    @property
+    def min_length(self) -> int:
+        if not self._buckets:
+            return -1
+        return min(self._buckets)
+
+    @property
+    def max_length(self) -> int:
+        if not self._buckets:
+            return -1
+        return max(self._buckets)
+
+    @property
+    def length_counts(self) -> Dict[int, int]:
+        """
+        Active targets of each length, ascending.
+        """
+        return {t_len: len(self._buckets[t_len]) for t_len in sorted(self._buckets)}
+
+    @property
+    def length_buckets(self) -> Dict[int, array]:
+        """
+        t_id of the active targets of each length, ascending t_id.  These are the library's own arrays, don't modify.
+        """
+        return self._buckets
+
+    @property
+    def mixed_lengths(self) -> bool:
+        """
+        Targets are not all the same length, substring matching is required for every query.
+        """
+        return len(self._buckets) > 1
+
+    def add(self, targets: List[str]) -> List[int]:
+        """
+        Add targets, returns the t_id assigned to each.
+        """
+        t_ids = []
+        for target in targets:
+            t_id = self.targets.append(target)
+            t_len = len(target)
+            if t_len not in self._buckets:
+                self._buckets[t_len] = array("i")
+            self._buckets[t_len].append(t_id)  # t_id only increases, buckets stay sorted
+            if self.trie is not None:
+                self.trie.add(target, t_id)
+            self._cluster_add(target, t_id)
+            t_ids.append(t_id)
+        return t_ids
+
+    def remove(self, t_ids: List[int]):
+        """
+        Retire targets by t_id, the ids are not reused.
+        """
+        for t_id in t_ids:
+            if t_id < 0 or t_id >= len(self.targets) or self.targets[t_id] is None:
+                raise ValueError(f"t_id {t_id} is not an active target")
+            target = self.targets[t_id]
+            t_len = len(target)
+            self.targets.remove(t_id)
+            bucket = self._buckets[t_len]
+            del bucket[bisect_left(bucket, t_id)]
+            if not bucket:
+                del self._buckets[t_len]
+            if self.trie is not None:
+                self.trie.remove(target, t_id)
+            self._cluster_remove(t_id)
+
+    def drop_trie(self):
+        """
+        Free the trie, later changes no longer maintain one.
+        """
+        self.use_trie = False
+        self.trie = None
+
+    @property
+    def n_clusters(self) -> int:
+        """
+        Clusters with more than one active member.
+        """
+        return sum(1 for (t_id, center) in enumerate(self.cluster_of) if t_id == center and self.cluster_size[t_id] > 1)
+
+    def _cluster_add(self, target: str, t_id: int):
+        center = t_id
+        distance = 0
+        if self.cluster_radius > 0:
+            for (seq, n_subs) in substitution_neighbours(target, self.cluster_radius):
+                found = [c_id for c_id in self.targets.find(seq) if c_id != t_id and self.cluster_of[c_id] == c_id]
+                if found:
+                    (center, distance) = (found[0], n_subs)
+                    break
+        self.cluster_of.append(center)
+        self.cluster_size.append(1)
+        self.cluster_radii.append(0)
+        if center != t_id:
+            self.cluster_size[center] += 1
+            self.cluster_radii[center] = max(self.cluster_radii[center], distance)
+
+    def _cluster_remove(self, t_id: int):
+        center = self.cluster_of[t_id]
+        self.cluster_size[center] -= 1
+        if center == t_id and self.cluster_size[t_id] > 0:
+            # members become their own centers, the bound needs the center sequence
+            for m_id in range(len(self.cluster_of)):
+                if self.cluster_of[m_id] == t_id and m_id != t_id:
+                    self.cluster_of[m_id] = m_id
+                    self.cluster_size[m_id] = 1
+                    self.cluster_radii[m_id] = 0
+            self.cluster_size[t_id] = 0
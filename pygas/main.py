@@ -27,72 +27,358 @@
 # statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
 # identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
 # 2009, 2010, 2011, 2012’.
-from typing import List
-import gzip
+import json
+import logging
 import sys
 
 from pygas.alignercpu import AlignerCpu
-from pygas.classes import Backtrack
+from pygas.progress import Progress, format_report
+from pygas.results import batch_rows, merge_rows, read_rows, write_rows
+from pygas.seqio import SeqReader, load_seqs, open_output
+from pygas.store import STORE_SUFFIX, ResultStore, write_store
 
+# modules only needed by one command are imported in that function, keeping start up of pygas run short
 
-def _simple_seq_load(ifile: str) -> List[str]:  # pragma: no cover
-    try:
-        with gzip.open(ifile, "rt") as i_fh:
-            lines = i_fh.readlines()
-    except gzip.BadGzipFile:
-        with open(ifile, "rt") as i_fh:
-            lines = i_fh.readlines()
-    lines = [x.strip() for x in lines]
-    return lines
 
-
-def run(targets, queries, output, minscore, rules, allow_rev_comp):  # pragma: no cover
-    target_seqs = _simple_seq_load(targets)
-    query_seqs = _simple_seq_load(queries)
+def run(
+    targets,
+    queries,
+    output,
+    minscore,
+    rules,
+    allow_rev_comp,
+    use_trie=True,
+    t_offset=0,
+    with_score=False,
+    progress_interval=60.0,
+    metrics=None,
+    budget=0,
+    with_status=False,
+    threads=1,
+    checkpoint=0,
+    resume=False,
+    cluster_radius=0,
+    auto_plan=False,
+    max_memory=None,
+):  # pragma: no cover
+    store = _is_store(output, max_memory, checkpoint)
+    query_reader = SeqReader(queries, threads=threads)  # read ahead while the targets are indexed
+    target_seqs = load_seqs(targets, threads=threads)
     a = AlignerCpu(
         targets=target_seqs,
         rules=rules,
         score_min=minscore,
         rev_comp=allow_rev_comp,
+        use_trie=use_trie,
+        cluster_radius=cluster_radius,
+        t_offset=t_offset,
+        budget=budget,
+        auto_plan=auto_plan,
+    )
+    if a.engine_plan:
+        for line in a.engine_plan.describe():
+            logging.info(f"Plan: {line}")
+    spill = _spill_run(a, max_memory, with_score, with_status) if max_memory else None
+    query_seqs = query_reader if spill else list(query_reader)  # streamed when spilling, only a chunk is held
+    ckpt = None
+    if checkpoint:
+        settings = {
+            "minscore": minscore,
+            "rules": rules,
+            "rc": allow_rev_comp,
+            "t_offset": t_offset,
+            "budget": budget,
+        }
+        ckpt = _checkpoint_run(a, query_seqs, output, checkpoint, resume, settings)
+    progress = Progress(
+        total=ckpt.remaining if ckpt else None if spill else len(query_seqs),
+        interval=progress_interval,
+        callback=(lambda report: logging.info(format_report(report))) if progress_interval > 0 else None,
+    )
+    if ckpt:
+        ckpt.run(progress=progress)
+        rows = ckpt.rows()
+        n_exceeded = ckpt.budget_exceeded
+    elif spill:
+        n_exceeded = _write_spilled(spill, query_seqs, progress, output, threads)
+    else:
+        ab = a.align_queries(query_seqs, progress=progress)
+        rows = batch_rows(ab)
+        n_exceeded = len(ab.budget_exceeded)
+    if store:
+        write_store(rows, output)
+    elif not spill:
+        ofh = open_output(output, threads=threads)
+        write_rows(rows, ofh, with_score=with_score, with_status=with_status)
+        if ofh is not sys.stdout:
+            ofh.close()
+    if ckpt:
+        ckpt.remove()
+
+    report = progress.finish()
+    if n_exceeded:
+        logging.warning(f"{n_exceeded} queries exceeded the budget of {budget} DP cells")
+    if metrics:
+        with open(metrics, "w") as mfh:
+            json.dump(report, mfh, indent=2)
+
+
+def _is_store(output, max_memory, checkpoint) -> bool:
+    """
+    Checks the output options of run can be combined, returns True when output is a binary result store.
+    """
+    if max_memory and checkpoint:
+        raise ValueError("--max-memory can't be used with --checkpoint")
+    store = bool(output) and output.endswith(STORE_SUFFIX)
+    if max_memory and store:
+        raise ValueError(f"--max-memory writes TSV, it can't be used with a {STORE_SUFFIX} output")
+    return store
+
+
+def _spill_run(a: AlignerCpu, max_memory: str, with_score: bool, with_status: bool):
+    from pygas.spill import SpillRun, parse_size
+
+    return SpillRun(a, parse_size(max_memory), with_score=with_score, with_status=with_status)
+
+
+def _write_spilled(spill, query_seqs, progress: Progress, output, threads: int) -> int:
+    """
+    Align with spilling and write the output, returns the number of queries that exceeded the budget.
+    """
+    spill.run(query_seqs, progress=progress)
+    ofh = open_output(output, threads=threads)
+    spill.write(ofh)
+    logging.info(f"Spilled rows to disk {spill.spills} times")
+    spill.close()
+    if ofh is not sys.stdout:
+        ofh.close()
+    return spill.budget_exceeded
+
+
+def _checkpoint_run(a: AlignerCpu, query_seqs, output, chunk_size: int, resume: bool, settings: dict):
+    from pygas.checkpoint import CheckpointRun
+
+    if not output:
+        raise ValueError("--checkpoint requires --output")
+    ckpt = CheckpointRun(a, query_seqs, f"{output}.ckpt", chunk_size=chunk_size, settings=settings, resume=resume)
+    if ckpt.completed:
+        logging.info(f"Resuming after {ckpt.completed} of {ckpt.n_chunks} chunks")
+    return ckpt
+
+
+def multi(
+    targets,
+    queries,
+    output_dir,
+    counts,
+    minscore,
+    rules,
+    allow_rev_comp,
+    use_trie=True,
+    with_score=False,
+    with_status=False,
+    budget=0,
+    suffix=".tsv",
+    progress_interval=60.0,
+    threads=1,
+):  # pragma: no cover
+    import os
+    from pygas.samples import MultiSampleRun, sample_name
+
+    names = [sample_name(path) for path in queries]
+    repeated = sorted({name for name in names if names.count(name) > 1})
+    if repeated:
+        raise ValueError(f"Query files give the same sample name: {', '.join(repeated)}")
+    a = AlignerCpu(
+        targets=load_seqs(targets, threads=threads),
+        rules=rules,
+        score_min=minscore,
+        rev_comp=allow_rev_comp,
+        use_trie=use_trie,
+        budget=budget,
+    )
+    msr = MultiSampleRun(a, {name: load_seqs(path, threads=threads) for (name, path) in zip(names, queries)})
+    logging.info(f"{len(msr.distinct)} distinct sequences in {msr.n_queries} queries from {len(names)} samples")
+    progress = Progress(
+        total=len(msr.distinct),
+        interval=progress_interval,
+        callback=(lambda report: logging.info(format_report(report))) if progress_interval > 0 else None,
+    )
+    msr.align(progress=progress)
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        for name in names:
+            with open_output(os.path.join(output_dir, name + suffix), threads=threads) as ofh:
+                msr.write(name, ofh, with_score=with_score, with_status=with_status)
+    if counts or not output_dir:
+        ofh = open_output(counts, threads=threads)
+        msr.write_counts(ofh, with_score=with_score, with_status=with_status)
+        if ofh is not sys.stdout:
+            ofh.close()
+    progress.finish()
+
+
+def merge(queries, shards, output, with_score=False, with_status=False, threads=1):  # pragma: no cover
+    query_seqs = load_seqs(queries, threads=threads)
+    rows = merge_rows(query_seqs, [read_rows(shard) for shard in shards])
+    ofh = open_output(output, threads=threads)
+    write_rows(rows, ofh, with_score=with_score, with_status=with_status)
+
+    if ofh is not sys.stdout:
+        ofh.close()
+
+
+def convert(store, output, with_score=False, with_status=False, threads=1):  # pragma: no cover
+    with ResultStore(store) as rs:
+        ofh = open_output(output, threads=threads)
+        write_rows(rs.rows(), ofh, with_score=with_score, with_status=with_status)
+
+    if ofh is not sys.stdout:
+        ofh.close()
+
+
+def benchmark(baseline, record, repeat, scale, time_tolerance, mem_tolerance) -> bool:  # pragma: no cover
+    """
+    Returns True when a stage regressed against the baseline or CLI start up exceeded its fixed budget.
+    """
+    from pygas.benchmark import (
+        check_startup,
+        compare,
+        format_table,
+        load_baseline,
+        run_benchmarks,
+        save_baseline,
+        startup_times,
+    )
+
+    current = run_benchmarks(repeat=repeat, scale=scale)
+    if record:
+        save_baseline(baseline, current, scale)
+        logging.info(f"Baseline written to {baseline}")
+        rows, regressed = compare(current, current)
+    else:
+        base = load_baseline(baseline)
+        if base["scale"] != scale:
+            raise ValueError(f"Baseline was recorded with --scale {base['scale']}")
+        rows, regressed = compare(base["stages"], current, time_tolerance=time_tolerance, mem_tolerance=mem_tolerance)
+    print(format_table(rows))
+    if regressed:
+        logging.error("Performance regressed against baseline")
+    rows, slow_startup = check_startup(startup_times(repeat=repeat))
+    print()
+    print(format_table(rows))
+    if slow_startup:
+        logging.error("Start up exceeded its budget")
+    return regressed or slow_startup
+
+
+def simulate(
+    prefix,
+    n_targets,
+    lengths,
+    n_prefixes,
+    prefix_length,
+    n_reads,
+    substitution_rate,
+    insertion_rate,
+    deletion_rate,
+    revcomp_rate,
+    duplicate_rate,
+    noise_rate,
+    seed,
+):  # pragma: no cover
+    from pygas.simulate import LibrarySpec, ReadSpec, parse_lengths, write_truth
+
+    targets = LibrarySpec(
+        n_targets=n_targets,
+        lengths=parse_lengths(lengths),
+        n_prefixes=n_prefixes,
+        prefix_length=prefix_length,
+        seed=seed,
+    ).generate()
+    with open(f"{prefix}.targets.txt", "w") as t_fh:
+        for target in targets:
+            print(target, file=t_fh)
+    reads = ReadSpec(
+        n_reads=n_reads,
+        substitution_rate=substitution_rate,
+        insertion_rate=insertion_rate,
+        deletion_rate=deletion_rate,
+        revcomp_rate=revcomp_rate,
+        duplicate_rate=duplicate_rate,
+        noise_rate=noise_rate,
+        seed=seed + 1,
+    )
+    with open(f"{prefix}.queries.txt", "w") as q_fh, open(f"{prefix}.truth.tsv", "w") as truth_fh:
+        write_truth(reads.generate(targets), q_fh, truth_fh)
+    logging.info(f"Wrote {prefix}.targets.txt, {prefix}.queries.txt and {prefix}.truth.tsv")
+
+
+def serve(libraries, socket=None, use_trie=True):  # pragma: no cover
+    import asyncio
+    from pygas.server import AlignmentServer, parse_library_spec
+
+    loaded = {}
+    for spec in libraries:
+        name, path = parse_library_spec(spec)
+        if name in loaded:
+            raise ValueError(f"Library name '{name}' is used more than once")
+        loaded[name] = load_seqs(path)
+        logging.info(f"Loaded library {name}: {len(loaded[name])} targets")
+    server = AlignmentServer(loaded, use_trie=use_trie)
+    if socket:
+        asyncio.run(server.serve_unix(socket))
+    else:
+        server.serve_stream(sys.stdin, sys.stdout)
+    logging.info(f"Served {server.jobs} jobs")
+
+
+def pair(
+    targets_1, targets_2, pairs, queries, output, minscore, rules, allow_rev_comp, split=0, with_score=False, threads=1
+):  # pragma: no cover
+    from pygas.paired import PairedAligner, load_pairs, split_read, write_pairs
+
+    query_reader = SeqReader(queries, threads=threads)
+    pa = PairedAligner(
+        targets_1=load_seqs(targets_1, threads=threads),
+        targets_2=load_seqs(targets_2, threads=threads),
+        rules=rules,
+        score_min=minscore,
+        rev_comp=allow_rev_comp,
+        pairs=load_pairs(pairs) if pairs else None,
     )
-    ab = a.align_queries(query_seqs)
-    ofh = open(output, "w") if output else sys.stdout
-    print(
-        "\t".join(
-            [
-                "#query",
-                "reversed",
-                "t_id",
-                "t_pos",
-                "seq",
-                "cigar",
-                "md",
-                "repeat_2-7...",
-            ]
-        ),
-        file=ofh,
+    reads = [split_read(read, split) for read in query_reader if read]
+    pb = pa.align_pairs(reads)
+    ofh = open_output(output, threads=threads)
+    write_pairs(pb, ofh, with_score=with_score)
+
+    if ofh is not sys.stdout:
+        ofh.close()
+    logging.info(f"{len(pb.mapped)} of {len(reads)} reads mapped to a pair")
+
+
+def extract(
+    targets, queries, output, minscore, rules, allow_rev_comp, flank_5="", flank_3="", anchor=-1, slack=2, threads=1
+):  # pragma: no cover
+    from pygas.extract import GuideExtractor, write_guides
+
+    query_reader = SeqReader(queries, threads=threads)
+    ge = GuideExtractor(
+        targets=load_seqs(targets, threads=threads),
+        rules=rules,
+        score_min=minscore,
+        rev_comp=allow_rev_comp,
+        flank_5=flank_5,
+        flank_3=flank_3,
+        anchor=anchor,
+        slack=slack,
     )
-    for unmapped_seq in ab.unmapped:
-        print(f"{unmapped_seq}\t.\t.\t.\t.", file=ofh)
-    for results in ab.mapped:
-        # get max score
-        max_score = max([bt.sm.score for bt in results])
-
-        res_ele = [results[0].sm.original_seq]
-        for bt in results:
-            sm = bt.sm
-            if sm.score == max_score:
-                res_ele.extend(
-                    [
-                        str(sm.reversed),
-                        str(sm.target_id),
-                        str(bt.t_pos),
-                        sm.query,
-                        bt.cigar,
-                        bt.md,
-                    ]
-                )
-        print("\t".join(res_ele), file=ofh)
+    reads = [read for read in query_reader if read]
+    eb = ge.extract(reads)
+    ofh = open_output(output, threads=threads)
+    write_guides(eb, ofh, with_score=True)
 
     if ofh is not sys.stdout:
         ofh.close()
+    logging.info(f"{len(eb.mapped)} of {len(reads)} reads hold a guide, {eb.exact} by exact window lookup")
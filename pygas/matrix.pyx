@@ -27,13 +27,31 @@
 # statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
 # identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
 # 2009, 2010, 2011, 2012’.
+from libc.stdlib cimport malloc, calloc, free
+from libc.string cimport memset
 from typing import List, Tuple
+from pygas.packed cimport PackedTargets, base_counts, encode_seq
 from pygas.classes import ScoreMatrix, Backtrack, AlignmentBatch
+from pygas.library import TargetLibrary
+from pygas.constants import STRATEGY_SCAN
 
 cdef int GAP = -1
 cdef int MATCH = 1
 cdef int MISMATCH = 0
 
+cdef struct QueryBudget:
+    long long cells  # DP cells computed for the query so far
+    long long limit  # 0 for no limit
+    bint exceeded
+
+
+cdef inline bint _over_budget(QueryBudget *budget):
+    if budget.limit > 0 and budget.cells >= budget.limit:
+        budget.exceeded = True
+        return True
+    return False
+
+
 REVCOMP_TABLE = ''.maketrans({"A":"T", "C":"G", "G":"C", "T":"A"})
 
 def revcomp(str seq) -> str:
@@ -41,7 +59,7 @@ def revcomp(str seq) -> str:
     return rev_seq.translate(REVCOMP_TABLE)
 
 def map_queries(
-    targets: List[str],
+    targets,
     queries: List[str],
     int penalty_max,
     int hard_min,
@@ -49,173 +67,454 @@ def map_queries(
     do_revcomp=True,
     exact_only=False,
     match_type: int=0,
+    long long budget=0,
+    dict strategies=None,
 ) -> AlignmentBatch:
     """
     max_penalty is applied on a per-read basis
     if it is below hard_min then a warning is emitted and the item is not sent for alignment.
+
+    targets is a list of target sequences (t_id = list index) or a TargetLibrary.  The library is built for the call
+    when a list is given, when the library has a trie only targets that can reach the lowest possible min_score are
+    passed to fill() during the matrix stage.
+
+    Queries are processed grouped by length, in sequence order.  Decisions that only depend on query length are made
+    once per group, identical queries are aligned once and trie searches are batched so that queries with a common
+    prefix share matrix columns.  Results are reported in input order.  In the matrix stage targets are visited a
+    length at a time (TargetLibrary.length_buckets), lengths that can score highest first so best_score rises early
+    and whole lengths are passed over once they can't change the result.
+
+    Targets are unpacked from 2-bit storage to integer codes for fill(), the str of a target is only decoded for a
+    reported hit.
+
+    budget limits the DP cells computed for each query (0 for no limit).  Once reached no further targets are aligned
+    for the query, it is listed in budget_exceeded of the result and reported with the best hits found so far.  Only
+    fill() cells are counted: the direct/substring scan and the trie search (batched, its columns are shared between
+    queries) are not charged to any query.
+
+    strategies chooses how matrix stage candidates are found for a query length (see pygas.planner): STRATEGY_TRIE
+    searches the trie, STRATEGY_SCAN visits every target with the composition and cluster bounds.  Lengths not given
+    use the trie when the library has one.  Results are the same either way.
     """
-    cdef str query, target, rev_query
-    cdef int t_idx, q_len, t_len, min_score, max_score, max_t_len
-    cdef dict targets_by_seq = {}
-    cdef list target_lengths = []
+    cdef str query, rev_query
+    cdef int q_idx, first_idx, q_len, max_t_len, min_t_len, threshold, q_penalty_score, best_score
     cdef list unmapped = []
     cdef list mapped = []
+    cdef list results = [None] * len(queries)  # best scoring ScoreMatrix objects of each query, None for unmapped
+    cdef dict dups = {}
+    cdef set exceeded = set()  # q_idx that ran out of budget
+    cdef QueryBudget q_budget
+    cdef list order, group, pending, group_buckets, buckets
+    cdef dict by_length
+    cdef bint do_substr, lib_substr, group_trie
+    cdef int *q_codes
+    cdef int *r_codes
+    cdef int *t_codes
+    cdef int q_counts[5]
+    cdef int r_counts[5]
+    cdef int[:] cluster_of = None
+    cdef int[:] cluster_size = None
+    cdef int[:] cluster_radii = None
 
-    max_t_len = -1
+    if not isinstance(targets, TargetLibrary):
+        targets = TargetLibrary(targets, use_trie=False)
+    trie = targets.trie
+    cdef PackedTargets target_seqs = targets.targets
+    max_t_len = targets.max_length
+    min_t_len = targets.min_length
+    length_buckets = targets.length_buckets
+    lib_substr = targets.mixed_lengths
+    if targets.cluster_radius > 0:
+        cluster_of = targets.cluster_of
+        cluster_size = targets.cluster_size
+        cluster_radii = targets.cluster_radii
 
-    do_substr = False
-    for t_idx, target in enumerate(targets):
-        target_lengths.append(len(target))
-        if target in targets_by_seq:
-            targets_by_seq[target].append(t_idx)
-        else:
-            targets_by_seq[target] = [t_idx]
-            t_len = len(target)
-            if t_len > max_t_len:
-                if max_t_len != -1:
-                    do_substr = True
-                max_t_len = t_len
-
-    for query in queries:
-        q_len = len(query)
-        if q_len < hard_min:
-            unmapped.append(query)
-            continue
-        q_penalty_score = q_len - penalty_max
-        if q_len != max_t_len:
-            do_substr = True
-
-        if do_revcomp:
-            rev_query = revcomp(query)
-
-        result = []  # store the best scoring results we see
-        best_score = 0
-
-        if do_substr and match_type != 0:  # try substr
-            for t_idx, target in enumerate(targets):
-                if ((match_type & 1) == 1 and query in target) or ((match_type & 2) == 2 and target in query):
-                    t_len = target_lengths[t_idx]
-                    # use matrix to build the bits we need quickly
-                    min_score = max(hard_min, best_score, min(t_len - penalty_max, q_penalty_score))
-                    (matrix, max_score) = fill(target, query, min_score)
-                    if max_score > best_score:
-                        result = []
-                        best_score = max_score
-                    if max_score < min_score:
-                        continue
-                    result.append(
-                        ScoreMatrix(
-                            query=query,
-                            target=target,
-                            target_id=t_idx,
-                            score=max_score,
-                            matrix=matrix,
-                            reversed=False,
-                            original_seq=query,
-                        )
-                    )
-        elif query in targets_by_seq:
-            best_score = q_len
-            for t_idx in targets_by_seq[query]:
-                result.append(
-                    ScoreMatrix(
-                        query=query,
-                        target=query,  # they are equal
-                        target_id=t_idx,
-                        score=q_len,
-                        reversed=False,
-                        original_seq=query,
-                        exact=True,
-                    )
-                )
+    order = sorted(range(len(queries)), key=lambda i: (len(queries[i]), queries[i]))
+    # encoded query and reverse complement, plus scratch for one unpacked target
+    max_q_len = len(queries[order[-1]]) if order else 0
+    q_codes = <int *> malloc((max_q_len + 1) * sizeof(int))
+    r_codes = <int *> malloc((max_q_len + 1) * sizeof(int))
+    t_codes = <int *> malloc((target_seqs.max_length + 1) * sizeof(int))
+    try:
+        if not q_codes or not r_codes or not t_codes:
+            raise MemoryError()
+        g_start = 0
+        while g_start < len(order):
+            q_len = len(queries[order[g_start]])
+            g_end = g_start + 1
+            while g_end < len(order) and len(queries[order[g_end]]) == q_len:
+                g_end += 1
+            group = order[g_start:g_end]
+            g_start = g_end
+            if q_len < hard_min:
+                continue
 
-        if do_revcomp:
-            if do_substr:  # try substr
-                for t_idx, target in enumerate(targets):
-                    if target in rev_query or rev_query in target:
-                        t_len = target_lengths[t_idx]
-                        # use matrix to build the bits we need quickly
-                        min_score = max(hard_min, best_score, min(t_len - penalty_max, q_penalty_score))
-                        (matrix, max_score) = fill(target, rev_query, min_score)
-                        if max_score > best_score:
-                            result = []
-                            best_score = max_score
-                        if max_score < min_score:
-                            continue
-                        result.append(
-                            ScoreMatrix(
-                                query=rev_query,
-                                target=target,
-                                target_id=t_idx,
-                                score=max_score,
-                                matrix=matrix,
-                                reversed=True,
-                                original_seq=query,
-                            )
-                        )
-            elif rev_query in targets_by_seq:
-                best_score = q_len
-                for t_idx in targets_by_seq[rev_query]:
-                    result.append(
-                        ScoreMatrix(
-                            query=rev_query,
-                            target=rev_query,  # they are equal
-                            target_id=t_idx,
-                            score=q_len,
-                            reversed=True,
-                            original_seq=query,
-                            exact=True,
-                        )
-                    )
+            q_penalty_score = q_len - penalty_max
+            do_substr = lib_substr or q_len != max_t_len
+            # a target scoring below every min_score it could be given can't add to, clear or alter result
+            threshold = max(hard_min, min(min_t_len - penalty_max, q_penalty_score))
+
+            group_trie = trie is not None and (strategies is None or strategies.get(q_len) != STRATEGY_SCAN)
+            group_buckets = _length_buckets(length_buckets, q_len, hard_min, penalty_max, q_penalty_score)
+            pending = []  # (q_idx, query, rev_query, best_score, cells) for the matrix stage
+            first_idx = -1
+            for q_idx in group:
+                query = queries[q_idx]
+                if first_idx != -1 and query == queries[first_idx]:
+                    dups[q_idx] = first_idx
+                    continue
+                first_idx = q_idx
+                q_budget.cells = 0
+                q_budget.limit = budget
+                q_budget.exceeded = False
+                rev_query = revcomp(query) if do_revcomp else None
+                encode_seq(query, q_codes)
+                if do_revcomp:
+                    encode_seq(rev_query, r_codes)
+                (result, best_score) = _direct_hits(
+                    query,
+                    rev_query,
+                    q_codes,
+                    r_codes,
+                    t_codes,
+                    target_seqs,
+                    do_substr,
+                    do_revcomp,
+                    match_type,
+                    hard_min,
+                    penalty_max,
+                    q_penalty_score,
+                    &q_budget,
+                )
+                if q_budget.exceeded:
+                    exceeded.add(q_idx)
+                    results[q_idx] = result
+                    continue
+                # if we get to here and the query has been "exact" or "substr" mapped to a target of the maximum length
+                # no point in processing the matrix, regardless of mismatch options
+                if exact_only or len(result) > 0:
+                    results[q_idx] = result
+                    continue
+                pending.append((q_idx, query, rev_query, best_score, q_budget.cells))
 
-        if exact_only:
-            if len(result) == 0:
-                unmapped.append(query)
+            if len(pending) == 0:
                 continue
-            mapped.append(result)
-            continue
+            if group_trie:
+                fwd_hits = trie.search_batch([p[1] for p in pending], threshold)
+                if do_revcomp:
+                    rev_hits = trie.search_batch([p[2] for p in pending], threshold)
+            for p_idx, (q_idx, query, rev_query, best_score, cells) in enumerate(pending):
+                if group_trie:
+                    # the trie candidates of each length, in the order of the group
+                    candidates = set(fwd_hits[p_idx]).union(rev_hits[p_idx]) if do_revcomp else fwd_hits[p_idx]
+                    by_length = {}
+                    for t_idx in sorted(candidates):
+                        by_length.setdefault(target_seqs.t_length(t_idx), []).append(t_idx)
+                    buckets = [(t_len, bucket_min, by_length[t_len]) for (t_len, bucket_min, _) in group_buckets
+                               if t_len in by_length]
+                else:
+                    buckets = group_buckets
+                encode_seq(query, q_codes)
+                if do_revcomp:
+                    encode_seq(rev_query, r_codes)
+                base_counts(q_codes, q_len, q_counts)
+                if do_revcomp:
+                    base_counts(r_codes, q_len, r_counts)
+                q_budget.cells = cells
+                q_budget.limit = budget
+                q_budget.exceeded = False
+                results[q_idx] = _matrix_hits(
+                    query,
+                    rev_query,
+                    q_codes,
+                    r_codes,
+                    t_codes,
+                    target_seqs,
+                    buckets,
+                    best_score,
+                    do_revcomp,
+                    threshold,
+                    q_counts,
+                    r_counts,
+                    &q_budget,
+                    cluster_of,
+                    cluster_size,
+                    cluster_radii,
+                )
+                if q_budget.exceeded:
+                    exceeded.add(q_idx)
+    finally:
+        free(q_codes)
+        free(r_codes)
+        free(t_codes)
 
-        # if we get to here and the query has been "exact" or "substr" mapped to a target of the maximum length no point in processing
-        # the matrix, regardless of mismatch options
-        if len(result) > 0:
+    for q_idx, query in enumerate(queries):
+        result = results[dups.get(q_idx, q_idx)]
+        if result:
             mapped.append(result)
-            continue
+        else:
+            unmapped.append(query)
 
-        for t_idx, target in enumerate(targets):
-            t_len = target_lengths[t_idx]
-            if best_score >= t_len:
-                # we only need to try for a better score if a target is longer, it'll be a multi-map though
-                continue
-            if t_len < hard_min:
-                continue
+    bt_mapped = []
+    bt_done = {}  # identical queries share the same result list
+    for r_set in mapped:
+        clean_set = bt_done.get(id(r_set))
+        if clean_set is None:
+            clean_set = []
+            for sm in r_set:
+                bt = Backtrack(sm, match_type)
+                if bt.pass_mode:
+                    if not keep_matrix:
+                        bt.sm.matrix = None
+                    clean_set.append(bt)
+            bt_done[id(r_set)] = clean_set
 
-            # user can define the hard minimum
-            # slightly painful that this has to be calculated for each target
-            min_score = max(hard_min, best_score, min(t_len - penalty_max, q_penalty_score))
+        if len(clean_set) > 0:
+            bt_mapped.append(clean_set)
+        else:
+            unmapped.append(r_set[0].original_seq)
+
+    budget_exceeded = [query for q_idx, query in enumerate(queries) if dups.get(q_idx, q_idx) in exceeded]
+    return AlignmentBatch(unmapped=unmapped, mapped=bt_mapped, budget_exceeded=budget_exceeded)
+
+
+cdef tuple _direct_hits(
+    str query,
+    str rev_query,
+    const int *q_codes,
+    const int *r_codes,
+    int *t_codes,
+    PackedTargets targets,
+    bint do_substr,
+    bint do_revcomp,
+    int match_type,
+    int hard_min,
+    int penalty_max,
+    int q_penalty_score,
+    QueryBudget *budget,
+):
+    """
+    Exact and substring matching, returns the best scoring ScoreMatrix objects and the best score seen.
 
-            (matrix, max_score) = fill(target, query, min_score)
+    q_codes/r_codes are the encoded query and reverse complement, t_codes is scratch for unpacking targets.
+    """
+    cdef int t_idx, t_len, min_score, max_score
+    cdef int q_len = len(query)
+    cdef int best_score = 0
+    cdef list result = []  # store the best scoring results we see
+    cdef list t_ids
+    cdef dict filled = {}  # see _class_fill()
 
-            # this will be used in min_score calc above on each loop
+    if do_substr and match_type != 0:  # try substr
+        for t_idx in targets.substr_hits(q_codes, q_len, match_type):
+            if _over_budget(budget):
+                break
+            t_len = targets.t_length(t_idx)
+            # use matrix to build the bits we need quickly
+            min_score = max(hard_min, best_score, min(t_len - penalty_max, q_penalty_score))
+            filled_score = _class_fill(targets, t_idx, False, q_codes, q_len, t_codes, min_score, budget, filled)
+            if filled_score is None:
+                continue
+            (matrix, max_score) = filled_score
             if max_score > best_score:
+                result = []
                 best_score = max_score
-                result = []  # clear any old entries if the score increases
+            if max_score < min_score:
+                continue
+            result.append(
+                ScoreMatrix(
+                    query=query,
+                    target=targets[t_idx],
+                    target_id=t_idx,
+                    score=max_score,
+                    matrix=matrix,
+                    reversed=False,
+                    original_seq=query,
+                )
+            )
+    else:
+        t_ids = targets.find(query)
+        if t_ids:
+            best_score = q_len
+        for t_idx in t_ids:
+            result.append(
+                ScoreMatrix(
+                    query=query,
+                    target=query,  # they are equal
+                    target_id=t_idx,
+                    score=q_len,
+                    reversed=False,
+                    original_seq=query,
+                    exact=True,
+                )
+            )
 
-            if max_score >= min_score:
+    if do_revcomp:
+        if do_substr:  # try substr
+            for t_idx in targets.substr_hits(r_codes, q_len, 3):
+                if _over_budget(budget):
+                    break
+                t_len = targets.t_length(t_idx)
+                # use matrix to build the bits we need quickly
+                min_score = max(hard_min, best_score, min(t_len - penalty_max, q_penalty_score))
+                filled_score = _class_fill(targets, t_idx, True, r_codes, q_len, t_codes, min_score, budget, filled)
+                if filled_score is None:
+                    continue
+                (matrix, max_score) = filled_score
+                if max_score > best_score:
+                    result = []
+                    best_score = max_score
+                if max_score < min_score:
+                    continue
                 result.append(
                     ScoreMatrix(
-                        query=query,
-                        target=target,
+                        query=rev_query,
+                        target=targets[t_idx],
                         target_id=t_idx,
                         score=max_score,
                         matrix=matrix,
-                        reversed=False,
+                        reversed=True,
                         original_seq=query,
                     )
                 )
+        else:
+            t_ids = targets.find(rev_query)
+            if t_ids:
+                best_score = q_len
+            for t_idx in t_ids:
+                result.append(
+                    ScoreMatrix(
+                        query=rev_query,
+                        target=rev_query,  # they are equal
+                        target_id=t_idx,
+                        score=q_len,
+                        reversed=True,
+                        original_seq=query,
+                        exact=True,
+                    )
+                )
+    return (result, best_score)
+
+
+cdef inline bint _cannot_change(int bound, int min_score, int best_score, int threshold):
+    # a score of at most bound is not reported (< min_score) and either can't raise best_score or is below the
+    # threshold of map_queries, where raising best_score has no effect on the result
+    return bound < min_score and (bound <= best_score or bound < threshold)
+
+
+cdef list _matrix_hits(
+    str query,
+    str rev_query,
+    const int *q_codes,
+    const int *r_codes,
+    int *t_codes,
+    PackedTargets targets,
+    list buckets,
+    int best_score,
+    bint do_revcomp,
+    int threshold,
+    const int *q_counts,
+    const int *r_counts,
+    QueryBudget *budget,
+    int[:] cluster_of,
+    int[:] cluster_size,
+    int[:] cluster_radii,
+):
+    """
+    Matrix alignment against candidate targets, best_score is carried over from _direct_hits().  buckets holds
+    (t_len, bucket_min, t_ids) for each target length in the order visited, bucket_min is the min_score of the length
+    before best_score is applied (see _length_buckets()).  A length that can't beat best_score, or whose highest
+    possible score (the shorter of query and target) can't change the result, is passed over without visiting its
+    targets.
+
+    fill() is skipped for an orientation when the composition bound of the target (PackedTargets.score_bound) shows
+    the result can't change, see _cannot_change().  With clusters (cluster_of is not None, see TargetLibrary) the
+    center of a target's cluster is aligned once per orientation and the bound it gives applies to every member.
+    Targets with equal sequences share one fill() per orientation, see _class_fill().
+
+    Only alignments at the best score are returned, ordered by t_id then orientation, so the result doesn't depend on
+    the order targets are visited.
+    """
+    cdef int t_idx, t_len, bucket_min, min_score, max_score, center
+    cdef int q_len = len(query)
+    cdef bint skip
+    cdef list result = []
+    cdef dict cluster_skips = {}  # (center, reversed): fill() can be skipped for every member
+    cdef dict filled = {}
+
+    for (t_len, bucket_min, t_ids) in buckets:
+        # we only need to try for a better score if a target is longer, it'll be a multi-map though
+        if best_score >= t_len:
+            continue
+        if _cannot_change(min(q_len, t_len), max(bucket_min, best_score), best_score, threshold):
+            continue
+        for t_idx in t_ids:
+            if _over_budget(budget):
+                break
+            min_score = max(bucket_min, best_score)
+            center = -1
+            if cluster_of is not None and cluster_size[cluster_of[t_idx]] > 1:
+                center = cluster_of[t_idx]
+
+            target = None  # only decoded when reported
+            skip = _cannot_change(targets.score_bound(t_idx, q_counts), min_score, best_score, threshold)
+            if not skip and center != -1:
+                cached = cluster_skips.get((center, False))
+                if cached is not None:
+                    skip = cached
+                else:
+                    skip = _cluster_cannot_change(
+                        targets, center, cluster_radii[center], q_codes, q_len, t_codes, min_score, best_score,
+                        threshold, budget
+                    )
+                    cluster_skips[(center, False)] = skip
+            filled_score = None
+            if not skip:
+                filled_score = _class_fill(targets, t_idx, False, q_codes, q_len, t_codes, min_score, budget, filled)
+            if filled_score is not None:
+                (matrix, max_score) = filled_score
+                if max_score > best_score:
+                    best_score = max_score
+                    result = []  # clear any old entries if the score increases
+                if max_score >= min_score:
+                    target = targets[t_idx]
+                    result.append(
+                        ScoreMatrix(
+                            query=query,
+                            target=target,
+                            target_id=t_idx,
+                            score=max_score,
+                            matrix=matrix,
+                            reversed=False,
+                            original_seq=query,
+                        )
+                    )
 
-            if do_revcomp:
-                (matrix, max_score) = fill(target, rev_query, min_score)
+            if not do_revcomp:
+                continue
+            min_score = max(bucket_min, best_score)
+            skip = _cannot_change(targets.score_bound(t_idx, r_counts), min_score, best_score, threshold)
+            if not skip and center != -1:
+                cached = cluster_skips.get((center, True))
+                if cached is not None:
+                    skip = cached
+                else:
+                    skip = _cluster_cannot_change(
+                        targets, center, cluster_radii[center], r_codes, q_len, t_codes, min_score, best_score,
+                        threshold, budget
+                    )
+                    cluster_skips[(center, True)] = skip
+            filled_score = None
+            if not skip:
+                filled_score = _class_fill(targets, t_idx, True, r_codes, q_len, t_codes, min_score, budget, filled)
+            if filled_score is not None:
+                (matrix, max_score) = filled_score
+                if max_score > best_score:
+                    best_score = max_score
+                    result = []
                 if max_score >= min_score:
+                    if target is None:
+                        target = targets[t_idx]
                     result.append(
                         ScoreMatrix(
                             query=rev_query,
@@ -227,53 +526,126 @@ def map_queries(
                             original_seq=query,
                         )
                     )
+        if budget.exceeded:
+            break
+    result.sort(key=_hit_order)
+    return result
 
-        if len(result) == 0:
-            unmapped.append(query)
-            continue
-        mapped.append(result)
 
-    bt_mapped = []
-    for r_set in mapped:
-        clean_set = []
-        for sm in r_set:
-            bt = Backtrack(sm, match_type)
-            if bt.pass_mode:
-                if not keep_matrix:
-                    bt.sm.matrix = None
-                clean_set.append(bt)
+def _hit_order(sm: ScoreMatrix) -> Tuple[int, bool]:
+    return (sm.target_id, sm.reversed)
+
+
+cdef list _length_buckets(dict length_buckets, int q_len, int hard_min, int penalty_max, int q_penalty_score):
+    """
+    (t_len, bucket_min, t_ids) of each target length that can reach hard_min, best first: the highest possible score
+    (the shorter of query and target) then the lower min_score of a shorter target.  bucket_min is min_score before
+    best_score is applied.
+    """
+    cdef int t_len
+    cdef list lengths = sorted([t_len for t_len in length_buckets if t_len >= hard_min])
+    lengths.sort(key=lambda t_len: -min(q_len, t_len))
+    return [
+        (t_len, max(hard_min, min(t_len - penalty_max, q_penalty_score)), length_buckets[t_len]) for t_len in lengths
+    ]
+
+cdef object _class_fill(
+    PackedTargets targets,
+    int t_idx,
+    bint reverse,
+    const int *codes,
+    int q_len,
+    int *t_codes,
+    int min_score,
+    QueryBudget *budget,
+    dict filled,
+):
+    # fill() of the target against codes, once per class of equal targets (PackedTargets.class_of) and orientation of
+    # a query, filled holds (min_score, matrix or None, max_score) by (class, reverse) for the scan.  min_score never
+    # falls during a scan, so a later member either gets the same result (a complete matrix reaching min_score, or the
+    # same min_score) or a fill() giving at most the cached max_score, which is below min_score and can't raise
+    # best_score past it.  None is returned for the latter, the member has no effect.
+    cdef tuple key = (targets.t_class(t_idx), reverse)
+    cdef tuple cached = filled.get(key)
+    cdef int t_len
+    if cached is not None:
+        if cached[2] >= min_score or cached[0] == min_score:
+            return cached[1:]
+        return None
+    t_len = targets.unpack(t_idx, t_codes)
+    (matrix, max_score) = _fill(t_codes, t_len, codes, q_len, min_score, &budget.cells)
+    # the matrix is only read for a reported score
+    filled[key] = (min_score, matrix if max_score >= min_score else None, max_score)
+    return (matrix, max_score)
 
-        if len(clean_set) > 0:
-            bt_mapped.append(clean_set)
-        else:
-            unmapped.append(r_set[0].original_seq)
 
-    return AlignmentBatch(unmapped=unmapped, mapped=bt_mapped)
+cdef bint _cluster_cannot_change(
+    PackedTargets targets,
+    int center,
+    int radius,
+    const int *codes,
+    int q_len,
+    int *t_codes,
+    int min_score,
+    int best_score,
+    int threshold,
+    QueryBudget *budget,
+):
+    # A member differs from the center by at most radius substitutions and each changes the score of an alignment by
+    # at most 1, so score(member) <= score(center) + radius.  _cannot_change() holds for any score <= limit.
+    cdef int limit = min(min_score - 1, max(best_score, threshold - 1))
+    cdef int need = limit - radius + 1  # the center scoring below this bounds every member to <= limit
+    cdef int t_len, max_score
+    if need <= 0:
+        return False
+    t_len = targets.unpack(center, t_codes)
+    # fill() stops early once need can't be reached, the score it returns is then still below need
+    (_, max_score) = _fill(t_codes, t_len, codes, q_len, need, &budget.cells)
+    return max_score < need
 
 
 def fill(str target, str query, int min_score) -> Tuple[List[List[int]], int]:
+    cdef int *t_codes = <int *> malloc((len(target) + 1) * sizeof(int))
+    cdef int *q_codes = <int *> malloc((len(query) + 1) * sizeof(int))
+    try:
+        if not t_codes or not q_codes:
+            raise MemoryError()
+        encode_seq(target, t_codes)
+        encode_seq(query, q_codes)
+        return _fill(t_codes, len(target), q_codes, len(query), min_score, NULL)
+    finally:
+        free(t_codes)
+        free(q_codes)
+
+
+cdef tuple _fill(const int *target, int t_len, const int *query, int q_len, int min_score, long long *cells):
     ## loosely based on https://en.wikipedia.org/wiki/Needleman%E2%80%93Wunsch_algorithm
-    cdef int t_len = len(target)
-    cdef int q_len = len(query)
+    # sequences are integer codes from encode_seq(), rows are only converted to lists for the returned matrix
     cdef int max_score_seen = -1
     cdef int i_max = t_len - 1
     cdef int j_max = q_len - 1
     cdef int i, j, m, insert, delete, m_val
+    cdef long long n_cells = 0
+    cdef int *last_i = <int *> calloc(q_len + 1, sizeof(int))
+    cdef int *this_i = <int *> malloc((q_len + 1) * sizeof(int))
+    cdef int *swap
+
+    if not last_i or not this_i:
+        free(last_i)
+        free(this_i)
+        raise MemoryError()
 
     f = [[]] * t_len  # list of lists Y-axis
-    last_i = [0] * q_len
     i = 0
     while i < t_len:
-        this_i = [0] * q_len
-        first_j = True
+        memset(this_i, 0, q_len * sizeof(int))
         j = 0
         while j < q_len:
             # last scores
-            if first_j:
+            if j == 0:
                 m = 0
                 delete = GAP
                 insert = GAP
-                first_j = False
             else:
                 m = last_i[j - 1]
                 delete = last_i[j]
@@ -284,19 +656,30 @@ def fill(str target, str query, int min_score) -> Tuple[List[List[int]], int]:
                 # no else as mismatch += 0
             delete += GAP  # deletion
             insert += GAP  # insertion
-            m_val = max([m, delete, insert])  # faster than sorted()[-1]
+            m_val = m
+            if delete > m_val:
+                m_val = delete
+            if insert > m_val:
+                m_val = insert
             this_i[j] = m_val
+            n_cells += 1
             if m_val > max_score_seen:
                 max_score_seen = m_val
             if (j_max - j) + max_score_seen < min_score:
                 break
             j += 1
 
-        f[i] = this_i
+        f[i] = [this_i[j] for j in range(q_len)]
+        swap = last_i
         last_i = this_i
+        this_i = swap
         if (i_max - i) + max_score_seen < min_score:
             break
 
         i += 1
 
+    free(last_i)
+    free(this_i)
+    if cells != NULL:
+        cells[0] += n_cells
     return (f, max_score_seen)
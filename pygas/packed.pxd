@@ -0,0 +1,73 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+
+cdef int encode_seq(str seq, int *out) except -1
+cdef void base_counts(const int *codes, int length, int *counts)
+
+
+cdef class PackedTargets:
+    cdef unsigned char *data
+    cdef Py_ssize_t data_len
+    cdef Py_ssize_t data_cap
+    cdef Py_ssize_t *offsets
+    cdef int *lengths
+    cdef int *next_same
+    cdef int *class_ids
+    cdef unsigned char *flags
+    cdef unsigned char *comp
+    cdef int count
+    cdef int capacity
+    cdef int n_active
+    cdef int max_len
+    cdef dict masked
+    cdef dict other
+    cdef int *slot_head
+    cdef int *slot_tail
+    cdef Py_ssize_t n_slots
+    cdef Py_ssize_t slots_used
+    cdef int *scratch
+    cdef int scratch_len
+    cdef unsigned char *key_buf
+
+    cdef int t_length(self, int t_id)
+    cdef int t_class(self, int t_id)
+    cdef int score_bound(self, int t_id, const int *q_counts)
+    cdef int unpack(self, int t_id, int *out) except -1
+    cdef list substr_hits(self, const int *query, int q_len, int match_type)
+    cdef int _reserve(self, int n) except -1
+    cdef int _grow(self) except -1
+    cdef int _grow_data(self, int nbytes) except -1
+    cdef void _pack_key(self, int t_len)
+    cdef Py_ssize_t _slot_of(self, const unsigned char *packed, int t_len)
+    cdef bint _same(self, int t_id, const unsigned char *packed, int t_len)
+    cdef Py_ssize_t _probe(self, const unsigned char *packed, int t_len)
+    cdef int _table_add(self, int t_id) except -1
+    cdef int _table_remove(self, int t_id) except -1
+    cdef int _rehash(self) except -1
@@ -0,0 +1,558 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memset, memcmp
+
+cdef unsigned char FLAG_MASKED = 1
+cdef unsigned char FLAG_RETIRED = 2
+cdef int SLOT_EMPTY = -1
+cdef int SLOT_TOMB = -2
+cdef int N_COUNTS = 5
+cdef unsigned char COUNT_SAT = 255  # stored counts saturate, treated as unbounded
+cdef str BASES = "ACGT"
+cdef const char *BASE_CHARS = b"ACGT"
+
+
+cdef int encode_seq(str seq, int *out) except -1:
+    """
+    Convert a sequence to integer codes, A/C/G/T are 0-3 and any other character is 4 + its code point so that codes
+    are equal exactly when the characters are.
+    """
+    cdef Py_UCS4 c
+    cdef int i = 0
+    for c in seq:
+        if c == "A":
+            out[i] = 0
+        elif c == "C":
+            out[i] = 1
+        elif c == "G":
+            out[i] = 2
+        elif c == "T":
+            out[i] = 3
+        else:
+            out[i] = 4 + <int> c
+        i += 1
+    return i
+
+
+cdef void base_counts(const int *codes, int length, int *counts):
+    """
+    Counts of A, C, G, T and any other character, counts must hold N_COUNTS values.
+    """
+    cdef int k
+    for k in range(N_COUNTS):
+        counts[k] = 0
+    for k in range(length):
+        counts[codes[k] if codes[k] < 4 else 4] += 1
+
+
+cdef inline bint _contains(const int *hay, int hay_len, const int *needle, int needle_len):
+    # equivalent of `needle in hay` for str
+    cdef int i, j
+    for i in range(hay_len - needle_len + 1):
+        j = 0
+        while j < needle_len and hay[i + j] == needle[j]:
+            j += 1
+        if j == needle_len:
+            return True
+    return needle_len == 0
+
+
+cdef class PackedTargets:
+    """
+    Target sequences held at 2 bits per base, indexed by t_id.
+
+    Bases other than A/C/G/T (typically N) are masked, their position and character are kept separately so the
+    original sequence is always recovered by decoding.  Base composition of each target is kept for score_bound().
+    Includes the exact match table, sequences without masked bases
+    are hashed on their packed bytes (no str retained), masked sequences fall back to a dict.
+
+    Targets with equal sequences form a class, identified by its lowest active t_id (class_of()), so work that only
+    depends on the sequence can be done once per class.
+
+    Behaves as a read-only sequence of str, retired targets decode as None.  Storage of a retired target is not
+    reclaimed.
+    """
+
+    def __cinit__(self):
+        cdef Py_ssize_t i
+        self.capacity = 1024
+        self.offsets = <Py_ssize_t *> malloc(self.capacity * sizeof(Py_ssize_t))
+        self.lengths = <int *> malloc(self.capacity * sizeof(int))
+        self.next_same = <int *> malloc(self.capacity * sizeof(int))
+        self.class_ids = <int *> malloc(self.capacity * sizeof(int))
+        self.flags = <unsigned char *> malloc(self.capacity * sizeof(unsigned char))
+        self.comp = <unsigned char *> malloc(self.capacity * N_COUNTS * sizeof(unsigned char))
+        self.data_cap = 1 << 16
+        self.data = <unsigned char *> malloc(self.data_cap)
+        self.n_slots = 1024
+        self.slot_head = <int *> malloc(self.n_slots * sizeof(int))
+        self.slot_tail = <int *> malloc(self.n_slots * sizeof(int))
+        if (
+            not self.offsets
+            or not self.lengths
+            or not self.next_same
+            or not self.class_ids
+            or not self.flags
+            or not self.comp
+            or not self.data
+            or not self.slot_head
+            or not self.slot_tail
+        ):
+            raise MemoryError()
+        for i in range(self.n_slots):
+            self.slot_head[i] = SLOT_EMPTY
+        self.data_len = 0
+        self.count = 0
+        self.n_active = 0
+        self.max_len = 0
+        self.slots_used = 0
+        self.scratch = NULL
+        self.scratch_len = 0
+        self.key_buf = NULL
+        self.masked = {}
+        self.other = {}
+
+    def __init__(self, targets=()):
+        for target in targets:
+            self.append(target)
+
+    def __dealloc__(self):
+        free(self.offsets)
+        free(self.lengths)
+        free(self.next_same)
+        free(self.class_ids)
+        free(self.flags)
+        free(self.comp)
+        free(self.data)
+        free(self.slot_head)
+        free(self.slot_tail)
+        free(self.scratch)
+        free(self.key_buf)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, int t_id):
+        cdef int t_len, k
+        if t_id < 0 or t_id >= self.count:
+            raise IndexError(t_id)
+        if self.flags[t_id] & FLAG_RETIRED:
+            return None
+        t_len = self.lengths[t_id]
+        self._reserve(t_len)
+        self.unpack(t_id, self.scratch)
+        if self.flags[t_id] & FLAG_MASKED:
+            return "".join([BASES[c] if c < 4 else chr(c - 4) for c in self.scratch[:t_len]])
+        for k in range(t_len):
+            self.key_buf[k] = BASE_CHARS[self.scratch[k]]
+        return self.key_buf[:t_len].decode("ascii")
+
+    def __reduce__(self):
+        return (_restore, (list(self),))
+
+    def __iter__(self):
+        cdef int t_id
+        for t_id in range(self.count):
+            yield self[t_id]
+
+    @property
+    def active(self) -> int:
+        return self.n_active
+
+    @property
+    def max_length(self) -> int:
+        """
+        Longest target ever added, including retired targets.
+        """
+        return self.max_len
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes allocated for sequences, per target arrays and the exact match table (excludes masked/other dicts).
+        """
+        return (
+            self.data_cap
+            + self.capacity * (sizeof(Py_ssize_t) + 3 * sizeof(int) + (1 + N_COUNTS) * sizeof(unsigned char))
+            + self.n_slots * 2 * sizeof(int)
+        )
+
+    def length(self, int t_id) -> int:
+        """
+        Length of target, -1 when retired.
+        """
+        if t_id < 0 or t_id >= self.count:
+            raise IndexError(t_id)
+        return self.t_length(t_id)
+
+    def class_of(self, int t_id) -> int:
+        """
+        Lowest active t_id with the same sequence as target, -1 when retired.
+        """
+        if t_id < 0 or t_id >= self.count:
+            raise IndexError(t_id)
+        if self.flags[t_id] & FLAG_RETIRED:
+            return -1
+        return self.t_class(t_id)
+
+    def append(self, str seq) -> int:
+        """
+        Add a target, returns its t_id.
+        """
+        cdef int t_len = len(seq)
+        cdef int nbytes = (t_len + 3) >> 2
+        cdef int t_id = self.count
+        cdef int k, c
+        cdef int counts[5]
+        cdef dict masked = None
+        cdef unsigned char *dest
+
+        self._reserve(t_len)
+        encode_seq(seq, self.scratch)
+        if self.count == self.capacity:
+            self._grow()
+        if self.data_len + nbytes > self.data_cap:
+            self._grow_data(nbytes)
+        dest = self.data + self.data_len
+        memset(dest, 0, nbytes)
+        for k in range(t_len):
+            c = self.scratch[k]
+            if c > 3:
+                if masked is None:
+                    masked = {}
+                masked[k] = c
+                continue
+            dest[k >> 2] |= c << ((k & 3) << 1)
+        base_counts(self.scratch, t_len, counts)
+        for k in range(N_COUNTS):
+            self.comp[t_id * N_COUNTS + k] = counts[k] if counts[k] < COUNT_SAT else COUNT_SAT
+        self.offsets[t_id] = self.data_len
+        self.lengths[t_id] = t_len
+        self.next_same[t_id] = -1
+        self.class_ids[t_id] = t_id
+        self.flags[t_id] = 0
+        self.data_len += nbytes
+        self.count += 1
+        self.n_active += 1
+        if t_len > self.max_len:
+            self.max_len = t_len
+        if masked is None:
+            self._table_add(t_id)
+        else:
+            self.flags[t_id] = FLAG_MASKED
+            self.masked[t_id] = masked
+            if seq in self.other:
+                self.class_ids[t_id] = self.other[seq][0]
+                self.other[seq].append(t_id)
+            else:
+                self.other[seq] = [t_id]
+        return t_id
+
+    def remove(self, int t_id):
+        """
+        Retire a target, the t_id is not reused.
+        """
+        if t_id < 0 or t_id >= self.count or self.flags[t_id] & FLAG_RETIRED:
+            raise ValueError(f"t_id {t_id} is not an active target")
+        if self.flags[t_id] & FLAG_MASKED:
+            seq = self[t_id]
+            self.other[seq].remove(t_id)
+            if not self.other[seq]:
+                del self.other[seq]
+            else:
+                for same_id in self.other[seq]:
+                    self.class_ids[same_id] = self.other[seq][0]
+            del self.masked[t_id]
+        else:
+            self._table_remove(t_id)
+        self.flags[t_id] |= FLAG_RETIRED
+        self.n_active -= 1
+
+    def find(self, str seq) -> list:
+        """
+        t_id of every active target equal to seq, ascending.
+        """
+        cdef int t_len = len(seq)
+        cdef int k, t_id
+        cdef Py_ssize_t slot
+        cdef list found = []
+
+        self._reserve(t_len)
+        encode_seq(seq, self.scratch)
+        for k in range(t_len):
+            if self.scratch[k] > 3:
+                return list(self.other.get(seq, found))
+        self._pack_key(t_len)
+        slot = self._probe(self.key_buf, t_len)
+        if slot == -1:
+            return found
+        t_id = self.slot_head[slot]
+        while t_id != -1:
+            found.append(t_id)
+            t_id = self.next_same[t_id]
+        return found
+
+    cdef int t_length(self, int t_id):
+        if self.flags[t_id] & FLAG_RETIRED:
+            return -1
+        return self.lengths[t_id]
+
+    cdef int t_class(self, int t_id):
+        return self.class_ids[t_id]
+
+    cdef int score_bound(self, int t_id, const int *q_counts):
+        """
+        Upper bound of the fill() score of a query against the target from base counts (see base_counts), each match
+        pairs a query base with an equal target base.
+        """
+        cdef const unsigned char *t_counts = self.comp + t_id * N_COUNTS
+        cdef int k
+        cdef int bound = 0
+        for k in range(N_COUNTS):
+            if t_counts[k] == COUNT_SAT or q_counts[k] < t_counts[k]:
+                bound += q_counts[k]
+            else:
+                bound += t_counts[k]
+        return bound
+
+    cdef int unpack(self, int t_id, int *out) except -1:
+        """
+        Write integer codes of target to out (see encode_seq), returns the length.
+        """
+        cdef int t_len = self.lengths[t_id]
+        cdef unsigned char *src = self.data + self.offsets[t_id]
+        cdef int k
+        for k in range(t_len):
+            out[k] = (src[k >> 2] >> ((k & 3) << 1)) & 3
+        if self.flags[t_id] & FLAG_MASKED:
+            for k, c in self.masked[t_id].items():
+                out[k] = c
+        return t_len
+
+    cdef list substr_hits(self, const int *query, int q_len, int match_type):
+        """
+        t_id of active targets where (match_type & 1 and query in target) or (match_type & 2 and target in query).
+        """
+        cdef list hits = []
+        cdef set class_hits = set()
+        cdef int t_id, t_len
+        self._reserve(self.max_len)
+        for t_id in range(self.count):
+            if self.flags[t_id] & FLAG_RETIRED:
+                continue
+            if self.class_ids[t_id] != t_id:
+                # equal to a lower t_id, already tested
+                if self.class_ids[t_id] in class_hits:
+                    hits.append(t_id)
+                continue
+            t_len = self.unpack(t_id, self.scratch)
+            if ((match_type & 1) == 1 and _contains(self.scratch, t_len, query, q_len)) or (
+                (match_type & 2) == 2 and _contains(query, q_len, self.scratch, t_len)
+            ):
+                hits.append(t_id)
+                class_hits.add(t_id)
+        return hits
+
+    cdef int _reserve(self, int n) except -1:
+        cdef int *ptr
+        cdef unsigned char *b_ptr
+        if n <= self.scratch_len:
+            return 0
+        ptr = <int *> realloc(self.scratch, n * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.scratch = ptr
+        b_ptr = <unsigned char *> realloc(self.key_buf, n)
+        if not b_ptr:
+            raise MemoryError()
+        self.key_buf = b_ptr
+        self.scratch_len = n
+        return 0
+
+    cdef int _grow(self) except -1:
+        cdef int capacity = self.capacity * 2
+        cdef void *ptr
+        ptr = realloc(self.offsets, capacity * sizeof(Py_ssize_t))
+        if not ptr:
+            raise MemoryError()
+        self.offsets = <Py_ssize_t *> ptr
+        ptr = realloc(self.lengths, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.lengths = <int *> ptr
+        ptr = realloc(self.next_same, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.next_same = <int *> ptr
+        ptr = realloc(self.class_ids, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.class_ids = <int *> ptr
+        ptr = realloc(self.flags, capacity * sizeof(unsigned char))
+        if not ptr:
+            raise MemoryError()
+        self.flags = <unsigned char *> ptr
+        ptr = realloc(self.comp, capacity * N_COUNTS * sizeof(unsigned char))
+        if not ptr:
+            raise MemoryError()
+        self.comp = <unsigned char *> ptr
+        self.capacity = capacity
+        return 0
+
+    cdef int _grow_data(self, int nbytes) except -1:
+        cdef Py_ssize_t data_cap = self.data_cap
+        cdef unsigned char *ptr
+        while self.data_len + nbytes > data_cap:
+            data_cap *= 2
+        ptr = <unsigned char *> realloc(self.data, data_cap)
+        if not ptr:
+            raise MemoryError()
+        self.data = ptr
+        self.data_cap = data_cap
+        return 0
+
+    cdef void _pack_key(self, int t_len):
+        # packs scratch (no masked bases) into key_buf, same layout as data
+        cdef int k
+        memset(self.key_buf, 0, (t_len + 3) >> 2)
+        for k in range(t_len):
+            self.key_buf[k >> 2] |= self.scratch[k] << ((k & 3) << 1)
+
+    cdef Py_ssize_t _slot_of(self, const unsigned char *packed, int t_len):
+        cdef unsigned long long h = 14695981039346656037ULL ^ <unsigned long long> t_len
+        cdef int k
+        for k in range((t_len + 3) >> 2):
+            h ^= packed[k]
+            h *= 1099511628211ULL
+        h ^= h >> 29
+        return <Py_ssize_t> (h & <unsigned long long> (self.n_slots - 1))
+
+    cdef bint _same(self, int t_id, const unsigned char *packed, int t_len):
+        return self.lengths[t_id] == t_len and memcmp(self.data + self.offsets[t_id], packed, (t_len + 3) >> 2) == 0
+
+    cdef Py_ssize_t _probe(self, const unsigned char *packed, int t_len):
+        cdef Py_ssize_t slot = self._slot_of(packed, t_len)
+        while self.slot_head[slot] != SLOT_EMPTY:
+            if self.slot_head[slot] >= 0 and self._same(self.slot_head[slot], packed, t_len):
+                return slot
+            slot = (slot + 1) & (self.n_slots - 1)
+        return -1
+
+    cdef int _table_add(self, int t_id) except -1:
+        cdef unsigned char *packed = self.data + self.offsets[t_id]
+        cdef int t_len = self.lengths[t_id]
+        cdef Py_ssize_t slot, free_slot = -1
+        if (self.slots_used + 1) * 2 > self.n_slots:
+            self._rehash()
+        slot = self._slot_of(packed, t_len)
+        while self.slot_head[slot] != SLOT_EMPTY:
+            if self.slot_head[slot] == SLOT_TOMB:
+                if free_slot == -1:
+                    free_slot = slot
+            elif self._same(self.slot_head[slot], packed, t_len):
+                # ids are always increasing so the chain stays sorted
+                self.next_same[self.slot_tail[slot]] = t_id
+                self.slot_tail[slot] = t_id
+                self.class_ids[t_id] = self.slot_head[slot]
+                return 0
+            slot = (slot + 1) & (self.n_slots - 1)
+        if free_slot == -1:
+            free_slot = slot
+            self.slots_used += 1
+        self.slot_head[free_slot] = t_id
+        self.slot_tail[free_slot] = t_id
+        return 0
+
+    cdef int _table_remove(self, int t_id) except -1:
+        cdef Py_ssize_t slot = self._probe(self.data + self.offsets[t_id], self.lengths[t_id])
+        cdef int prev = -1
+        cdef int cur = self.slot_head[slot]
+        while cur != t_id:
+            prev = cur
+            cur = self.next_same[cur]
+        if prev == -1:
+            self.slot_head[slot] = self.next_same[t_id]
+            # the next in the chain identifies the class
+            cur = self.slot_head[slot]
+            while cur != -1:
+                self.class_ids[cur] = self.slot_head[slot]
+                cur = self.next_same[cur]
+        else:
+            self.next_same[prev] = self.next_same[t_id]
+        if self.slot_tail[slot] == t_id:
+            self.slot_tail[slot] = prev
+        if self.slot_head[slot] == -1:
+            self.slot_head[slot] = SLOT_TOMB
+        self.next_same[t_id] = -1
+        return 0
+
+    cdef int _rehash(self) except -1:
+        cdef int *old_head = self.slot_head
+        cdef int *old_tail = self.slot_tail
+        cdef Py_ssize_t old_n = self.n_slots
+        cdef Py_ssize_t i, slot
+        cdef int head
+        self.n_slots = old_n * 2
+        self.slot_head = <int *> malloc(self.n_slots * sizeof(int))
+        self.slot_tail = <int *> malloc(self.n_slots * sizeof(int))
+        if not self.slot_head or not self.slot_tail:
+            free(old_head)
+            free(old_tail)
+            raise MemoryError()
+        for i in range(self.n_slots):
+            self.slot_head[i] = SLOT_EMPTY
+        self.slots_used = 0
+        for i in range(old_n):
+            head = old_head[i]
+            if head < 0:
+                continue
+            slot = self._slot_of(self.data + self.offsets[head], self.lengths[head])
+            while self.slot_head[slot] != SLOT_EMPTY:
+                slot = (slot + 1) & (self.n_slots - 1)
+            self.slot_head[slot] = head
+            self.slot_tail[slot] = old_tail[i]
+            self.slots_used += 1
+        free(old_head)
+        free(old_tail)
+        return 0
+
+
+def _restore(seqs):
+    """
+    Rebuild a pickled PackedTargets, None marks a retired target.
+    """
+    packed = PackedTargets()
+    for seq in seqs:
+        packed.append("" if seq is None else seq)
+    for t_id, seq in enumerate(seqs):
+        if seq is None:
+            packed.remove(t_id)
+    return packed
@@ -0,0 +1,245 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from pygas.alignercpu import AlignerCpu
+from pygas.classes import AlignmentBatch, Backtrack, PairedBatch, PairHit, ScoreMatrix
+from pygas.matrix import fill, revcomp
+from pygas.results import HIT_FIELDS, hit_fields
+from pygas.seqio import load_seqs
+
+PAIR_HEADER = (
+    ["#query_1", "query_2", "pair_id"]
+    + [f"{name}_1" for name in ("reversed", "t_id", "t_pos", "seq", "cigar", "md")]
+    + [f"{name}_2" for name in ("reversed", "t_id", "t_pos", "seq", "cigar", "md")]
+    + ["repeat_3-15..."]
+)
+PAIR_FIELDS = 1 + 2 * HIT_FIELDS  # pair_id then the hit fields of each half
+
+
+def split_read(read: str, split: int) -> Tuple[str, str]:
+    """
+    Halves of a read holding both guides, as "half_1<TAB>half_2" or split at a fixed position when split > 0.
+    """
+    if split > 0:
+        return read[:split], read[split:]
+    halves = read.split("\t")
+    if len(halves) != 2:
+        raise ValueError(f"Expected 2 tab separated halves: {read}")
+    return halves[0], halves[1]
+
+
+def load_pairs(path: str) -> List[Tuple[int, int]]:
+    """
+    Allowed pairs as "t_id_1<TAB>t_id_2" lines (0-based line numbers of the two target files), lines starting # are
+    skipped.
+    """
+    pairs = []
+    for line in load_seqs(path):
+        if not line or line.startswith("#"):
+            continue
+        cols = line.split("\t")
+        if len(cols) != 2:
+            raise ValueError(f"Expected 2 tab separated t_ids in {path}: {line}")
+        pairs.append((int(cols[0]), int(cols[1])))
+    return pairs
+
+
+@dataclass
+class PairedAligner:
+    """
+    Dual-guide alignment without expanding the N x M pair library.  Each half of a read is aligned to its own guide
+    library (targets_1, targets_2) by an AlignerCpu, so memory and per-read work scale with N + M.
+
+    pairs:
+        Allowed (t_id_1, t_id_2) combinations, pair_id is the index in this list.  When not set every combination is
+        allowed and pair_id is t_id_1 * len(targets_2) + t_id_2, the index in the expanded library
+        [t1 + t2 for t1 in targets_1 for t2 in targets_2].
+
+    Remaining fields are applied to both halves, see AlignerCpu.  A read maps when both halves align to an allowed
+    pair, only pairs at the best combined score are reported, as for the expanded library.  The best hits of each
+    half are paired first.  When they form no allowed pair, half 2 is aligned to every target in an allowed pair and
+    half 1 to the partners of those it hits, so this costs a scan of the pair targets for those reads only.
+    """
+
+    targets_1: List[str]
+    targets_2: List[str]
+    rules: List[str]
+    score_min: int
+    rev_comp: bool = True
+    match_type: int = 3
+    pairs: Optional[List[Tuple[int, int]]] = None
+    use_trie: bool = True
+    budget: int = 0
+
+    def __post_init__(self):
+        (self.aligner_1, self.aligner_2) = [
+            AlignerCpu(
+                targets=targets,
+                rules=self.rules,
+                score_min=self.score_min,
+                rev_comp=self.rev_comp,
+                match_type=self.match_type,
+                use_trie=self.use_trie,
+                budget=self.budget,
+            )
+            for targets in (self.targets_1, self.targets_2)
+        ]
+        self.targets_1 = self.aligner_1.targets
+        self.targets_2 = self.aligner_2.targets
+        self._pair_ids = None
+        self._partners = {}  # t_id_2: [(t_id_1, pair_id)] of the allowed pairs
+        if self.pairs is not None:
+            self._pair_ids = {}
+            for (pair_id, (t_id_1, t_id_2)) in enumerate(self.pairs):
+                if not (0 <= t_id_1 < len(self.targets_1) and 0 <= t_id_2 < len(self.targets_2)):
+                    raise ValueError(f"Pair {pair_id} ({t_id_1}, {t_id_2}) is outside the target libraries")
+                if (t_id_1, t_id_2) not in self._pair_ids:
+                    self._pair_ids[(t_id_1, t_id_2)] = pair_id
+                    self._partners.setdefault(t_id_2, []).append((t_id_1, pair_id))
+
+    def pair_id(self, t_id_1: int, t_id_2: int) -> Optional[int]:
+        """
+        None when the combination is not an allowed pair.
+        """
+        if self._pair_ids is None:
+            return t_id_1 * len(self.targets_2) + t_id_2
+        return self._pair_ids.get((t_id_1, t_id_2))
+
+    def align_pairs(self, reads: List[Tuple[str, str]]) -> PairedBatch:
+        """
+        Each distinct half is aligned once, reads are reported unmapped first then mapped, each in input order.
+        """
+        ab_1 = self.aligner_1.align_queries(list(dict.fromkeys(read[0] for read in reads)), keep_matrix=False)
+        ab_2 = self.aligner_2.align_queries(list(dict.fromkeys(read[1] for read in reads)), keep_matrix=False)
+        (hits_1, hits_2) = (_hits_by_query(ab_1), _hits_by_query(ab_2))
+        exceeded = (set(ab_1.budget_exceeded), set(ab_2.budget_exceeded))
+        unmapped = []
+        mapped = []
+        budget_exceeded = []
+        rescued = {}
+        for read in reads:
+            if read[0] in exceeded[0] or read[1] in exceeded[1]:
+                budget_exceeded.append(read)
+            pair_hits = []
+            for bt_1 in hits_1.get(read[0], []):
+                for bt_2 in hits_2.get(read[1], []):
+                    pair_id = self.pair_id(bt_1.sm.target_id, bt_2.sm.target_id)
+                    if pair_id is not None:
+                        pair_hits.append(PairHit(pair_id=pair_id, first=bt_1, second=bt_2))
+            if not pair_hits and read[0] in hits_1 and read[1] in hits_2 and self._pair_ids is not None:
+                if read not in rescued:
+                    rescued[read] = self._allowed_pair_hits(read)
+                pair_hits = rescued[read]
+            if not pair_hits:
+                unmapped.append(read)
+                continue
+            best = max(hit.score for hit in pair_hits)
+            mapped.append([hit for hit in pair_hits if hit.score == best])
+        return PairedBatch(unmapped=unmapped, mapped=mapped, budget_exceeded=budget_exceeded)
+
+    def _allowed_pair_hits(self, read: Tuple[str, str]) -> List[PairHit]:
+        """
+        Pairs of a read whose best hits form no allowed pair, from the hits of each half to targets that can still
+        form one.
+        """
+        hits_2 = _target_hits(self.aligner_2, read[1], sorted(self._partners))
+        t_ids_1 = sorted({t_id_1 for t_id_2 in hits_2 for (t_id_1, _) in self._partners[t_id_2]})
+        hits_1 = _target_hits(self.aligner_1, read[0], t_ids_1)
+        pair_hits = []
+        for (t_id_2, bts_2) in hits_2.items():
+            for (t_id_1, pair_id) in self._partners[t_id_2]:
+                for bt_1 in hits_1.get(t_id_1, []):
+                    pair_hits.extend(PairHit(pair_id=pair_id, first=bt_1, second=bt_2) for bt_2 in bts_2)
+        return pair_hits
+
+
+def _hits_by_query(ab: AlignmentBatch) -> Dict[str, List[Backtrack]]:
+    return {results[0].sm.original_seq: results for results in ab.mapped}
+
+
+def _target_hits(aligner: AlignerCpu, query: str, t_ids: List[int]) -> Dict[int, List[Backtrack]]:
+    """
+    Alignments of query at the best score of each target in t_ids, for targets scoring at least the minimum that
+    map_queries would apply.
+    """
+    strands = [(query, False)] + ([(revcomp(query), True)] if aligner.rev_comp else [])
+    hits = {}
+    for t_id in t_ids:
+        target = aligner.targets[t_id]
+        if target is None:
+            continue
+        min_score = max(aligner.score_min, min(len(target), len(query)) - aligner.max_penalty)
+        found = []
+        for (seq, rev) in strands:
+            (matrix, score) = fill(target, seq, min_score)
+            if score >= min_score:
+                found.append(
+                    ScoreMatrix(
+                        query=seq,
+                        target=target,
+                        target_id=t_id,
+                        score=score,
+                        matrix=matrix,
+                        reversed=rev,
+                        original_seq=query,
+                    )
+                )
+        if not found:
+            continue
+        best = max(sm.score for sm in found)
+        bts = [Backtrack(sm, aligner.match_type) for sm in found if sm.score == best]
+        for bt in bts:
+            bt.sm.matrix = None
+        bts = [bt for bt in bts if bt.pass_mode]
+        if bts:
+            hits[t_id] = bts
+    return hits
+
+
+def write_pairs(pb: PairedBatch, ofh: TextIO, with_score=False):
+    """
+    One line per read, unmapped reads have "." as pair_id.  with_score adds the combined score after query_2.
+    """
+    header = PAIR_HEADER[:2] + (["score"] if with_score else []) + PAIR_HEADER[2:]
+    lines = ["\t".join(header)]
+    for read in pb.unmapped:
+        lines.append("\t".join(list(read) + (["."] if with_score else []) + ["."]))
+    for pair_hits in pb.mapped:
+        cols = [pair_hits[0].first.sm.original_seq, pair_hits[0].second.sm.original_seq]
+        if with_score:
+            cols.append(str(pair_hits[0].score))
+        for hit in pair_hits:
+            cols.append(str(hit.pair_id))
+            cols.extend(hit_fields(hit.first))
+            cols.extend(hit_fields(hit.second))
+        lines.append("\t".join(cols))
+    ofh.write("\n".join(lines) + "\n")
@@ -0,0 +1,159 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Dict, List
+import random
+
+from pygas.constants import STRATEGY_EXACT, STRATEGY_SCAN, STRATEGY_TRIE
+from pygas.library import TargetLibrary
+
+CALIBRATION_QUERIES = 64  # per target length, half derived from targets and half random
+CALIBRATION_CHUNK = 8
+
+
+@dataclass
+class LibraryProfile:
+    """
+    Shape of a target library, duplication is the fraction of active targets equal to a lower t_id.
+    """
+
+    n_targets: int
+    n_distinct: int
+    lengths: Dict[int, int]
+    has_trie: bool
+    n_clusters: int = 0
+
+    @classmethod
+    def from_library(cls, library: TargetLibrary) -> "LibraryProfile":
+        targets = library.targets
+        n_distinct = sum(1 for t_id in range(len(targets)) if targets.class_of(t_id) == t_id)
+        return cls(
+            n_targets=len(library),
+            n_distinct=n_distinct,
+            lengths=library.length_counts,
+            has_trie=library.trie is not None,
+            n_clusters=library.n_clusters,
+        )
+
+    @property
+    def duplication(self) -> float:
+        if self.n_targets == 0:
+            return 0.0
+        return 1 - self.n_distinct / self.n_targets
+
+
+@dataclass
+class EnginePlan:
+    """
+    strategies:
+        Strategy of each query length, see map_queries.  STRATEGY_EXACT marks lengths where the aligner never reaches
+        the matrix stage (no rules).
+    timings:
+        Seconds per calibration query of each strategy tried, by query length.  A strategy abandoned once slower than
+        the best so far is timed over the queries it completed.
+    """
+
+    profile: LibraryProfile
+    strategies: Dict[int, str] = field(default_factory=dict)
+    timings: Dict[int, Dict[str, float]] = field(default_factory=dict)
+
+    def describe(self) -> List[str]:
+        p = self.profile
+        lengths = ",".join(f"{t_len}:{count}" for (t_len, count) in p.lengths.items())
+        lines = [
+            f"{p.n_targets} targets, {p.n_distinct} distinct ({p.duplication:.1%} duplicated), lengths {lengths}, "
+            f"trie {'built' if p.has_trie else 'not built'}, {p.n_clusters} clusters"
+        ]
+        for (q_len, strategy) in self.strategies.items():
+            timings = self.timings.get(q_len, {})
+            timed = ", ".join(f"{name} {secs * 1e6:.1f} us/query" for (name, secs) in timings.items())
+            lines.append(f"length {q_len}: {strategy}" + (f" ({timed})" if timed else ""))
+        return lines
+
+
+def calibration_queries(library: TargetLibrary, t_len: int, n_queries: int, rng: random.Random) -> List[str]:
+    """
+    Targets of length t_len with one substitution, alternating with random sequences of that length.  Random
+    sequences are the unmapped reads that make the matrix stage expensive.
+    """
+    targets = library.targets
+    queries = []
+    for _ in range(20 * n_queries):
+        if len(queries) >= n_queries // 2 or len(targets) == 0:
+            break
+        target = targets[rng.randrange(len(targets))]
+        if target is None or len(target) != t_len:
+            continue
+        pos = rng.randrange(t_len)
+        queries.append(target[:pos] + rng.choice([b for b in "ACGT" if b != target[pos]]) + target[pos + 1 :])
+    while len(queries) < n_queries:
+        queries.append("".join(rng.choice("ACGT") for _ in range(t_len)))
+    return queries
+
+
+def plan_engine(aligner, n_queries: int = CALIBRATION_QUERIES, seed: int = 0) -> EnginePlan:
+    """
+    Plan for an AlignerCpu, each target length is taken as a query length class.  The trie and the bounded scan give
+    the same results, the faster on the calibration queries is chosen.
+    """
+    library = aligner.library
+    plan = EnginePlan(profile=LibraryProfile.from_library(library))
+    rng = random.Random(seed)
+    for t_len in plan.profile.lengths:
+        if aligner.exact_only:
+            plan.strategies[t_len] = STRATEGY_EXACT
+            continue
+        if library.trie is None:
+            plan.strategies[t_len] = STRATEGY_SCAN
+            continue
+        queries = calibration_queries(library, t_len, n_queries, rng)
+        timings = {}
+        for strategy in (STRATEGY_TRIE, STRATEGY_SCAN):
+            limit = min(timings.values()) * len(queries) if timings else None
+            timings[strategy] = _time_strategy(aligner, queries, {t_len: strategy}, limit)
+        plan.timings[t_len] = timings
+        plan.strategies[t_len] = min(timings, key=timings.get)
+    return plan
+
+
+def _time_strategy(aligner, queries: List[str], strategies: Dict[int, str], limit: float = None) -> float:
+    """
+    Seconds per query, stopping once the total passes limit.
+    """
+    start = perf_counter()
+    done = 0
+    for c_start in range(0, len(queries), CALIBRATION_CHUNK):
+        chunk = queries[c_start : c_start + CALIBRATION_CHUNK]
+        aligner._align(chunk, keep_matrix=False, strategies=strategies)
+        done += len(chunk)
+        if limit is not None and perf_counter() - start > limit:
+            break
+    return (perf_counter() - start) / done
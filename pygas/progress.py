@@ -0,0 +1,140 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass
+from typing import Callable, Optional
+import os
+import sys
+import time
+
+from pygas.classes import AlignmentBatch
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def peak_rss() -> int:
+    """
+    Peak resident set size of this process in bytes, -1 when not available.
+    """
+    if resource is None:  # pragma: no cover
+        return -1
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss() -> int:
+    """
+    Resident set size of this process in bytes, the peak when the current size is not available (not linux).
+    """
+    try:
+        with open("/proc/self/statm") as ifh:
+            return int(ifh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):  # pragma: no cover
+        return peak_rss()
+
+
+@dataclass
+class Progress:
+    """
+    Throughput and outcome counts for AlignerCpu.align_queries, which aligns in chunks when given a Progress.
+
+    callback is called with report() at most once per interval seconds (checked after each chunk) and again by
+    finish().  Counts follow the output, a query is multi-mapped when more than one alignment has the best score.
+    total is None when the number of queries isn't known (streamed input), there is then no ETA.
+    """
+
+    total: Optional[int] = 0
+    interval: float = 60.0
+    callback: Optional[Callable[[dict], None]] = None
+
+    def __post_init__(self):
+        self.processed = 0
+        self.mapped = 0
+        self.unmapped = 0
+        self.multi_mapped = 0
+        self.budget_exceeded = 0
+        self.start = time.monotonic()
+        self._last_report = self.start
+
+    def update(self, ab: AlignmentBatch):
+        self.processed += ab.total_reads
+        self.mapped += len(ab.mapped)
+        self.unmapped += len(ab.unmapped)
+        self.budget_exceeded += len(ab.budget_exceeded)
+        for results in ab.mapped:
+            max_score = max([bt.sm.score for bt in results])
+            if sum(bt.sm.score == max_score for bt in results) > 1:
+                self.multi_mapped += 1
+        now = time.monotonic()
+        if self.callback is not None and now - self._last_report >= self.interval:
+            self._last_report = now
+            self.callback(self.report())
+
+    def finish(self) -> dict:
+        report = self.report()
+        if self.callback is not None:
+            self.callback(report)
+        return report
+
+    def report(self) -> dict:
+        elapsed = time.monotonic() - self.start
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        remaining = None if self.total is None else max(self.total - self.processed, 0)
+        return {
+            "processed": self.processed,
+            "total": self.total,
+            "elapsed_s": round(elapsed, 3),
+            "queries_per_s": round(rate, 1),
+            "eta_s": round(remaining / rate, 1) if rate > 0 and remaining is not None else None,
+            "mapped": self.mapped,
+            "unmapped": self.unmapped,
+            "multi_mapped": self.multi_mapped,
+            "budget_exceeded": self.budget_exceeded,
+            "mapped_rate": self._fraction(self.mapped),
+            "unmapped_rate": self._fraction(self.unmapped),
+            "multi_mapped_rate": self._fraction(self.multi_mapped),
+            "peak_rss_bytes": peak_rss(),
+        }
+
+    def _fraction(self, count: int) -> float:
+        return round(count / self.processed, 4) if self.processed else 0.0
+
+
+def format_report(report: dict) -> str:
+    eta = "?" if report["eta_s"] is None else f"{report['eta_s']:.0f}s"
+    total = "?" if report["total"] is None else report["total"]
+    return (
+        f"{report['processed']}/{total} queries, {report['queries_per_s']:.1f}/s, ETA {eta}, "
+        f"mapped {report['mapped_rate']:.2%}, unmapped {report['unmapped_rate']:.2%}, "
+        f"multi-mapped {report['multi_mapped_rate']:.2%}, budget exceeded {report['budget_exceeded']}, peak RSS {report['peak_rss_bytes'] / 2**20:.1f} MiB"
+    )
@@ -0,0 +1,212 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, TextIO
+import gzip
+
+from pygas.classes import AlignmentBatch, Backtrack
+
+HEADER = ["#query", "reversed", "t_id", "t_pos", "seq", "cigar", "md", "repeat_2-7..."]
+HIT_FIELDS = 6  # reversed, t_id, t_pos, seq, cigar, md
+UNMAPPED = [".", ".", ".", "."]
+STATUS_MAPPED = "mapped"
+STATUS_UNMAPPED = "unmapped"
+STATUS_BUDGET = "budget_exceeded"
+WRITE_BATCH = 10000  # rows formatted per write() call
+
+
+@dataclass
+class ResultRow:
+    """
+    One line of output, each hit is the text fields of an alignment at the best score (see HIT_FIELDS).
+
+    score:
+        Best score of the query, None when unmapped.  Only written when requested, it is needed to merge the output of
+        target shards.
+    budget_exceeded:
+        Alignment stopped at the per-query budget, hits are the best found so far.  Written as the status column when
+        requested.
+    """
+
+    query: str
+    score: Optional[int] = None
+    hits: List[List[str]] = field(default_factory=list)
+    budget_exceeded: bool = False
+
+    @property
+    def mapped(self) -> bool:
+        return self.score is not None
+
+    @property
+    def status(self) -> str:
+        if self.budget_exceeded:
+            return STATUS_BUDGET
+        return STATUS_MAPPED if self.mapped else STATUS_UNMAPPED
+
+    def fields(self, with_score=False, with_status=False) -> List[str]:
+        cols = [self.query]
+        if with_score:
+            cols.append(str(self.score) if self.mapped else ".")
+        if with_status:
+            cols.append(self.status)
+        if not self.mapped:
+            return cols + UNMAPPED
+        for hit in self.hits:
+            cols.extend(hit)
+        return cols
+
+    @classmethod
+    def parse(cls, line: str, with_status=False) -> "ResultRow":
+        """
+        Parse a line written with a score column.
+        """
+        cols = line.rstrip("\n").split("\t")
+        row = cls(query=cols[0])
+        if with_status:
+            row.budget_exceeded = cols.pop(2) == STATUS_BUDGET
+        if cols[1] == ".":
+            return row
+        row.score = int(cols[1])
+        cols = cols[2:]
+        row.hits = [cols[i : i + HIT_FIELDS] for i in range(0, len(cols), HIT_FIELDS)]
+        return row
+
+
+def hit_fields(bt: Backtrack) -> List[str]:
+    """
+    Text fields of one alignment, see HIT_FIELDS.
+    """
+    sm = bt.sm
+    return [str(sm.reversed), str(sm.target_id), str(bt.t_pos), sm.query, bt.cigar, bt.md]
+
+
+def batch_rows(ab: AlignmentBatch) -> List[ResultRow]:
+    """
+    Output rows of an AlignmentBatch, unmapped queries first, only alignments at the best score of a query are kept.
+    """
+    exceeded = set(ab.budget_exceeded)
+    rows = [ResultRow(query=seq, budget_exceeded=seq in exceeded) for seq in ab.unmapped]
+    for results in ab.mapped:
+        max_score = max([bt.sm.score for bt in results])
+        query = results[0].sm.original_seq
+        row = ResultRow(query=query, score=max_score, budget_exceeded=query in exceeded)
+        for bt in results:
+            if bt.sm.score == max_score:
+                row.hits.append(hit_fields(bt))
+        rows.append(row)
+    return rows
+
+
+def write_rows(rows: Iterable[ResultRow], ofh: TextIO, with_score=False, with_status=False):
+    header = HEADER[:1] + (["score"] if with_score else []) + (["status"] if with_status else []) + HEADER[1:]
+    ofh.write("\t".join(header) + "\n")
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, WRITE_BATCH))
+        if not batch:
+            break
+        ofh.write("".join(["\t".join(row.fields(with_score, with_status)) + "\n" for row in batch]))
+
+
+def read_rows(path: str) -> Dict[str, ResultRow]:
+    """
+    Load output written with a score column, keyed by query.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    rows = {}
+    with opener(path, "rt") as ifh:
+        header = ifh.readline().rstrip("\n").split("\t")
+        if header[:2] != ["#query", "score"]:
+            raise ValueError(f"{path} has no score column, shards must be written with --score")
+        with_status = header[2] == "status"
+        for line in ifh:
+            row = ResultRow.parse(line, with_status)
+            rows[row.query] = row
+    return rows
+
+
+def merge_rows(queries: List[str], shards: List[Dict[str, ResultRow]]) -> List[ResultRow]:
+    """
+    Combine the rows of target shards aligned against the same queries.
+
+    A query is mapped if any shard maps it, only hits at the best score over all shards are kept (in shard order).  A
+    query that exceeded its budget in any shard is flagged as such.
+    Rows are ordered as batch_rows() would for a single run, unmapped first then mapped, each in query order.
+
+    The result matches a single run over all targets except when, for a query:
+
+    - one shard maps it in the exact/substring stage and another doesn't.  A single run stops at those hits and never
+      runs the matrix stage, the other shard's matrix hits are kept by the merge if they score at least as well.
+    - match_type is not 3 and backtrack rejects a best scoring alignment.  A single run reports the remaining hits of
+      that query (or none), a shard without the rejected target reports its own best hits.
+    - a budget is set, it is spent per shard so a shard can finish a query that a single run would stop early.
+    """
+    unmapped = []
+    mapped = []
+    for query in queries:
+        shard_rows = []
+        for s_idx, shard in enumerate(shards):
+            if query not in shard:
+                raise ValueError(f"Query {query} is missing from shard {s_idx}")
+            shard_rows.append(shard[query])
+        scores = [row.score for row in shard_rows if row.mapped]
+        exceeded = any(row.budget_exceeded for row in shard_rows)
+        if not scores:
+            unmapped.append(ResultRow(query=query, budget_exceeded=exceeded))
+            continue
+        merged = ResultRow(query=query, score=max(scores), budget_exceeded=exceeded)
+        for row in shard_rows:
+            if row.score == merged.score:
+                merged.hits.extend(row.hits)
+        mapped.append(merged)
+    return unmapped + mapped
+
+
+def merge_batches(queries: List[str], batches: List[AlignmentBatch]) -> AlignmentBatch:
+    """
+    API equivalent of merge_rows() for the AlignmentBatch of each target shard.
+
+    Mapped results only retain Backtrack objects at the best score over all shards.  See merge_rows() for when this
+    differs from a single run.
+    """
+    by_query = [{results[0].sm.original_seq: results for results in ab.mapped} for ab in batches]
+    exceeded = {query for ab in batches for query in ab.budget_exceeded}
+    unmapped = []
+    mapped = []
+    for query in queries:
+        results = [bt for shard in by_query for bt in shard.get(query, [])]
+        if not results:
+            unmapped.append(query)
+            continue
+        max_score = max([bt.sm.score for bt in results])
+        mapped.append([bt for bt in results if bt.sm.score == max_score])
+    budget_exceeded = [query for query in queries if query in exceeded]
+    return AlignmentBatch(unmapped=unmapped, mapped=mapped, budget_exceeded=budget_exceeded)
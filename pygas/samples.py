@@ -0,0 +1,132 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass
+from itertools import islice
+from typing import Dict, Iterator, List, TextIO
+import os
+
+from pygas.alignercpu import AlignerCpu
+from pygas.progress import Progress
+from pygas.results import HEADER, WRITE_BATCH, ResultRow, batch_rows, write_rows
+
+SEQ_SUFFIXES = (".gz", ".txt", ".seq", ".tsv")
+
+
+def sample_name(path: str) -> str:
+    """
+    File name without directory or sequence file suffixes, e.g. "/data/S1.txt.gz" is "S1".
+    """
+    name = os.path.basename(path)
+    while True:
+        stem = next((name[: -len(sfx)] for sfx in SEQ_SUFFIXES if name.endswith(sfx) and len(name) > len(sfx)), None)
+        if stem is None:
+            return name
+        name = stem
+
+
+@dataclass
+class MultiSampleRun:
+    """
+    Align several samples against one library, each distinct sequence is aligned once however many samples (or times
+    within a sample) it occurs in.
+
+    samples:
+        Queries of each sample by name, in output order.
+    """
+
+    aligner: AlignerCpu
+    samples: Dict[str, List[str]]
+
+    def __post_init__(self):
+        self.distinct = list(dict.fromkeys(seq for queries in self.samples.values() for seq in queries))
+        self._rows = None
+
+    @property
+    def n_queries(self) -> int:
+        return sum(len(queries) for queries in self.samples.values())
+
+    def align(self, progress: Progress = None):
+        ab = self.aligner.align_queries(self.distinct, keep_matrix=False, progress=progress)
+        self._rows = {row.query: row for row in batch_rows(ab)}
+
+    def row(self, seq: str) -> ResultRow:
+        if self._rows is None:
+            raise ValueError("Samples are not aligned, call align() first")
+        return self._rows[seq]
+
+    def rows(self, name: str) -> Iterator[ResultRow]:
+        """
+        Rows of one sample as written by a single sample run, unmapped first then mapped, each in input order.
+        """
+        return self._ordered(self.samples[name])
+
+    def counts(self) -> Dict[str, List[int]]:
+        """
+        Occurrences of each distinct sequence in each sample, in the order of samples.
+        """
+        counts = {seq: [0] * len(self.samples) for seq in self.distinct}
+        for (s_idx, queries) in enumerate(self.samples.values()):
+            for seq in queries:
+                counts[seq][s_idx] += 1
+        return counts
+
+    def write(self, name: str, ofh: TextIO, with_score=False, with_status=False):
+        write_rows(self.rows(name), ofh, with_score=with_score, with_status=with_status)
+
+    def write_counts(self, ofh: TextIO, with_score=False, with_status=False):
+        """
+        One row per distinct sequence (unmapped first then mapped, each in first seen order) with a count column per
+        sample after the query.
+        """
+        counts = self.counts()
+        header = (
+            HEADER[:1]
+            + [f"count_{name}" for name in self.samples]
+            + (["score"] if with_score else [])
+            + (["status"] if with_status else [])
+            + HEADER[1:]
+        )
+        ofh.write("\t".join(header) + "\n")
+        lines = (
+            "\t".join(fields[:1] + [str(n) for n in counts[fields[0]]] + fields[1:]) + "\n"
+            for fields in (row.fields(with_score, with_status) for row in self._ordered(self.distinct))
+        )
+        while True:
+            batch = list(islice(lines, WRITE_BATCH))
+            if not batch:
+                break
+            ofh.write("".join(batch))
+
+    def _ordered(self, seqs: List[str]) -> Iterator[ResultRow]:
+        for mapped in (False, True):
+            for seq in seqs:
+                row = self.row(seq)
+                if row.mapped == mapped:
+                    yield row
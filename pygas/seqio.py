@@ -0,0 +1,279 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, List, Optional, TextIO, Tuple
+import gzip
+import queue
+import struct
+import sys
+import threading
+import zlib
+
+BGZF_BLOCK = 65280  # maximum uncompressed bytes per block, as htslib
+# empty block marking the end of a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+OUTPUT_BUFFER = 1 << 20
+GZIP_MAGIC = b"\x1f\x8b"
+READ_CHUNK = 1 << 20  # bytes per read of plain text or gzip input
+READ_AHEAD = 64  # chunks or BGZF blocks decompressed ahead of the consumer
+
+
+def is_bgzf(path: str) -> bool:
+    with open(path, "rb") as fh:
+        header = fh.read(18)
+    return len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+
+def bgzf_blocks(fh: BinaryIO) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Raw deflate data, CRC32 and uncompressed size of each block of a BGZF file, without decompressing.
+    """
+    while True:
+        header = fh.read(12)
+        if not header:
+            return
+        if len(header) < 12 or header[:4] != b"\x1f\x8b\x08\x04":
+            raise ValueError("Invalid BGZF block header")
+        xlen = int.from_bytes(header[10:12], "little")
+        extra = fh.read(xlen)
+        block_size = None
+        i = 0
+        while i + 4 <= len(extra):
+            slen = int.from_bytes(extra[i + 2 : i + 4], "little")
+            if extra[i : i + 2] == b"BC" and slen == 2:
+                block_size = int.from_bytes(extra[i + 4 : i + 6], "little") + 1
+            i += 4 + slen
+        if block_size is None:
+            raise ValueError("BGZF block has no BC field")
+        rest = fh.read(block_size - 12 - xlen)
+        if len(rest) != block_size - 12 - xlen:
+            raise ValueError("Truncated BGZF block")
+        (crc, size) = struct.unpack("<II", rest[-8:])
+        yield rest[:-8], crc, size
+
+
+def inflate_block(deflated: bytes, crc: int, size: int) -> bytes:
+    try:
+        data = zlib.decompress(deflated, -15)
+    except zlib.error as e:
+        raise ValueError(f"Corrupt BGZF block: {e}")
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise ValueError("BGZF block failed its CRC/size check")
+    return data
+
+
+@dataclass
+class SeqReader:
+    """
+    Iterates the sequences of a file, one per line, plain text, gzip or BGZF.  Reading starts in a background thread
+    on construction so it overlaps with other work, up to READ_AHEAD chunks are held until consumed.
+
+    threads:
+        BGZF blocks are decompressed by this many worker threads, each block records its compressed size so blocks are
+        found without inflating them.  Other gzip files, including multi-member ones (concatenated or pigz output), are
+        decompressed as one stream by the read-ahead thread: a plain member's end is only known once it is inflated.
+        0 decompresses BGZF in the read-ahead thread.
+    """
+
+    path: str
+    threads: int = 1
+
+    def __post_init__(self):
+        self._queue = queue.Queue(maxsize=READ_AHEAD)
+        self._stop = threading.Event()
+        bgzf = is_bgzf(self.path)
+        self._pool = None
+        if bgzf and self.threads:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="bgzf")
+        self._thread = threading.Thread(target=self._produce, args=(bgzf,), daemon=True)
+        self._thread.start()
+
+    def __iter__(self) -> Iterator[str]:
+        tail = b""
+        for chunk in self._chunks():
+            data = tail + chunk
+            cut = data.rfind(b"\n")
+            if cut < 0:
+                tail = data
+                continue
+            tail = data[cut + 1 :]
+            for line in data[:cut].decode().split("\n"):
+                yield line.strip()
+        if tail:
+            yield tail.decode().strip()
+
+    def close(self):
+        """
+        Stop reading early, not needed once iteration has finished.
+        """
+        self._stop.set()
+        self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    def _chunks(self) -> Iterator[bytes]:
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item.result() if isinstance(item, Future) else item
+        finally:
+            self.close()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _produce(self, bgzf: bool):
+        try:
+            with open(self.path, "rb") as fh:
+                if bgzf:
+                    for block in bgzf_blocks(fh):
+                        if self._stop.is_set():
+                            return
+                        self._put(self._pool.submit(inflate_block, *block) if self._pool else inflate_block(*block))
+                    return
+                compressed = fh.read(2) == GZIP_MAGIC
+                fh.seek(0)
+                source = gzip.GzipFile(fileobj=fh) if compressed else fh
+                while not self._stop.is_set():
+                    chunk = source.read(READ_CHUNK)
+                    if not chunk:
+                        return
+                    self._put(chunk)
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(None)
+
+
+def load_seqs(path: str, threads: int = 1) -> List[str]:
+    """
+    Sequences one per line, plain text, gzip or BGZF (see SeqReader).
+    """
+    return list(SeqReader(path, threads=threads))
+
+
+def bgzf_block(data: bytes, level: int = 6) -> bytes:
+    """
+    One BGZF block, a gzip member with the total block size in a BC extra field.  At most BGZF_BLOCK bytes of data.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25)
+    return header + deflated + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+@dataclass
+class BgzfWriter:
+    """
+    Text file object writing block gzip (BGZF), readable by gzip/zcat and indexable by htslib tools.
+
+    threads:
+        Blocks are compressed by this many background threads while the caller keeps formatting, 0 compresses in the
+        calling thread.  Blocks are written in order, at most 4 per thread are held in memory.
+    """
+
+    path: str
+    threads: int = 1
+    level: int = 6
+
+    def __post_init__(self):
+        self._fh = open(self.path, "wb")
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="bgzf") if self.threads else None
+        self._buffer = bytearray()
+        self._pending = deque()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+    def write(self, text: str) -> int:
+        self._buffer += text.encode()
+        if len(self._buffer) >= BGZF_BLOCK:
+            full = len(self._buffer) - len(self._buffer) % BGZF_BLOCK
+            for start in range(0, full, BGZF_BLOCK):
+                self._submit(bytes(self._buffer[start : start + BGZF_BLOCK]))
+            del self._buffer[:full]
+        return len(text)
+
+    def flush(self):
+        """
+        Compress and write everything buffered, ending the current block early.
+        """
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._fh.write(self._pending.popleft().result())
+        self._fh.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+            self._fh.write(BGZF_EOF)
+        finally:
+            self._fh.close()
+            if self._pool is not None:
+                self._pool.shutdown()
+            self.closed = True
+
+    def _submit(self, data: bytes):
+        if self._pool is None:
+            self._fh.write(bgzf_block(data, self.level))
+            return
+        self._pending.append(self._pool.submit(bgzf_block, data, self.level))
+        while self._pending and (len(self._pending) > 4 * self.threads or self._pending[0].done()):
+            self._fh.write(self._pending.popleft().result())
+
+
+def open_output(path: Optional[str], threads: int = 1) -> TextIO:
+    """
+    stdout when path is not set, BGZF for a .gz path (see BgzfWriter) otherwise a text file with a large buffer.
+    """
+    if not path:
+        return sys.stdout
+    if path.endswith(".gz"):
+        return BgzfWriter(path, threads=threads)
+    return open(path, "w", buffering=OUTPUT_BUFFER)
@@ -0,0 +1,258 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, TextIO, Tuple
+import asyncio
+import json
+import logging
+import os
+import time
+
+from pygas.alignercpu import AlignerCpu
+from pygas.library import TargetLibrary
+from pygas.results import batch_rows, write_rows
+from pygas.seqio import load_seqs, open_output
+
+JOB_DEFAULTS = {
+    "id": None,
+    "library": None,
+    "queries": None,
+    "queries_file": None,
+    "output": None,
+    "minscore": 15,
+    "rules": ["M"],
+    "rc": True,
+    "budget": 0,
+    "score": False,
+    "status": False,
+}
+COMMANDS = ("libraries", "shutdown")
+
+
+def parse_library_spec(spec: str) -> Tuple[str, str]:
+    """
+    NAME=PATH, or PATH where the name is the file name up to the first '.'.
+    """
+    if "=" in spec:
+        name, path = spec.split("=", 1)
+    else:
+        path = spec
+        name = os.path.basename(path).split(".", 1)[0]
+    if not name or not path:
+        raise ValueError(f"Invalid library '{spec}', expected NAME=PATH")
+    return name, path
+
+
+def parse_job(request: dict) -> dict:
+    """
+    Validate an alignment job and fill in the defaults (JOB_DEFAULTS), options match those of pygas run.
+    """
+    unknown = sorted(set(request) - set(JOB_DEFAULTS))
+    if unknown:
+        raise ValueError(f"Unknown job field(s): {', '.join(unknown)}")
+    job = {**JOB_DEFAULTS, **request}
+    if (job["queries"] is None) == (job["queries_file"] is None):
+        raise ValueError("A job needs one of queries or queries_file")
+    if job["queries"] is not None and not _is_str_list(job["queries"]):
+        raise ValueError("queries must be a list of sequences")
+    if not _is_str_list(job["rules"]):
+        raise ValueError('rules must be a list of strings, e.g. ["M"]')
+    for key in ("minscore", "budget"):
+        if not isinstance(job[key], int) or isinstance(job[key], bool):
+            raise ValueError(f"{key} must be an integer")
+    for key in ("rc", "score", "status"):
+        if not isinstance(job[key], bool):
+            raise ValueError(f"{key} must be true or false")
+    for key in ("library", "queries_file", "output"):
+        if job[key] is not None and not isinstance(job[key], str):
+            raise ValueError(f"{key} must be a string")
+    return job
+
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+@dataclass
+class AlignmentServer:
+    """
+    Holds target libraries in memory and aligns jobs against them, avoiding the per-file start up and index build of
+    pygas run.
+
+    Requests and responses are JSON objects, one per line.  A job is an object with the fields of JOB_DEFAULTS, e.g.:
+
+        {"id": "s1", "library": "lib", "queries_file": "s1.txt", "output": "s1.tsv", "minscore": 18}
+
+    library may be omitted when only one is loaded.  With output the rows are written to that file exactly as pygas run
+    would, otherwise they are streamed back as {"id": ..., "row": [fields]} after each chunk of chunk_size queries (rows
+    are ordered unmapped then mapped within a chunk).  Every job ends with {"id": ..., "done": true, ...counts} or
+    {"id": ..., "error": "..."}.  {"command": "libraries"} lists the loaded libraries and {"command": "shutdown"}
+    stops the server.
+
+    Aligners are cached per library and rule set, each library is indexed once and shared between them.
+    """
+
+    libraries: Dict[str, List[str]]
+    use_trie: bool = True
+    chunk_size: int = 10000
+
+    def __post_init__(self):
+        self._libraries = {
+            name: TargetLibrary(targets, use_trie=self.use_trie) for (name, targets) in self.libraries.items()
+        }
+        self._aligners = {}
+        self.jobs = 0
+        self.stopped = False
+
+    def aligner(self, job: dict) -> AlignerCpu:
+        name = job["library"]
+        if name is None:
+            if len(self._libraries) != 1:
+                raise ValueError(f"library is required, loaded: {', '.join(sorted(self._libraries))}")
+            name = next(iter(self._libraries))
+        if name not in self._libraries:
+            raise ValueError(f"Unknown library '{name}'")
+        key = (name, tuple(job["rules"]), job["minscore"], bool(job["rc"]), job["budget"])
+        if key not in self._aligners:
+            self._aligners[key] = AlignerCpu(
+                targets=self._libraries[name],
+                rules=job["rules"],
+                score_min=job["minscore"],
+                rev_comp=bool(job["rc"]),
+                budget=job["budget"],
+            )
+        return self._aligners[key]
+
+    def handle(self, request: dict) -> Iterator[dict]:
+        """
+        Responses to one request, rows are yielded as they become available.
+        """
+        if "command" in request:
+            if request["command"] not in COMMANDS:
+                yield {"error": f"Unknown command '{request['command']}'"}
+            elif request["command"] == "shutdown":
+                self.stopped = True
+                yield {"done": True}
+            else:
+                yield {"libraries": {name: len(library) for (name, library) in self._libraries.items()}}
+            return
+        job_id = request.get("id")
+        try:
+            job = parse_job(request)
+            aligner = self.aligner(job)
+            queries = job["queries"] if job["queries"] is not None else load_seqs(job["queries_file"])
+            start = time.perf_counter()
+            counts = {"queries": len(queries), "mapped": 0, "unmapped": 0, "budget_exceeded": 0}
+            if job["output"]:
+                rows = batch_rows(aligner.align_queries(queries, keep_matrix=False))
+                _count_rows(rows, counts)
+                with open_output(job["output"]) as ofh:
+                    write_rows(rows, ofh, with_score=job["score"], with_status=job["status"])
+            else:
+                for i in range(0, len(queries), self.chunk_size):
+                    rows = batch_rows(aligner.align_queries(queries[i : i + self.chunk_size], keep_matrix=False))
+                    _count_rows(rows, counts)
+                    for row in rows:
+                        yield {"id": job_id, "row": row.fields(job["score"], job["status"])}
+        except (OSError, ValueError) as e:
+            yield {"id": job_id, "error": str(e)}
+            return
+        except Exception as e:  # a failed job must not stop the server
+            logging.exception(f"Job {job_id} failed")
+            yield {"id": job_id, "error": f"{type(e).__name__}: {e}"}
+            return
+        self.jobs += 1
+        yield {"id": job_id, "done": True, **counts, "seconds": round(time.perf_counter() - start, 6)}
+
+    def serve_stream(self, ifh: TextIO, ofh: TextIO):
+        """
+        Answer requests read from ifh until end of input or shutdown, e.g. stdin/stdout.
+        """
+        for line in ifh:
+            if not line.strip():
+                continue
+            for response in self._respond(line):
+                print(json.dumps(response), file=ofh, flush=True)
+            if self.stopped:
+                break
+
+    async def serve_unix(self, path: str):
+        """
+        Listen on a Unix socket until a shutdown request, jobs from concurrent connections are aligned one at a time.
+        """
+        loop = asyncio.get_running_loop()
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pygas")
+        stop = asyncio.Event()
+
+        async def connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                while not reader.at_eof():
+                    line = (await reader.readline()).decode()
+                    if not line.strip():
+                        continue
+                    responses = self._respond(line)
+                    while True:
+                        response = await loop.run_in_executor(pool, next, responses, None)
+                        if response is None:
+                            break
+                        writer.write(json.dumps(response).encode() + b"\n")
+                        await writer.drain()
+                    if self.stopped:
+                        stop.set()
+                        break
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(connection, path=path)
+        logging.info(f"Listening on {path}")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            pool.shutdown(wait=False)
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _respond(self, line: str) -> Iterator[dict]:
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            return iter([{"error": f"Invalid JSON: {e}"}])
+        if not isinstance(request, dict):
+            return iter([{"error": "Request must be a JSON object"}])
+        return self.handle(request)
+
+
+def _count_rows(rows, counts: dict):
+    for row in rows:
+        counts["mapped" if row.mapped else "unmapped"] += 1
+        counts["budget_exceeded"] += row.budget_exceeded
@@ -0,0 +1,231 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+import math
+import random
+
+from pygas.matrix import revcomp
+from pygas.results import ResultRow
+
+BASES = "ACGT"
+TRUTH_HEADER = ["#read", "t_id", "reversed", "substitutions", "insertions", "deletions", "duplicate_of"]
+
+
+def parse_lengths(spec: str) -> Dict[int, float]:
+    """
+    Length distribution from "20" or "19:0.1,20:0.8,21:0.1", weights are relative and default to 1.
+    """
+    lengths = {}
+    for item in spec.split(","):
+        (length, _, weight) = item.partition(":")
+        lengths[int(length)] = float(weight) if weight else 1.0
+    if not lengths or min(lengths) < 1 or min(lengths.values()) <= 0:
+        raise ValueError(f"Invalid length distribution: {spec}")
+    return lengths
+
+
+@dataclass
+class LibrarySpec:
+    """
+    Target library of unique random sequences.
+
+    n_prefixes:
+        When non-zero every target starts with one of this many shared random prefixes of prefix_length, mimicking
+        libraries built around common scaffolds.
+    """
+
+    n_targets: int
+    lengths: Dict[int, float]
+    n_prefixes: int = 0
+    prefix_length: int = 8
+    seed: int = 0
+
+    def __post_init__(self):
+        if self.n_prefixes and self.prefix_length >= min(self.lengths):
+            raise ValueError("prefix_length must be shorter than every target length")
+        unique = sum(4 ** (length - self._prefix_len()) for length in self.lengths)
+        if self.n_targets > unique * max(1, self.n_prefixes):
+            raise ValueError("More targets requested than unique sequences available")
+
+    def _prefix_len(self) -> int:
+        return self.prefix_length if self.n_prefixes else 0
+
+    def generate(self) -> List[str]:
+        rng = random.Random(self.seed)
+        prefixes = ["".join(rng.choices(BASES, k=self.prefix_length)) for _ in range(self.n_prefixes)] or [""]
+        lengths = list(self.lengths)
+        weights = list(self.lengths.values())
+        seen = set()
+        targets = []
+        while len(targets) < self.n_targets:
+            prefix = rng.choice(prefixes)
+            length = rng.choices(lengths, weights)[0]
+            target = prefix + "".join(rng.choices(BASES, k=length - len(prefix)))
+            if target in seen:
+                continue
+            seen.add(target)
+            targets.append(target)
+        return targets
+
+
+@dataclass
+class ReadSpec:
+    """
+    Reads drawn from a target library.
+
+    Substitution, insertion and deletion rates are per base, the other rates are per read.  A duplicate repeats one of
+    the last dup_window reads exactly, a noise read is random sequence that is not derived from a target.
+    """
+
+    n_reads: int
+    substitution_rate: float = 0.0
+    insertion_rate: float = 0.0
+    deletion_rate: float = 0.0
+    revcomp_rate: float = 0.0
+    duplicate_rate: float = 0.0
+    noise_rate: float = 0.0
+    seed: int = 0
+    dup_window: int = 1000
+
+    def __post_init__(self):
+        rates = [
+            self.substitution_rate,
+            self.insertion_rate,
+            self.deletion_rate,
+            self.revcomp_rate,
+            self.duplicate_rate,
+            self.noise_rate,
+        ]
+        if min(rates) < 0 or max(rates) > 1:
+            raise ValueError("Rates must be between 0 and 1")
+        if self.substitution_rate + self.insertion_rate + self.deletion_rate >= 1:
+            raise ValueError("Combined per base error rate must be below 1")
+
+    def generate(self, targets: List[str]) -> Iterator[Tuple[str, list]]:
+        """
+        Yields (read, truth) where truth holds the TRUTH_HEADER fields after the read, t_id is None for noise.
+        """
+        rng = random.Random(self.seed)
+        error_rate = self.substitution_rate + self.insertion_rate + self.deletion_rate
+        log_keep = math.log(1 - error_rate) if error_rate > 0 else None
+        recent = []  # ring buffer of (r_idx, read, truth) that duplicates are drawn from
+        for r_idx in range(self.n_reads):
+            if recent and rng.random() < self.duplicate_rate:
+                (o_idx, read, truth) = rng.choice(recent)
+                yield (read, truth[:-1] + [o_idx])
+                continue
+            if rng.random() < self.noise_rate:
+                read = "".join(rng.choices(BASES, k=len(rng.choice(targets))))
+                truth = [None, False, 0, 0, 0, None]
+            else:
+                t_id = rng.randrange(len(targets))
+                (read, counts) = self._mutate(targets[t_id], rng, log_keep)
+                reverse = rng.random() < self.revcomp_rate
+                if reverse:
+                    read = revcomp(read)
+                truth = [t_id, reverse] + counts + [None]
+            if len(recent) < self.dup_window:
+                recent.append((r_idx, read, truth))
+            else:
+                recent[r_idx % self.dup_window] = (r_idx, read, truth)
+            yield (read, truth)
+
+    def _mutate(self, seq: str, rng: random.Random, log_keep: Optional[float]) -> Tuple[str, List[int]]:
+        counts = [0, 0, 0]
+        if log_keep is None:
+            return (seq, counts)
+        error_rate = self.substitution_rate + self.insertion_rate + self.deletion_rate
+        read = list(seq)
+        # skip to the next error with a geometric draw, only a few random numbers per read at realistic rates
+        pos = int(math.log(1 - rng.random()) / log_keep)
+        while pos < len(read):
+            event = rng.random() * error_rate
+            if event < self.substitution_rate:
+                read[pos] = rng.choice(BASES.replace(read[pos], ""))
+                counts[0] += 1
+            elif event < self.substitution_rate + self.insertion_rate:
+                read.insert(pos, rng.choice(BASES))
+                counts[1] += 1
+                pos += 1
+            elif len(read) > 1:
+                del read[pos]
+                counts[2] += 1
+                pos -= 1
+            pos += 1 + int(math.log(1 - rng.random()) / log_keep)
+        return ("".join(read), counts)
+
+
+def write_truth(reads: Iterator[Tuple[str, list]], q_fh: TextIO, truth_fh: TextIO) -> int:
+    """
+    Write reads one per line and the truth table, returns the number of reads.
+    """
+    print("\t".join(TRUTH_HEADER), file=truth_fh)
+    n_reads = 0
+    for (read, truth) in reads:
+        print(read, file=q_fh)
+        print("\t".join([read] + ["." if value is None else str(value) for value in truth]), file=truth_fh)
+        n_reads += 1
+    return n_reads
+
+
+def read_truth(path: str) -> List[Tuple[str, Optional[int], bool]]:
+    """
+    Load (read, t_id, reversed) from a truth file, t_id is None for noise.
+    """
+    truth = []
+    with open(path) as ifh:
+        for line in ifh:
+            if line.startswith("#"):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            truth.append((cols[0], None if cols[1] == "." else int(cols[1]), cols[2] == "True"))
+    return truth
+
+
+def evaluate(truth: List[Tuple[str, Optional[int], bool]], rows: List[ResultRow]) -> Dict[str, int]:
+    """
+    Compare alignment output with the truth, each truth entry is (read, t_id, reversed) with t_id None for noise.
+
+    A read derived from a target is recovered when that target is among its best hits, noise reads should be unmapped.
+    """
+    hits = {row.query: {int(hit[1]) for hit in row.hits} for row in rows if row.mapped}
+    counts = {"reads": 0, "recovered": 0, "wrong_target": 0, "missed": 0, "noise_unmapped": 0, "noise_mapped": 0}
+    for (read, t_id, _) in truth:
+        counts["reads"] += 1
+        if t_id is None:
+            counts["noise_mapped" if read in hits else "noise_unmapped"] += 1
+        elif read not in hits:
+            counts["missed"] += 1
+        elif t_id in hits[read]:
+            counts["recovered"] += 1
+        else:
+            counts["wrong_target"] += 1
+    return counts
@@ -0,0 +1,150 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterable, List, Optional, TextIO
+import os
+import tempfile
+
+from pygas.alignercpu import AlignerCpu
+from pygas.progress import Progress, current_rss
+from pygas.results import HEADER, batch_rows
+from pygas.seqio import READ_CHUNK
+
+SPILL_FRACTION = 0.9  # held rows are spilled once RSS reaches this fraction of max_memory
+SUFFIXES = ("K", "M", "G", "T")
+
+
+def parse_size(size: str) -> int:
+    """
+    Bytes from e.g. "512M" or "4G" (binary multiples), a plain number is bytes.
+    """
+    text = size.strip().upper().rstrip("B").rstrip("I")
+    scale = 1
+    if text and text[-1] in SUFFIXES:
+        scale = 1024 ** (SUFFIXES.index(text[-1]) + 1)
+        text = text[:-1]
+    try:
+        value = float(text)
+    except ValueError:
+        raise ValueError(f"Invalid size: {size}") from None
+    if value <= 0:
+        raise ValueError(f"Size must be positive: {size}")
+    return int(value * scale)
+
+
+@dataclass
+class SpillRun:
+    """
+    Align queries chunk_size at a time with memory held to max_memory bytes.  Queries may be any iterable (e.g. a
+    SeqReader) and are only read a chunk ahead, rows are kept as formatted text.  Once the RSS of the process reaches
+    SPILL_FRACTION of max_memory the held rows are appended to a temporary run on disk (one for unmapped and one for
+    mapped rows).  write() gives the same output as write_rows(batch_rows(...)) of align_queries() with a Progress.
+
+    Memory used by the library and one chunk isn't spilled, when that alone is over max_memory every chunk is
+    spilled.
+
+    directory:
+        Where the temporary run is created, the system default when not set.
+    """
+
+    aligner: AlignerCpu
+    max_memory: int
+    chunk_size: int = 10000
+    with_score: bool = False
+    with_status: bool = False
+    directory: Optional[str] = None
+
+    def __post_init__(self):
+        if self.chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self._tmp = tempfile.TemporaryDirectory(prefix="pygas-spill-", dir=self.directory)
+        # unmapped then mapped, output is every unmapped row before any mapped row
+        self._runs = [open(os.path.join(self._tmp.name, f"{name}.tsv"), "w+") for name in ("unmapped", "mapped")]
+        self._held: List[List[str]] = [[], []]
+        self.n_queries = 0
+        self.budget_exceeded = 0
+        self.spills = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+    def run(self, queries: Iterable[str], progress: Progress = None):
+        """
+        Align all queries, can be called more than once to append.
+        """
+        queries = iter(queries)
+        while True:
+            chunk = list(islice(queries, self.chunk_size))
+            if not chunk:
+                break
+            ab = self.aligner.align_queries(chunk, keep_matrix=False, progress=progress, chunk_size=self.chunk_size)
+            for row in batch_rows(ab):
+                self._held[row.mapped].append("\t".join(row.fields(self.with_score, self.with_status)) + "\n")
+            self.n_queries += len(chunk)
+            self.budget_exceeded += len(ab.budget_exceeded)
+            del ab
+            if current_rss() >= self.max_memory * SPILL_FRACTION:
+                self.spill()
+
+    def spill(self):
+        """
+        Move held rows to the on-disk run.
+        """
+        if not any(self._held):
+            return
+        for (run, lines) in zip(self._runs, self._held):
+            run.writelines(lines)
+            lines.clear()
+        self.spills += 1
+
+    def write(self, ofh: TextIO):
+        header = (
+            HEADER[:1] + (["score"] if self.with_score else []) + (["status"] if self.with_status else []) + HEADER[1:]
+        )
+        ofh.write("\t".join(header) + "\n")
+        for (run, lines) in zip(self._runs, self._held):
+            run.flush()
+            run.seek(0)
+            while True:
+                block = run.read(READ_CHUNK)
+                if not block:
+                    break
+                ofh.write(block)
+            run.seek(0, os.SEEK_END)
+            ofh.write("".join(lines))
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._tmp.cleanup()
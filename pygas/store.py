@@ -0,0 +1,258 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from array import array
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+import mmap
+import struct
+import sys
+import zlib
+
+from pygas.results import WRITE_BATCH, ResultRow
+
+STORE_MAGIC = b"PGRS"
+STORE_VERSION = 1
+STORE_SUFFIX = ".pgr"
+# magic, version, n_queries, n_hits, n_strings, n_slots then offsets of the query, hit, string and index sections
+STORE_HEADER = struct.Struct("<4sHxxQQQQQQQQ")
+# string id of the query, score, flags, first hit, number of hits
+QUERY_RECORD = struct.Struct("<IiBII")
+# query index, t_id, reversed, t_pos, score, string ids of seq, cigar and md
+HIT_RECORD = struct.Struct("<IIBiiIII")
+FLAG_MAPPED = 1
+FLAG_BUDGET = 2
+
+
+def _key_hash(key: bytes) -> int:
+    return zlib.crc32(key)
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":  # pragma: no cover
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_store(rows: Iterable[ResultRow], path: str) -> int:
+    """
+    Write rows (e.g. from batch_rows()) as a binary result store, see ResultStore.  Hit records are written as rows
+    arrive, the string pool and query records are held until the end.  Returns the number of rows.
+    """
+    strings: Dict[str, int] = {}
+
+    def string_id(text: str) -> int:
+        sid = strings.get(text)
+        if sid is None:
+            sid = strings[text] = len(strings)
+        return sid
+
+    queries = bytearray()
+    query_ids = array("I")
+    n_queries = n_hits = 0
+    with open(path, "wb") as ofh:
+        ofh.write(bytes(STORE_HEADER.size))
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, WRITE_BATCH))
+            if not batch:
+                break
+            hits = bytearray()
+            for row in batch:
+                q_id = string_id(row.query)
+                flags = (FLAG_MAPPED if row.mapped else 0) | (FLAG_BUDGET if row.budget_exceeded else 0)
+                score = row.score if row.mapped else 0
+                queries += QUERY_RECORD.pack(q_id, score, flags, n_hits, len(row.hits))
+                query_ids.append(q_id)
+                for (reversed, t_id, t_pos, seq, cigar, md) in row.hits:
+                    hits += HIT_RECORD.pack(
+                        n_queries,
+                        int(t_id),
+                        reversed == "True",
+                        int(t_pos),
+                        score,
+                        string_id(seq),
+                        string_id(cigar),
+                        string_id(md),
+                    )
+                n_hits += len(row.hits)
+                n_queries += 1
+            ofh.write(hits)
+
+        query_off = ofh.tell()
+        ofh.write(queries)
+        string_off = ofh.tell()
+        pool = [text.encode() for text in strings]
+        offsets = array("Q", [0])
+        for data in pool:
+            offsets.append(offsets[-1] + len(data))
+        ofh.write(_little_endian(offsets))
+        ofh.write(b"".join(pool))
+
+        # open addressing with linear probing, slots hold query index + 1 (0 is empty), the first row of a query wins
+        n_slots = 1 << max(2 * n_queries - 1, 1).bit_length()
+        slots = array("I", bytes(4 * n_slots))
+        mask = n_slots - 1
+        for (q_idx, q_id) in enumerate(query_ids):
+            slot = _key_hash(pool[q_id]) & mask
+            while slots[slot]:
+                if query_ids[slots[slot] - 1] == q_id:
+                    break
+                slot = (slot + 1) & mask
+            else:
+                slots[slot] = q_idx + 1
+        index_off = ofh.tell()
+        ofh.write(_little_endian(slots))
+
+        ofh.seek(0)
+        ofh.write(
+            STORE_HEADER.pack(
+                STORE_MAGIC,
+                STORE_VERSION,
+                n_queries,
+                n_hits,
+                len(pool),
+                n_slots,
+                STORE_HEADER.size,
+                query_off,
+                string_off,
+                index_off,
+            )
+        )
+    return n_queries
+
+
+class ResultStore:
+    """
+    Memory mapped reader of a file written by write_store().  Rows are in the order written, len() is the number of
+    rows and a query can be looked up with get() / `in` through the hash index without reading the rest of the file.
+
+    Layout (little endian): a header (STORE_HEADER), HIT_RECORD for every hit, QUERY_RECORD for every row, offsets and
+    data of a pool of distinct strings (queries, aligned seq, CIGAR and MD) then the hash index (uint32 slots).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as ifh:
+            self._mm = mmap.mmap(ifh.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < STORE_HEADER.size or self._mm[:4] != STORE_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a pygas result store")
+        (
+            _,
+            version,
+            self.n_queries,
+            self.n_hits,
+            self.n_strings,
+            self._n_slots,
+            self._hit_off,
+            self._query_off,
+            self._string_off,
+            self._index_off,
+        ) = STORE_HEADER.unpack_from(self._mm)
+        if version != STORE_VERSION:
+            self.close()
+            raise ValueError(f"{path} is result store version {version}, expected {STORE_VERSION}")
+        self._data_off = self._string_off + 8 * (self.n_strings + 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.n_queries
+
+    def __contains__(self, query: str) -> bool:
+        return self.find(query) is not None
+
+    def close(self):
+        self._mm.close()
+
+    def string(self, s_id: int) -> str:
+        (start, end) = struct.unpack_from("<QQ", self._mm, self._string_off + 8 * s_id)
+        return self._mm[self._data_off + start : self._data_off + end].decode()
+
+    def find(self, query: str) -> Optional[int]:
+        """
+        Index of the first row of query, None when it isn't in the store.
+        """
+        key = query.encode()
+        mask = self._n_slots - 1
+        slot = _key_hash(key) & mask
+        while True:
+            (value,) = struct.unpack_from("<I", self._mm, self._index_off + 4 * slot)
+            if not value:
+                return None
+            (q_id,) = struct.unpack_from("<I", self._mm, self._query_off + QUERY_RECORD.size * (value - 1))
+            (start, end) = struct.unpack_from("<QQ", self._mm, self._string_off + 8 * q_id)
+            if self._mm[self._data_off + start : self._data_off + end] == key:
+                return value - 1
+            slot = (slot + 1) & mask
+
+    def get(self, query: str) -> Optional[ResultRow]:
+        q_idx = self.find(query)
+        return None if q_idx is None else self.row(q_idx)
+
+    def row(self, q_idx: int) -> ResultRow:
+        if not 0 <= q_idx < self.n_queries:
+            raise IndexError(f"Row {q_idx} is out of range for {self.n_queries} rows")
+        (q_id, score, flags, first_hit, n_hits) = QUERY_RECORD.unpack_from(
+            self._mm, self._query_off + QUERY_RECORD.size * q_idx
+        )
+        row = ResultRow(query=self.string(q_id), budget_exceeded=bool(flags & FLAG_BUDGET))
+        if flags & FLAG_MAPPED:
+            row.score = score
+            hits = self._records(HIT_RECORD, self._hit_off, first_hit, n_hits)
+            for (_, t_id, reversed, t_pos, _, seq, cigar, md) in hits:
+                row.hits.append(
+                    [str(bool(reversed)), str(t_id), str(t_pos), self.string(seq), self.string(cigar), self.string(md)]
+                )
+        return row
+
+    def rows(self) -> Iterator[ResultRow]:
+        for q_idx in range(self.n_queries):
+            yield self.row(q_idx)
+
+    def hits(self) -> Iterator[Tuple[int, int, bool, int, int]]:
+        """
+        Bulk scan of the fixed-width hit fields: (row index, t_id, reversed, t_pos, score) for every hit in row order,
+        strings aren't read.
+        """
+        for start in range(0, self.n_hits, WRITE_BATCH):
+            for (q_idx, t_id, reversed, t_pos, score, _, _, _) in self._records(
+                HIT_RECORD, self._hit_off, start, min(WRITE_BATCH, self.n_hits - start)
+            ):
+                yield (q_idx, t_id, bool(reversed), t_pos, score)
+
+    def _records(self, record: struct.Struct, offset: int, first: int, count: int) -> Iterator[tuple]:
+        start = offset + record.size * first
+        return record.iter_unpack(self._mm[start : start + record.size * count])
@@ -0,0 +1,417 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from libc.stdlib cimport malloc, realloc, free
+
+cdef int GAP = -1
+cdef int MATCH = 1
+
+cdef int INIT_NODES = 1024
+# queries searched together by search_batch()
+cdef int MAX_GROUP = 16
+
+
+cdef class TargetTrie:
+    """
+    Radix tree over the target library, used to find the targets that can reach a score threshold against a query
+    without filling a matrix for each of them.
+
+    Rows of the fill() matrix only depend on the target prefix, so each row is computed once per tree edge base and
+    shared by every target below it.  A branch is abandoned as soon as the best score any target below it could reach
+    is lower than the threshold.
+    """
+
+    cdef int *first_child
+    cdef int *next_sibling
+    cdef int *label_start
+    cdef int *label_len
+    cdef int *depth_end
+    cdef int *max_depth
+    cdef int *n_term
+    cdef int n_nodes
+    cdef int capacity
+    cdef bytearray store
+    cdef dict terminals
+
+    def __cinit__(self):
+        self.capacity = INIT_NODES
+        self.first_child = <int *> malloc(self.capacity * sizeof(int))
+        self.next_sibling = <int *> malloc(self.capacity * sizeof(int))
+        self.label_start = <int *> malloc(self.capacity * sizeof(int))
+        self.label_len = <int *> malloc(self.capacity * sizeof(int))
+        self.depth_end = <int *> malloc(self.capacity * sizeof(int))
+        self.max_depth = <int *> malloc(self.capacity * sizeof(int))
+        self.n_term = <int *> malloc(self.capacity * sizeof(int))
+        if (
+            not self.first_child
+            or not self.next_sibling
+            or not self.label_start
+            or not self.label_len
+            or not self.depth_end
+            or not self.max_depth
+            or not self.n_term
+        ):
+            raise MemoryError()
+        self.n_nodes = 0
+        self.store = bytearray()
+        self.terminals = {}
+        self._new_node(0, 0, 0)  # root
+
+    def __dealloc__(self):
+        free(self.first_child)
+        free(self.next_sibling)
+        free(self.label_start)
+        free(self.label_len)
+        free(self.depth_end)
+        free(self.max_depth)
+        free(self.n_term)
+
+    @property
+    def node_count(self) -> int:
+        return self.n_nodes
+
+    cdef int _grow(self) except -1:
+        cdef int capacity = self.capacity * 2
+        cdef int *ptr
+        ptr = <int *> realloc(self.first_child, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.first_child = ptr
+        ptr = <int *> realloc(self.next_sibling, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.next_sibling = ptr
+        ptr = <int *> realloc(self.label_start, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.label_start = ptr
+        ptr = <int *> realloc(self.label_len, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.label_len = ptr
+        ptr = <int *> realloc(self.depth_end, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.depth_end = ptr
+        ptr = <int *> realloc(self.max_depth, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.max_depth = ptr
+        ptr = <int *> realloc(self.n_term, capacity * sizeof(int))
+        if not ptr:
+            raise MemoryError()
+        self.n_term = ptr
+        self.capacity = capacity
+        return 0
+
+    cdef int _new_node(self, int start, int length, int depth) except -1:
+        cdef int node = self.n_nodes
+        if node == self.capacity:
+            self._grow()
+        self.first_child[node] = -1
+        self.next_sibling[node] = -1
+        self.label_start[node] = start
+        self.label_len[node] = length
+        self.depth_end[node] = depth
+        self.max_depth[node] = depth
+        self.n_term[node] = 0
+        self.n_nodes += 1
+        return node
+
+    def add(self, str seq, int t_id):
+        """
+        Add a target to the tree, t_id is reported by search() when the target can reach the threshold.
+        """
+        cdef bytes b_seq = seq.encode("ascii")
+        cdef int t_len = len(b_seq)
+        cdef int node = 0
+        cdef int pos = 0
+        cdef int child, k, l_start, l_len, tail
+
+        if self.max_depth[0] < t_len:
+            self.max_depth[0] = t_len
+        while pos < t_len:
+            child = self.first_child[node]
+            while child != -1 and self.store[self.label_start[child]] != b_seq[pos]:
+                child = self.next_sibling[child]
+            if child == -1:
+                # new leaf holding the remainder of the target
+                child = self._new_node(len(self.store), t_len - pos, t_len)
+                self.store.extend(b_seq[pos:])
+                self.next_sibling[child] = self.first_child[node]
+                self.first_child[node] = child
+                node = child
+                break
+            l_start = self.label_start[child]
+            l_len = self.label_len[child]
+            k = 1
+            while k < l_len and pos + k < t_len and self.store[l_start + k] == b_seq[pos + k]:
+                k += 1
+            if k < l_len:
+                # split the edge, the lower part keeps the children and any targets ending on the original node
+                tail = self._new_node(l_start + k, l_len - k, self.depth_end[child])
+                self.max_depth[tail] = self.max_depth[child]
+                self.first_child[tail] = self.first_child[child]
+                self.n_term[tail] = self.n_term[child]
+                if self.n_term[child]:
+                    self.terminals[tail] = self.terminals.pop(child)
+                self.first_child[child] = tail
+                self.label_len[child] = k
+                self.depth_end[child] -= l_len - k
+                self.n_term[child] = 0
+            if self.max_depth[child] < t_len:
+                self.max_depth[child] = t_len
+            node = child
+            pos += k
+
+        if self.n_term[node]:
+            self.terminals[node].append(t_id)
+        else:
+            self.terminals[node] = [t_id]
+        self.n_term[node] += 1
+
+    def remove(self, str seq, int t_id):
+        """
+        Remove a target added with add().  Nodes are kept, so the depth bounds used for pruning stay valid (if loose).
+        """
+        cdef int node = self._find(seq.encode("ascii"))
+        if node == -1 or t_id not in self.terminals.get(node, []):
+            raise KeyError(f"t_id {t_id} is not indexed for {seq}")
+        self.terminals[node].remove(t_id)
+        self.n_term[node] -= 1
+        if self.n_term[node] == 0:
+            del self.terminals[node]
+
+    cdef int _find(self, bytes b_seq):
+        cdef int t_len = len(b_seq)
+        cdef int node = 0
+        cdef int pos = 0
+        cdef int child, k
+        while pos < t_len:
+            child = self.first_child[node]
+            while child != -1 and self.store[self.label_start[child]] != b_seq[pos]:
+                child = self.next_sibling[child]
+            if child == -1 or pos + self.label_len[child] > t_len:
+                return -1
+            for k in range(1, self.label_len[child]):
+                if self.store[self.label_start[child] + k] != b_seq[pos + k]:
+                    return -1
+            pos += self.label_len[child]
+            node = child
+        return node
+
+    def search(self, str query, int threshold) -> list:
+        """
+        Returns the t_id of every target where the maximum value of the fill() matrix against query is >= threshold.
+        Order of the returned ids is not defined.
+        """
+        return self.search_batch([query], threshold)[0]
+
+    def search_batch(self, list queries, int threshold) -> list:
+        """
+        search() for each query, results are returned in the order of queries.
+
+        Queries are visited in (length, sequence) order and identical queries are searched once.  Matrix columns only
+        depend on the query prefix, so consecutive queries of the same length sharing at least half of their sequence
+        are searched together, computing the columns of the common prefix once for each row.
+        """
+        cdef int n = len(queries)
+        cdef list results = [None] * n
+        cdef list order = sorted(range(n), key=lambda i: (len(queries[i]), queries[i]))
+        cdef list group = []
+        cdef list dups = []
+        cdef list hits
+        cdef str query, head
+        cdef int q_idx, q_len, lcp, g
+        cdef int g_lcp = 0
+
+        for q_idx in order:
+            query = queries[q_idx]
+            if group:
+                head = queries[group[0]]
+                if query == queries[group[-1]]:
+                    dups.append((q_idx, group[-1]))
+                    continue
+                q_len = len(query)
+                lcp = 0
+                if q_len == len(head) and len(group) < MAX_GROUP:
+                    while lcp < q_len and query[lcp] == head[lcp]:
+                        lcp += 1
+                if lcp >= max(1, q_len // 2):
+                    group.append(q_idx)
+                    g_lcp = min(g_lcp, lcp)
+                    continue
+                for g, hits in enumerate(self._search_group([queries[i] for i in group], g_lcp, threshold)):
+                    results[group[g]] = hits
+            group = [q_idx]
+            g_lcp = len(query)
+        if group:
+            for g, hits in enumerate(self._search_group([queries[i] for i in group], g_lcp, threshold)):
+                results[group[g]] = hits
+        for (q_idx, g) in dups:
+            results[q_idx] = list(results[g])
+        return results
+
+    cdef list _search_group(self, list queries, int shared, int threshold):
+        """
+        Search for queries of equal length with the first shared bases in common, each row is laid out as the shared
+        columns followed by the remaining columns of each query.
+        """
+        cdef int n_q = len(queries)
+        cdef int q_len = len(queries[0])
+        cdef int tail = q_len - shared
+        cdef int width = shared + n_q * tail
+        cdef int n_rows = self.max_depth[0] + 1
+        cdef list hits = [[] for _ in range(n_q)]
+        cdef unsigned char *store = self.store
+        cdef int *q
+        cdef int *rows
+        cdef int *path_max
+        cdef char *active
+        cdef int *stack
+        cdef int *prev
+        cdef int *cur
+        cdef int *t_prev
+        cdef int *t_cur
+        cdef int *t_q
+        cdef int sp, node, child, d, k, j, g, c, m, delete, insert, shared_max, row_max, p_max, n_active
+        cdef str query
+
+        if q_len == 0 or self.n_nodes == 1:
+            return hits
+
+        q = <int *> malloc(n_q * q_len * sizeof(int))
+        rows = <int *> malloc(n_rows * width * sizeof(int))
+        path_max = <int *> malloc(n_rows * n_q * sizeof(int))
+        active = <char *> malloc(n_rows * n_q * sizeof(char))
+        stack = <int *> malloc(self.n_nodes * sizeof(int))
+        try:
+            if not q or not rows or not path_max or not active or not stack:
+                raise MemoryError()
+            for g, query in enumerate(queries):
+                for j in range(q_len):
+                    q[g * q_len + j] = ord(query[j])
+                path_max[g] = -1
+                active[g] = 1
+            for j in range(width):
+                rows[j] = 0
+
+            sp = 0
+            child = self.first_child[0]
+            while child != -1:
+                stack[sp] = child
+                sp += 1
+                child = self.next_sibling[child]
+
+            while sp > 0:
+                sp -= 1
+                node = stack[sp]
+                d = self.depth_end[node] - self.label_len[node]
+                n_active = 0
+                for g in range(n_q):
+                    n_active += active[d * n_q + g]
+                for k in range(self.label_start[node], self.label_start[node] + self.label_len[node]):
+                    c = store[k]
+                    prev = rows + d * width
+                    cur = prev + width
+                    # same recurrence as fill(), first column has no upstream cells
+                    m = MATCH if q[0] == c else 0
+                    cur[0] = m
+                    shared_max = m
+                    for j in range(1, shared):
+                        m = prev[j - 1]
+                        if q[j] == c:
+                            m += MATCH
+                        delete = prev[j] + GAP
+                        insert = cur[j - 1] + GAP
+                        if delete > m:
+                            m = delete
+                        if insert > m:
+                            m = insert
+                        cur[j] = m
+                        if m > shared_max:
+                            shared_max = m
+                    n_active = 0
+                    for g in range(n_q):
+                        if not active[d * n_q + g]:
+                            active[(d + 1) * n_q + g] = 0
+                            continue
+                        t_q = q + g * q_len + shared
+                        t_prev = prev + shared + g * tail
+                        t_cur = cur + shared + g * tail
+                        row_max = shared_max
+                        for j in range(tail):
+                            # the column before the tail is the last shared one
+                            if j == 0:
+                                m = prev[shared - 1]
+                                insert = cur[shared - 1] + GAP
+                            else:
+                                m = t_prev[j - 1]
+                                insert = t_cur[j - 1] + GAP
+                            if t_q[j] == c:
+                                m += MATCH
+                            delete = t_prev[j] + GAP
+                            if delete > m:
+                                m = delete
+                            if insert > m:
+                                m = insert
+                            t_cur[j] = m
+                            if m > row_max:
+                                row_max = m
+                        p_max = path_max[d * n_q + g]
+                        if row_max > p_max:
+                            p_max = row_max
+                        path_max[(d + 1) * n_q + g] = p_max
+                        # each row can only improve on the last by one
+                        if p_max < threshold and row_max + (self.max_depth[node] - d - 1) < threshold:
+                            active[(d + 1) * n_q + g] = 0
+                        else:
+                            active[(d + 1) * n_q + g] = 1
+                            n_active += 1
+                    d += 1
+                    if n_active == 0:
+                        break
+                if n_active == 0:
+                    continue
+                if self.n_term[node]:
+                    for g in range(n_q):
+                        if active[d * n_q + g] and path_max[d * n_q + g] >= threshold:
+                            hits[g].extend(self.terminals[node])
+                child = self.first_child[node]
+                while child != -1:
+                    stack[sp] = child
+                    sp += 1
+                    child = self.next_sibling[child]
+        finally:
+            free(q)
+            free(rows)
+            free(path_max)
+            free(active)
+            free(stack)
+        return hits
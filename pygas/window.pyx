@@ -0,0 +1,188 @@
+#
+# Copyright (c) 2021
+#
+# Author: CASM/Cancer IT <cgphelp@sanger.ac.uk>
+#
+# This file is part of pygas.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# 1. The usage of a range of years within a copyright statement contained within
+# this distribution should be interpreted as being equivalent to a list of years
+# including the first and last year specified and all consecutive years between
+# them. For example, a copyright statement that reads ‘Copyright (c) 2005, 2007-
+# 2009, 2011-2012’ should be interpreted as being identical to a statement that
+# reads ‘Copyright (c) 2005, 2007, 2008, 2009, 2011, 2012’ and a copyright
+# statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
+# identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
+# 2009, 2010, 2011, 2012’.
+from libc.stdlib cimport malloc, free
+from pygas.packed cimport PackedTargets, encode_seq
+from pygas.matrix import revcomp
+
+# longest target held as an exact 2-bit window key
+cdef int MAX_KEY_LEN = 32
+
+
+cdef class WindowIndex:
+    """
+    Exact lookup of every target length window of a read, for reads longer than the guides.
+
+    Targets of up to 32 ACGT bases are keyed by their 2-bit packed value, one table per length, so the key of each
+    window (and of its reverse complement) is rolled along the read a base at a time and looked up without re-hashing
+    the window.  Other targets (longer, or holding non-ACGT characters) are looked up per window in the
+    PackedTargets exact table.
+
+    The index reflects the targets at construction, or as updated by add()/remove().
+    """
+
+    cdef PackedTargets targets
+    cdef dict tables
+    cdef dict other_counts
+
+    def __init__(self, PackedTargets targets):
+        cdef int t_id
+        self.targets = targets
+        self.tables = {}
+        self.other_counts = {}
+        for t_id in range(len(targets)):
+            target = targets[t_id]
+            if target is not None:
+                self.add(target, t_id)
+
+    @property
+    def lengths(self) -> list:
+        """
+        Distinct target lengths, ascending.
+        """
+        return sorted(set(self.tables) | set(self.other_counts))
+
+    def add(self, str target, int t_id):
+        cdef object key = _window_key(target)
+        cdef int t_len = len(target)
+        if key is None:
+            self.other_counts[t_len] = self.other_counts.get(t_len, 0) + 1
+        else:
+            self.tables.setdefault(t_len, {}).setdefault(key, []).append(t_id)
+
+    def remove(self, str target, int t_id):
+        cdef object key = _window_key(target)
+        cdef int t_len = len(target)
+        cdef dict table
+        if key is None:
+            self.other_counts[t_len] -= 1
+            if self.other_counts[t_len] == 0:
+                del self.other_counts[t_len]
+            return
+        table = self.tables[t_len]
+        table[key].remove(t_id)
+        if not table[key]:
+            del table[key]
+            if not table:
+                del self.tables[t_len]
+
+    def scan(self, str read, bint rev_comp=True) -> list:
+        """
+        (t_id, offset, reversed) of every window of read equal to a target, offset is the 0-based start of the window
+        in read.  When reversed the target equals the reverse complement of the window.  Sorted by offset then t_id.
+        """
+        cdef int r_len = len(read)
+        cdef int *codes
+        cdef list found = []
+        cdef int t_len, offset
+
+        if r_len == 0:
+            return found
+        codes = <int *> malloc(r_len * sizeof(int))
+        if not codes:
+            raise MemoryError()
+        try:
+            encode_seq(read, codes)
+            for (t_len, table) in self.tables.items():
+                if t_len <= r_len:
+                    _roll(codes, r_len, t_len, table, rev_comp, found)
+        finally:
+            free(codes)
+        if self.other_counts:
+            rc_read = revcomp(read) if rev_comp else None
+            for t_len in self.other_counts:
+                for offset in range(r_len - t_len + 1):
+                    window = read[offset : offset + t_len]
+                    for t_id in self.targets.find(window):
+                        found.append((t_id, offset, False))
+                    if rc_read is None:
+                        continue
+                    # window [offset, offset + t_len) of read is window r_len - offset - t_len of rc_read
+                    rc_window = rc_read[r_len - offset - t_len : r_len - offset]
+                    if rc_window != window:
+                        for t_id in self.targets.find(rc_window):
+                            found.append((t_id, offset, True))
+        found.sort(key=lambda hit: (hit[1], hit[0], hit[2]))
+        return found
+
+
+cdef object _window_key(str target):
+    """
+    2-bit packed value of target, None when it can't be keyed.
+    """
+    cdef unsigned long long key = 0
+    cdef Py_UCS4 c
+    if len(target) == 0 or len(target) > MAX_KEY_LEN:
+        return None
+    for c in target:
+        if c == "A":
+            key = key << 2
+        elif c == "C":
+            key = (key << 2) | 1
+        elif c == "G":
+            key = (key << 2) | 2
+        elif c == "T":
+            key = (key << 2) | 3
+        else:
+            return None
+    return key
+
+
+cdef int _roll(const int *codes, int r_len, int t_len, dict table, bint rev_comp, list found) except -1:
+    cdef unsigned long long mask = (<unsigned long long> -1) >> (2 * (MAX_KEY_LEN - t_len))
+    cdef int high = 2 * (t_len - 1)
+    cdef unsigned long long key = 0
+    cdef unsigned long long rc_key = 0
+    cdef int valid = 0
+    cdef int i, c, offset
+    cdef object t_ids
+
+    for i in range(r_len):
+        c = codes[i]
+        if c > 3:
+            # windows over a non-ACGT base can't equal a keyed target
+            valid = 0
+            continue
+        key = ((key << 2) | c) & mask
+        rc_key = (rc_key >> 2) | (<unsigned long long> (3 - c) << high)
+        valid += 1
+        if valid < t_len:
+            continue
+        offset = i - t_len + 1
+        t_ids = table.get(key)
+        if t_ids is not None:
+            for t_id in t_ids:
+                found.append((t_id, offset, False))
+        # a reverse complement palindrome is reported once, forward
+        if rev_comp and rc_key != key:
+            t_ids = table.get(rc_key)
+            if t_ids is not None:
+                for t_id in t_ids:
+                    found.append((t_id, offset, True))
+    return 0
@@ -52,7 +52,7 @@ config = {
         "console_scripts": ["pygas=pygas.cli:cli"],
     },
     "ext_modules": cythonize(
-        ["pygas/matrix.pyx"],
+        ["pygas/matrix.pyx", "pygas/trie.pyx", "pygas/packed.pyx", "pygas/window.pyx"],
         compiler_directives={"language_level": "3", "embedsignature": True},
     ),
 }
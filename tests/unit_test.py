@@ -27,13 +27,41 @@
 # statement that reads ‘Copyright (c) 2005-2012’ should be interpreted as being
 # identical to a statement that reads ‘Copyright (c) 2005, 2006, 2007, 2008,
 # 2009, 2010, 2011, 2012’.
+import asyncio
+import gzip
+import io
+import json
+import pickle
+import random
+import subprocess
+import sys
 import pytest
 
 from pygas.aligner import Aligner
 from pygas.alignercpu import AlignerCpu
+from pygas.alignerasync import AsyncAligner
 
 # from pygas.alignergpu import AlignerGpu
-from pygas.classes import Backtrack
+from pygas.benchmark import check_startup, compare, run_benchmarks, startup_times
+from pygas.checkpoint import CheckpointRun
+from pygas.classes import AlignmentBatch, Backtrack
+from pygas.constants import STRATEGY_EXACT, STRATEGY_SCAN, STRATEGY_TRIE
+from pygas.extract import GuideExtractor, write_guides
+from pygas.library import TargetLibrary, substitution_neighbours
+from pygas.matrix import fill, revcomp
+from pygas.packed import PackedTargets
+from pygas.paired import PairedAligner, load_pairs, split_read, write_pairs
+from pygas.planner import LibraryProfile, calibration_queries
+from pygas.progress import Progress, current_rss, format_report
+from pygas.seqio import BGZF_BLOCK, BGZF_EOF, BgzfWriter, SeqReader, is_bgzf, load_seqs, open_output
+from pygas.server import AlignmentServer, parse_library_spec
+from pygas.spill import SpillRun, parse_size
+from pygas.store import ResultStore, write_store
+from pygas.simulate import LibrarySpec, ReadSpec, evaluate, parse_lengths
+from pygas.results import batch_rows, merge_batches, merge_rows, read_rows, write_rows
+from pygas.samples import MultiSampleRun, sample_name
+from pygas.trie import TargetTrie
+from pygas.window import WindowIndex
 
 READ_A = "ACGTAAAAAAAAAAAACGT"
 READ_C = "ACGTCCCCCCCCCCCCCGT"
@@ -415,3 +443,848 @@ def test_21_match_mode_fuzzy(target, query, mode, exp_map, exp_unmap):
     # print(results)
     assert len(results.mapped) == exp_map
     assert len(results.unmapped) == exp_unmap
+
+
+def _random_library(seed, n_targets=40, n_queries=30):
+    rng = random.Random(seed)
+    prefixes = ["".join(rng.choice("ACGT") for _ in range(rng.choice([4, 6, 8]))) for _ in range(5)]
+    targets = [
+        rng.choice(prefixes) + "".join(rng.choice("ACGT") for _ in range(rng.choice([10, 12, 14])))
+        for _ in range(n_targets)
+    ]
+    targets += targets[:3]  # duplicates
+    queries = []
+    for _ in range(n_queries):
+        q = list(rng.choice(targets))
+        for _ in range(rng.randint(0, 3)):
+            p = rng.randrange(len(q))
+            op = rng.randint(0, 2)
+            if op == 0:
+                q[p] = rng.choice("ACGT")
+            elif op == 1:
+                q.insert(p, rng.choice("ACGT"))
+            else:
+                del q[p]
+        queries.append("".join(q))
+    return (targets, queries)
+
+
+def _batch_summary(ab):
+    return (
+        ab.unmapped,
+        [[(bt.sm.target_id, bt.sm.reversed, bt.sm.score, bt.t_pos, bt.cigar, bt.md) for bt in r] for r in ab.mapped],
+    )
+
+
+@pytest.mark.parametrize("threshold", [1, 10, 15, 18])
+def test_22_trie_search(threshold):
+    (targets, queries) = _random_library(22)
+    trie = TargetTrie()
+    for t_idx, target in enumerate(targets):
+        trie.add(target, t_idx)
+    for query in queries:
+        expected = [t_idx for t_idx, target in enumerate(targets) if fill(target, query, -1)[1] >= threshold]
+        assert sorted(trie.search(query, threshold)) == expected
+
+
+@pytest.mark.parametrize(
+    "rules, match_type, rev_comp",
+    [
+        (["M"], 3, True),
+        (["MM"], 0, True),
+        (["MDI"], 3, True),
+        (["I", "D"], 1, False),
+        (["MM"], 2, True),
+    ],
+)
+def test_23_trie_matches_fill(rules, match_type, rev_comp):
+    (targets, queries) = _random_library(23)
+    args = dict(targets=targets, rules=rules, score_min=10, rev_comp=rev_comp, match_type=match_type)
+    without = AlignerCpu(use_trie=False, **args).align_queries(queries)
+    with_trie = AlignerCpu(use_trie=True, **args).align_queries(queries)
+    assert _batch_summary(without) == _batch_summary(with_trie)
+
+
+def test_24_trie_search_batch():
+    (targets, queries) = _random_library(24)
+    # queries sharing most of their sequence are searched as a group
+    queries += [q[:-2] + "AC" for q in queries] + [q[:-3] + "TTG" for q in queries] + queries[:5]
+    trie = TargetTrie()
+    for t_idx, target in enumerate(targets):
+        trie.add(target, t_idx)
+    batch = trie.search_batch(queries, 15)
+    assert len(batch) == len(queries)
+    for query, hits in zip(queries, batch):
+        assert sorted(hits) == sorted(trie.search(query, 15))
+
+
+def test_25_query_order():
+    (targets, queries) = _random_library(25)
+    queries = queries + queries[::2] + ["ACGT", READ_BAD]
+    # the substring pass can't depend on which query lengths are present or on target order
+    exact = AlignerCpu(targets=["AAAAA" + "C" * 16, "G" * 20], rules=[], score_min=20, match_type=3)
+    assert exact.align_queries(["T" + "G" * 20]).unmapped == []
+    a = AlignerCpu(targets=targets, rules=["MM"], score_min=10, rev_comp=True)
+    batch = a.align_queries(queries)
+    assert batch.total_reads == len(queries)
+    mapped = []
+    unmapped = []
+    for query in queries:
+        single = a.align_queries([query])
+        mapped.extend(single.mapped)
+        unmapped.extend(single.unmapped)
+    assert _batch_summary(batch) == _batch_summary(AlignmentBatch(unmapped=unmapped, mapped=mapped))
+
+
+@pytest.mark.parametrize("use_trie", [True, False])
+def test_26_library_updates(use_trie):
+    (targets, queries) = _random_library(26)
+    (extra, extra_queries) = _random_library(126, n_targets=10, n_queries=10)
+    queries += extra_queries
+    args = dict(rules=["MDI"], score_min=10, rev_comp=True)
+    a = AlignerCpu(targets=targets[:30], use_trie=use_trie, **args)
+    a.align_queries(queries)
+    retired = [1, 5, 6, 29]
+    a.remove_targets(retired)
+    assert a.add_targets(extra) == list(range(30, 30 + len(extra)))
+    assert a.targets[5] is None
+    # equivalent library built from scratch, ids differ but order is retained
+    live_ids = [t_id for t_id, target in enumerate(a.targets) if target is not None]
+    fresh = AlignerCpu(targets=[a.targets[t_id] for t_id in live_ids], use_trie=use_trie, **args)
+    (f_unmapped, f_mapped) = _batch_summary(fresh.align_queries(queries))
+    f_mapped = [[(live_ids[r[0]],) + r[1:] for r in res] for res in f_mapped]
+    assert _batch_summary(a.align_queries(queries)) == (f_unmapped, f_mapped)
+    with pytest.raises(ValueError):
+        a.remove_targets([5])
+
+
+def test_27_packed_targets():
+    seqs = ["ACGTACGTA", "", "ACGNTacgt", "TTTT", "ACGTACGTA", "ACGNTacgt"]
+    packed = PackedTargets(seqs)
+    assert list(packed) == seqs, "Decodes to original sequences, including non-ACGT"
+    assert packed.find("ACGTACGTA") == [0, 4]
+    assert packed.find("ACGNTacgt") == [2, 5]
+    assert packed.find("ACGTACGT") == []
+    packed.remove(0)
+    assert packed[0] is None and packed.length(0) == -1
+    assert packed.find("ACGTACGTA") == [4]
+    assert packed.append("ACGTACGTA") == 6
+    assert packed.find("ACGTACGTA") == [4, 6]
+    assert len(packed) == 7 and packed.active == 6
+    with pytest.raises(ValueError):
+        packed.remove(0)
+    (targets, _) = _random_library(27, n_targets=20000)
+    # list of str held 1 pointer and 1 str per target, before lengths and the exact match dict
+    assert PackedTargets(targets).nbytes < sum(8 + sys.getsizeof(t) for t in targets), "Smaller than a list of str"
+
+
+def _row_summary(rows):
+    return [(r.query, r.score, sorted(map(tuple, r.hits))) for r in rows]
+
+
+def test_28_shard_merge(tmp_path):
+    (targets, queries) = _random_library(28, n_targets=60, n_queries=40)
+    queries += queries[:5]
+    args = dict(rules=["MDI"], score_min=10, rev_comp=True)
+    full = batch_rows(AlignerCpu(targets=targets, **args).align_queries(queries))
+    batches = []
+    shards = []
+    for s_idx, t_offset in enumerate(range(0, len(targets), 25)):
+        ab = AlignerCpu(targets=targets[t_offset : t_offset + 25], t_offset=t_offset, **args).align_queries(queries)
+        batches.append(ab)
+        shard = tmp_path / f"shard{s_idx}.tsv"
+        with open(shard, "w") as ofh:
+            write_rows(batch_rows(ab), ofh, with_score=True)
+        shards.append(read_rows(str(shard)))
+    assert _row_summary(batch_rows(merge_batches(queries, batches))) == _row_summary(full)
+    assert _row_summary(merge_rows(queries, shards)) == _row_summary(full)
+    with pytest.raises(ValueError):
+        merge_rows(queries + ["ACGT"], shards)
+    # copies of a read share their results, the offset is applied once
+    repeated = AlignerCpu(targets=[targets[0]], t_offset=100, **args).align_queries([targets[0]] * 3)
+    assert [[bt.sm.target_id for bt in r] for r in repeated.mapped] == [[100]] * 3
+
+
+def test_29_progress():
+    (targets, queries) = _random_library(29, n_queries=45)
+    args = dict(targets=targets, rules=["MDI"], score_min=10, rev_comp=True)
+    expected = _batch_summary(AlignerCpu(**args).align_queries(queries))
+    reports = []
+    progress = Progress(interval=0, callback=reports.append)
+    batch = AlignerCpu(**args).align_queries(queries, progress=progress, chunk_size=10)
+    assert _batch_summary(batch) == expected
+    assert [r["processed"] for r in reports] == [10, 20, 30, 40, 45]
+    final = progress.finish()
+    assert final["total"] == 45 and final["eta_s"] == 0
+    assert final["mapped"] == len(batch.mapped) and final["unmapped"] == len(batch.unmapped)
+    assert final["multi_mapped"] == sum(len(row.hits) > 1 for row in batch_rows(batch) if row.mapped)
+    assert final["peak_rss_bytes"] > 0
+
+
+def test_30_benchmark_compare():
+    baseline = {
+        "a/fill": {"median_s": 1.0, "mad_s": 0.01, "peak_bytes": 1000},
+        "a/backtrack": {"median_s": 1.0, "mad_s": 0.2, "peak_bytes": 1000},
+        "a/library": {"median_s": 1.0, "mad_s": 0.01, "peak_bytes": 1000},
+    }
+    current = {
+        "a/fill": {"median_s": 1.2, "mad_s": 0.01, "peak_bytes": 1000},
+        "a/backtrack": {"median_s": 1.5, "mad_s": 0.2, "peak_bytes": 1000},  # within noise
+        "a/library": {"median_s": 1.0, "mad_s": 0.01, "peak_bytes": 1200},
+    }
+    (rows, regressed) = compare(baseline, current)
+    status = {row[0]: row[-1] for row in rows[1:]}
+    assert regressed
+    assert status == {"a/fill": "SLOWER", "a/backtrack": "ok", "a/library": "MEMORY"}
+    assert compare(baseline, baseline)[1] is False
+    results = run_benchmarks(repeat=1, scale=0.01)
+    stages = ("library", "map_queries", "fill", "backtrack")
+    assert set(results) == {f"{d}/{s}" for d in ("uniform", "mixed_lengths") for s in stages}
+
+
+def test_31_simulate():
+    lib_spec = LibrarySpec(n_targets=300, lengths=parse_lengths("19:1,20:8,21:1"), n_prefixes=5, seed=31)
+    targets = lib_spec.generate()
+    assert targets == lib_spec.generate(), "Same seed, same library"
+    assert len(set(targets)) == 300 and {len(t) for t in targets} <= {19, 20, 21}
+    assert len({t[:8] for t in targets}) <= 5
+    read_spec = ReadSpec(
+        n_reads=200,
+        substitution_rate=0.02,
+        insertion_rate=0.01,
+        deletion_rate=0.01,
+        revcomp_rate=0.5,
+        duplicate_rate=0.1,
+        noise_rate=0.1,
+        seed=31,
+    )
+    reads = list(read_spec.generate(targets))
+    assert len(reads) == 200
+    for r_idx, (read, (t_id, reverse, subs, ins, dels, dup_of)) in enumerate(reads):
+        if dup_of is not None:
+            assert dup_of < r_idx and reads[dup_of][0] == read
+        elif t_id is not None and subs == ins == dels == 0:
+            assert read == (revcomp(targets[t_id]) if reverse else targets[t_id])
+    truth = [(read, t[0], t[1]) for (read, t) in reads]
+    queries = list(dict.fromkeys(read for (read, _) in reads))
+    rows = batch_rows(AlignerCpu(targets=targets, rules=["MDI"], score_min=15).align_queries(queries))
+    counts = evaluate(truth, rows)
+    assert counts["reads"] == 200
+    assert counts["recovered"] > 0.8 * (200 - counts["noise_unmapped"] - counts["noise_mapped"])
+    with pytest.raises(ValueError):
+        parse_lengths("20:0")
+
+
+@pytest.mark.parametrize("use_trie", [False, True])
+def test_32_query_budget(use_trie):
+    (targets, queries) = _random_library(32, n_queries=40)
+    args = dict(targets=targets, rules=["MDI"], score_min=10, rev_comp=True, use_trie=use_trie)
+    unlimited = AlignerCpu(**args).align_queries(queries)
+    assert unlimited.budget_exceeded == []
+    assert _batch_summary(AlignerCpu(budget=10 ** 9, **args).align_queries(queries)) == _batch_summary(unlimited)
+    limited = AlignerCpu(budget=50, **args).align_queries(queries)
+    assert 0 < len(limited.budget_exceeded) < len(queries)
+    assert len(limited.mapped) + len(limited.unmapped) == len(queries)
+    # queries within budget are unaffected
+    within = dict(zip([r[0].sm.original_seq for r in unlimited.mapped], _batch_summary(unlimited)[1]))
+    for (results, summary) in zip(limited.mapped, _batch_summary(limited)[1]):
+        if results[0].sm.original_seq not in limited.budget_exceeded:
+            assert within[results[0].sm.original_seq] == summary
+    status = {row.query: row.status for row in batch_rows(limited)}
+    assert {q for q, st in status.items() if st == "budget_exceeded"} == set(limited.budget_exceeded)
+    progress = Progress()
+    AlignerCpu(budget=50, **args).align_queries(queries, progress=progress, chunk_size=7)
+    assert progress.report()["budget_exceeded"] == len(limited.budget_exceeded)
+
+
+def test_33_composition_bound():
+    targets = ["C" * 20, "G" * 20, "CG" * 10, "AAAAAAAAAAAAAAAAAAAC"]
+    a = AlignerCpu(targets=targets, rules=["MDI"], score_min=15, use_trie=False, budget=1)
+    # no A/T in the first 3 targets so fill() is never needed, the budget of 1 cell is only spent on the last target
+    ab = a.align_queries(["A" * 20])
+    assert ab.budget_exceeded == []
+    assert [(bt.sm.target_id, bt.sm.score) for bt in ab.mapped[0]] == [(3, 19)]
+    a = AlignerCpu(targets=targets[:3], rules=["MDI"], score_min=15, use_trie=False, budget=1)
+    ab = a.align_queries(["A" * 20])
+    assert ab.budget_exceeded == [] and ab.unmapped == ["A" * 20]
+
+
+def test_34_pickle_aligner():
+    (targets, queries) = _random_library(34)
+    a = AlignerCpu(targets=targets, rules=["MDI"], score_min=10)
+    a.remove_targets([3])
+    b = pickle.loads(pickle.dumps(a))
+    assert list(b.targets) == list(a.targets) and b.targets[3] is None
+    assert _batch_summary(b.align_queries(queries)) == _batch_summary(a.align_queries(queries))
+
+
+@pytest.mark.parametrize("processes", [0, 1, 2])
+def test_35_async_aligner(processes):
+    (targets, queries) = _random_library(35, n_queries=60)
+    a = AlignerCpu(targets=targets, rules=["MDI"], score_min=10)
+    requests = [queries[i : i + 7] for i in range(0, len(queries), 7)]
+
+    async def run():
+        async with AsyncAligner(a, processes=processes) as aa:
+            batches = await asyncio.gather(*[aa.align_queries(r) for r in requests])
+            assert aa.engine_calls == 1, "Concurrent requests share an engine call"
+            cancelled = asyncio.ensure_future(aa.align_queries(queries[:5]))
+            other = asyncio.ensure_future(aa.align_queries(queries[5:9]))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            other_ab = await other
+            with pytest.raises(asyncio.CancelledError):
+                await cancelled
+        async with AsyncAligner(a, processes=processes, max_batch=7) as aa:
+            split = await asyncio.gather(*[aa.align_queries(r) for r in requests])
+            assert aa.engine_calls == len(requests)
+            assert aa.peak_batches == max(processes, 1), "Up to processes batches run at once"
+        return (batches, other_ab, split)
+
+    (batches, other_ab, split) = asyncio.run(run())
+    for (request, ab, ab_split) in zip(requests, batches, split):
+        assert _batch_summary(ab) == _batch_summary(a.align_queries(request, keep_matrix=False))
+        assert _batch_summary(ab_split) == _batch_summary(ab)
+    assert _batch_summary(other_ab) == _batch_summary(a.align_queries(queries[5:9]))
+
+
+def test_36_server(tmp_path):
+    (targets, queries) = _random_library(36)
+    lib2 = targets[::-1]
+    server = AlignmentServer({"lib": targets, "rev": lib2}, chunk_size=7)
+    expected = AlignerCpu(targets=targets, rules=["MDI"], score_min=10)
+    q_file = tmp_path / "queries.txt.gz"
+    with gzip.open(q_file, "wt") as q_fh:
+        q_fh.write("\n".join(queries) + "\n")
+    requests = [
+        {"command": "libraries"},
+        {"id": 1, "library": "lib", "queries": queries, "rules": ["MDI"], "minscore": 10, "score": True},
+        {
+            "id": 2,
+            "library": "lib",
+            "queries_file": str(q_file),
+            "rules": ["MDI"],
+            "minscore": 10,
+            "output": str(tmp_path / "out.tsv"),
+        },
+        {"id": 3, "queries": queries},
+        {"id": 4, "library": "lib", "queries": queries, "minscore": "10"},
+        {"id": 5, "library": "rev", "queries": queries, "rules": ["MDI"], "minscore": 10, "extra": 1},
+        {"command": "shutdown"},
+        {"id": 6, "library": "lib", "queries": queries},
+    ]
+    ofh = io.StringIO()
+    server.serve_stream(io.StringIO("\n".join(json.dumps(r) for r in requests) + "\nnot json\n"), ofh)
+    responses = [json.loads(line) for line in ofh.getvalue().splitlines()]
+    assert responses[0] == {"libraries": {"lib": len(targets), "rev": len(targets)}}
+    rows = [r["row"] for r in responses if r.get("id") == 1 and "row" in r]
+    # streamed per chunk of 7 queries
+    expected_rows = [
+        row.fields(with_score=True)
+        for i in range(0, len(queries), 7)
+        for row in batch_rows(expected.align_queries(queries[i : i + 7]))
+    ]
+    assert rows == expected_rows
+    done = {r["id"]: r for r in responses if r.get("done") and "id" in r}
+    assert done[1]["mapped"] + done[1]["unmapped"] == len(queries) == done[2]["queries"]
+    out = io.StringIO()
+    write_rows(batch_rows(expected.align_queries(queries)), out)
+    assert (tmp_path / "out.tsv").read_text() == out.getvalue()
+    errors = {r["id"]: r["error"] for r in responses if "error" in r}
+    assert errors == {
+        3: "library is required, loaded: lib, rev",
+        4: "minscore must be an integer",
+        5: "Unknown job field(s): extra",
+    }
+    assert responses[-1] == {"done": True} and server.stopped and server.jobs == 2
+    assert len(server._aligners) == 1, "Jobs with the same settings share an aligner"
+    assert parse_library_spec("a=x/b.txt") == ("a", "x/b.txt")
+    assert parse_library_spec("x/b.txt.gz") == ("b", "x/b.txt.gz")
+
+    async def client(path):
+        while not (tmp_path / "s").exists():
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_unix_connection(path)
+        for request in ({"id": "x", "library": "rev", "queries": queries[:3]}, {"command": "shutdown"}):
+            writer.write((json.dumps(request) + "\n").encode())
+        lines = [json.loads(line) for line in (await reader.read()).decode().splitlines()]
+        writer.close()
+        return lines
+
+    async def run():
+        server = AlignmentServer({"lib": targets, "rev": lib2})
+        path = str(tmp_path / "s")
+        (_, lines) = await asyncio.gather(server.serve_unix(path), client(path))
+        return lines
+
+    lines = asyncio.run(run())
+    ab = AlignerCpu(targets=lib2, rules=["M"], score_min=15).align_queries(queries[:3])
+    assert [line["row"] for line in lines[:3]] == [row.fields() for row in batch_rows(ab)]
+    assert lines[3]["done"] and lines[-1] == {"done": True}
+    assert not (tmp_path / "s").exists()
+
+
+def _fail_poly_a(aligner):
+    def wrapped(self, job):
+        if job["queries"] == ["A" * 20]:
+            raise TypeError("poly-A")
+        return aligner(self, job)
+
+    return wrapped
+
+
+@pytest.mark.parametrize(
+    "job, error",
+    [
+        ({"queries": [123]}, "queries must be a list of sequences"),
+        ({"queries": ["ACGT"], "rules": [5]}, 'rules must be a list of strings, e.g. ["M"]'),
+        ({"queries": ["ACGT"], "rc": "yes"}, "rc must be true or false"),
+        ({"queries": ["ACGT"], "library": ["lib"]}, "library must be a string"),
+        ({"queries_file": 7}, "queries_file must be a string"),
+        ({"queries": ["ACGT"], "output": {}}, "output must be a string"),
+    ],
+)
+def test_36_server_malformed_job(job, error, monkeypatch):
+    server = AlignmentServer({"lib": ["ACGTACGTACGTACGTACGT"]})
+    requests = [{"id": 1, **job}, {"id": 2, "queries": ["A" * 20]}, {"id": 3, "queries": ["ACGTACGTACGTACGTACGT"]}]
+    # an unexpected failure in one job is reported, the following jobs still run
+    monkeypatch.setattr(AlignmentServer, "aligner", _fail_poly_a(AlignmentServer.aligner))
+    ofh = io.StringIO()
+    server.serve_stream(io.StringIO("\n".join(json.dumps(r) for r in requests) + "\n"), ofh)
+    responses = [json.loads(line) for line in ofh.getvalue().splitlines()]
+    assert responses[0] == {"id": 1, "error": error}
+    assert responses[1] == {"id": 2, "error": "TypeError: poly-A"}
+    assert responses[-1]["id"] == 3 and responses[-1]["done"] and server.jobs == 1
+
+
+def test_37_startup():
+    code = "import sys, pygas.cli; print(' '.join(sorted(sys.modules)))"
+    loaded = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout.split()
+    for module in ("pkg_resources", "pygas.main", "pygas.matrix", "asyncio"):
+        assert module not in loaded, f"{module} is imported by the CLI before a command runs"
+    version = subprocess.run([sys.executable, "-m", "pygas", "--version"], check=True, capture_output=True, text=True)
+    assert version.stdout.startswith("pygas, version ")
+    # the wall clock budget is enforced by "pygas benchmark", here only the commands and the check are exercised
+    times = startup_times(repeat=1)
+    assert list(times) == ["version", "run"]
+    (rows, over) = check_startup({name: 0.0 for name in times})
+    assert not over and [row[0] for row in rows[1:]] == ["version", "run"]
+    assert check_startup({"run": 2.0})[1]
+
+
+@pytest.mark.parametrize("threads", [0, 2])
+def test_38_bgzf_writer(tmp_path, threads):
+    rng = random.Random(38)
+    text = "".join("".join(rng.choice("ACGT") for _ in range(rng.randint(1, 300))) + "\n" for _ in range(3000))
+    path = str(tmp_path / "out.txt.gz")
+    with BgzfWriter(path, threads=threads) as ofh:
+        for start in range(0, len(text), 5000):
+            ofh.write(text[start : start + 5000])
+    data = open(path, "rb").read()
+    assert gzip.decompress(data).decode() == text
+    assert data.endswith(BGZF_EOF)
+    # every block records its own size and holds at most BGZF_BLOCK bytes
+    offset = 0
+    sizes = []
+    while offset < len(data):
+        assert data[offset : offset + 4] == bytes([31, 139, 8, 4]) and data[offset + 12 : offset + 14] == b"BC"
+        block_size = int.from_bytes(data[offset + 16 : offset + 18], "little") + 1
+        sizes.append(int.from_bytes(data[offset + block_size - 4 : offset + block_size], "little"))
+        offset += block_size
+    assert offset == len(data)
+    assert sizes[-1] == 0 and sum(sizes) == len(text.encode())
+    assert all(size == BGZF_BLOCK for size in sizes[:-2])
+    assert load_seqs(path) == text.splitlines()
+
+    (targets, queries) = _random_library(38)
+    rows = batch_rows(AlignerCpu(targets=targets, rules=["MDI"], score_min=10).align_queries(queries))
+    for name in ("rows.tsv", "rows.tsv.gz"):
+        ofh = open_output(str(tmp_path / name), threads=threads)
+        write_rows(rows, ofh, with_score=True)
+        ofh.close()
+    assert read_rows(str(tmp_path / "rows.tsv.gz")) == read_rows(str(tmp_path / "rows.tsv"))
+    assert open_output(None) is sys.stdout
+
+
+@pytest.mark.parametrize("threads", [0, 2])
+def test_39_seq_reader(tmp_path, threads):
+    rng = random.Random(39)
+    seqs = ["".join(rng.choice("ACGTN") for _ in range(rng.randint(0, 40))) for _ in range(20000)]
+    text = "\n".join(seqs) + "\n"
+    paths = {kind: str(tmp_path / f"seqs.{kind}") for kind in ("txt", "gz", "bgzf")}
+    with open(paths["txt"], "w") as ofh:
+        ofh.write(text)
+    with gzip.open(paths["gz"], "wt") as ofh:
+        ofh.write(text)
+    with BgzfWriter(paths["bgzf"], threads=threads) as ofh:
+        ofh.write(text)
+    assert [is_bgzf(path) for path in paths.values()] == [False, False, True]
+    assert len(text) > 4 * BGZF_BLOCK, "Spans several blocks"
+    for path in paths.values():
+        assert load_seqs(path, threads=threads) == seqs
+    # no trailing newline, CRLF and blank lines are kept as for readlines()
+    with open(paths["txt"], "w", newline="") as ofh:
+        ofh.write("AC\r\n\nGT")
+    assert load_seqs(paths["txt"]) == ["AC", "", "GT"]
+    reader = SeqReader(paths["bgzf"], threads=threads)
+    assert next(iter(reader)) == seqs[0]
+    reader.close()
+
+    data = bytearray(open(paths["bgzf"], "rb").read())
+    data[-40] ^= 0xFF
+    with open(paths["bgzf"], "wb") as ofh:
+        ofh.write(data)
+    with pytest.raises(ValueError, match="BGZF block"):
+        load_seqs(paths["bgzf"], threads=threads)
+    with open(paths["bgzf"], "wb") as ofh:
+        ofh.write(bytes(data[:-60]))
+    with pytest.raises(ValueError, match="Truncated BGZF block"):
+        load_seqs(paths["bgzf"], threads=threads)
+
+
+def test_40_paired(tmp_path):
+    rng = random.Random(40)
+    targets_1 = ["".join(rng.choice("ACGT") for _ in range(20)) for _ in range(30)]
+    targets_2 = ["".join(rng.choice("ACGT") for _ in range(20)) for _ in range(20)]
+    reads = []
+    truth = []
+    for _ in range(60):
+        (i, j) = (rng.randrange(len(targets_1)), rng.randrange(len(targets_2)))
+        half_1 = list(targets_1[i])
+        half_1[rng.randrange(20)] = rng.choice("ACGT")
+        reads.append(("".join(half_1), targets_2[j]))
+        truth.append(i * len(targets_2) + j)
+    reads.append(("A" * 20, targets_2[0]))
+    pa = PairedAligner(targets_1, targets_2, rules=["M"], score_min=15, rev_comp=False)
+    pb = pa.align_pairs(reads)
+    assert pb.unmapped == [("A" * 20, targets_2[0])]
+    found = {(hits[0].first.sm.original_seq, hits[0].second.sm.original_seq): hits for hits in pb.mapped}
+    for (read, pair_id) in zip(reads, truth):
+        assert pair_id in [hit.pair_id for hit in found[read]]
+        assert all(hit.score == max(h.score for h in found[read]) for hit in found[read])
+    # pair_id is the t_id of the same read in the expanded library
+    expanded = [t_1 + t_2 for t_1 in targets_1 for t_2 in targets_2]
+    exact = [(targets_1[pair_id // len(targets_2)], targets_2[pair_id % len(targets_2)]) for pair_id in truth[:10]]
+    ab = AlignerCpu(targets=expanded, rules=[], score_min=40, rev_comp=False).align_queries([a + b for (a, b) in exact])
+    assert [r[0].sm.target_id for r in ab.mapped] == [h[0].pair_id for h in pa.align_pairs(exact).mapped]
+
+    pairs_path = tmp_path / "pairs.tsv"
+    pairs_path.write_text("#t_id_1\tt_id_2\n" + "".join(f"{p // 20}\t{p % 20}\n" for p in truth[:5]))
+    allowed = load_pairs(str(pairs_path))
+    restricted = PairedAligner(targets_1, targets_2, rules=["M"], score_min=15, rev_comp=False, pairs=allowed)
+    pb = restricted.align_pairs(reads)
+    assert {hits[0].pair_id for hits in pb.mapped} <= set(range(5)) and len(pb.mapped) >= 5
+    assert restricted.pair_id(*allowed[2]) == allowed.index(allowed[2])
+    assert restricted.pair_id(*next((i, 0) for i in range(30) if (i, 0) not in allowed)) is None
+    with pytest.raises(ValueError, match="outside the target libraries"):
+        PairedAligner(targets_1, targets_2, rules=["M"], score_min=15, pairs=[(30, 0)])
+    # the best hits of both halves are not an allowed pair, the best allowed pairs are found as in the expanded library
+    near_1 = [targets_1[0], targets_1[0][:5] + ("A" if targets_1[0][5] != "A" else "C") + targets_1[0][6:]]
+    near_2 = [targets_2[0], targets_2[0][:9] + ("A" if targets_2[0][9] != "A" else "C") + targets_2[0][10:]]
+    near_pairs = [(1, 1), (0, 1), (1, 0)]
+    near = PairedAligner(near_1, near_2, rules=["M"], score_min=15, rev_comp=False, pairs=near_pairs)
+    rescued = near.align_pairs([(near_1[0], near_2[0])]).mapped[0]
+    expanded = [near_1[i] + near_2[j] for (i, j) in near_pairs]
+    ab = AlignerCpu(targets=expanded, rules=["MM"], score_min=30, rev_comp=False).align_queries([near_1[0] + near_2[0]])
+    assert sorted(hit.pair_id for hit in rescued) == sorted(bt.sm.target_id for bt in ab.mapped[0]) == [1, 2]
+    assert {hit.score for hit in rescued} == {39}
+
+    out = io.StringIO()
+    write_pairs(pb, out, with_score=True)
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith("#query_1\tquery_2\tscore\tpair_id") and len(lines) == len(reads) + 1
+    assert all((len(line.split("\t")) - 3) % 13 == 0 for line in lines[len(pb.unmapped) + 1 :])
+    assert split_read("AC\tGT", 0) == ("AC", "GT") and split_read("ACGT", 1) == ("A", "CGT")
+    with pytest.raises(ValueError):
+        split_read("ACGT", 0)
+
+
+def test_41_checkpoint(tmp_path):
+    (targets, queries) = _random_library(41, n_queries=50)
+    queries += queries[:4]  # duplicates across chunks
+    a = AlignerCpu(targets=targets, rules=["MDI"], score_min=10, budget=200)
+    directory = str(tmp_path / "out.ckpt")
+    settings = {"rules": ("MDI",), "minscore": 10}
+    ckpt = CheckpointRun(a, queries, directory, chunk_size=7, settings=settings)
+    ckpt.run(max_chunks=3)
+    assert ckpt.completed == 3 and ckpt.remaining == len(queries) - 21
+    with pytest.raises(ValueError, match="chunks are complete"):
+        list(ckpt.rows())
+    with pytest.raises(ValueError, match="holds a checkpoint"):
+        CheckpointRun(a, queries, directory, chunk_size=7, settings=settings)
+    with pytest.raises(ValueError, match="different settings"):
+        CheckpointRun(a, queries, directory, chunk_size=7, settings={**settings, "minscore": 11}, resume=True)
+    with pytest.raises(ValueError, match="different queries_sha1"):
+        CheckpointRun(a, queries[1:] + queries[:1], directory, chunk_size=7, settings=settings, resume=True)
+
+    resumed = CheckpointRun(a, queries, directory, chunk_size=7, settings=settings, resume=True)
+    assert resumed.completed == 3
+    progress = Progress(total=resumed.remaining)
+    resumed.run(progress=progress)
+    assert progress.processed == len(queries) - 21 and resumed.remaining == 0
+    full = a.align_queries(queries)
+    out = io.StringIO()
+    resumed.write(out, with_score=True, with_status=True)
+    expected = io.StringIO()
+    write_rows(batch_rows(full), expected, with_score=True, with_status=True)
+    assert out.getvalue() == expected.getvalue()
+    assert resumed.budget_exceeded == len(full.budget_exceeded) > 0
+    resumed.remove()
+    assert not (tmp_path / "out.ckpt").exists()
+
+
+def test_42_target_clusters():
+    assert len(list(substitution_neighbours("ACGT", 1))) == 1 + 4 * 3
+    assert len(set(substitution_neighbours("ACGTA", 2))) == 1 + 5 * 3 + 10 * 9
+    rng = random.Random(42)
+    targets = []
+    for _ in range(20):
+        center = "".join(rng.choice("ACGT") for _ in range(20))
+        targets.append(center)
+        for _ in range(5):
+            member = list(center)
+            member[rng.randrange(20)] = rng.choice("ACGT")
+            targets.append("".join(member))
+    library = TargetLibrary(targets, cluster_radius=1)
+    assert library.n_clusters == 20
+    assert [library.cluster_of[t_id] for t_id in range(6)] == [0] * 6
+    assert library.cluster_size[0] == 6 and library.cluster_radii[0] <= 1
+    library.remove([0])
+    assert library.cluster_size[0] == 0 and all(library.cluster_of[t_id] == t_id for t_id in range(1, 6))
+    library.add([targets[0]])
+    assert library.cluster_of[len(targets)] in range(1, 6)
+
+    queries = []
+    for _ in range(40):
+        q = list(rng.choice(targets))
+        for _ in range(rng.randint(1, 3)):
+            p = rng.randrange(len(q))
+            if rng.random() < 0.5:
+                q[p] = rng.choice("ACGT")
+            else:
+                q.insert(p, rng.choice("ACGT"))
+        queries.append("".join(q))
+    for rules in (["M"], ["MDI"], ["MM", "I"]):
+        for use_trie in (False, True):
+            args = dict(targets=targets, rules=rules, score_min=12, use_trie=use_trie)
+            expected = _batch_summary(AlignerCpu(**args).align_queries(queries))
+            for radius in (1, 2):
+                assert _batch_summary(AlignerCpu(cluster_radius=radius, **args).align_queries(queries)) == expected
+
+
+def test_43_guide_extraction():
+    rng = random.Random(43)
+    targets = ["".join(rng.choice("ACGT") for _ in range(20)) for _ in range(50)] + ["ACGTNACGTA", "A" * 40]
+    index = WindowIndex(TargetLibrary(targets).targets)
+    assert index.lengths == [10, 20, 40]
+    read = "GG" + targets[3] + "C" + revcomp(targets[7]) + "ACGTNACGTA" + "T" + "A" * 41
+    assert index.scan(read) == [(3, 2, False), (7, 23, True), (50, 43, False), (51, 54, False), (51, 55, False)]
+    assert (7, 23, True) not in index.scan(read, rev_comp=False)
+    index.remove(targets[3], 3)
+    assert (3, 2, False) not in index.scan(read)
+
+    (flank_5, flank_3) = ("TTGACAGCTAGCTCAGTCCT", "GTTTTAGAGCTAGAAATAGC")
+    reads = []
+    for (i, t_id) in enumerate([0, 1, 2, 3, 4, 5]):
+        guide = targets[t_id]
+        if i >= 3:
+            guide = guide[:8] + ("A" if guide[8] != "A" else "C") + guide[9:]
+        reads.append("GATC" * (i + 1) + flank_5 + guide + flank_3 + "CCGG")
+    reads[1] = revcomp(reads[1])
+    reads[4] = revcomp(reads[4])
+    reads += ["GATC" * 20]
+    ge = GuideExtractor(targets, rules=["M"], score_min=18, flank_5=flank_5, flank_3=flank_3)
+    eb = ge.extract(reads)
+    assert eb.unmapped == ["GATC" * 20] and eb.exact == 3
+    hits = {hits[0].read: hits[0] for hits in eb.mapped}
+    for (i, read) in enumerate(reads[:6]):
+        hit = hits[read]
+        assert (hit.t_id, hit.reversed) == (i, i in (1, 4))
+        offset = 4 * (i + 1) + 20
+        assert hit.offset == (len(read) - offset - 20 if hit.reversed else offset)
+        assert hit.score == (20 if i < 3 else 19) and hit.cigar == "20M" and (hit.md == "20") == (i < 3)
+    # mismatches at the first and last guide base don't shift the offset, on either strand
+    for (pos, md) in ((0, f"0{targets[4][0]}19"), (19, f"19{targets[4][19]}0")):
+        guide = targets[4][:pos] + ("A" if targets[4][pos] != "A" else "C") + targets[4][pos + 1 :]
+        read = "GATC" + flank_5 + guide + flank_3 + "CCGG"
+        for (seq, offset) in ((read, 24), (revcomp(read), len(read) - 44)):
+            hit = ge.extract([seq]).mapped[0][0]
+            assert (hit.t_id, hit.offset, hit.cigar, hit.md) == (4, offset, "20M", md)
+    # without anchors only exact hits are found, a fixed anchor recovers the rest
+    assert len(GuideExtractor(targets, rules=["M"], score_min=18).extract(reads).mapped) == 3
+    anchored = GuideExtractor(targets[:50], rules=["M"], score_min=18, anchor=24)
+    shifted = reads[3][12:]  # guide at 24 as in reads[0]
+    assert [hits[0].t_id for hits in anchored.extract([reads[0], shifted, reads[3]]).mapped] == [0, 3]
+
+    out = io.StringIO()
+    write_guides(eb, out, with_score=True)
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith("#read\tscore\treversed\tt_id\toffset") and len(lines) == len(reads) + 1
+    assert lines[1] == "GATC" * 20 + "\t.\t." and lines[2].split("\t")[1:4] == ["20", "False", "0"]
+
+
+def test_44_duplicate_target_classes():
+    packed = PackedTargets(["ACGT", "TTTT", "ACGT", "ACNT", "ACGT", "ACNT"])
+    assert [packed.class_of(t_id) for t_id in range(6)] == [0, 1, 0, 3, 0, 3]
+    packed.remove(0)
+    packed.remove(3)
+    assert [packed.class_of(t_id) for t_id in range(6)] == [-1, 1, 2, -1, 2, 5]
+    assert packed.class_of(packed.append("ACGT")) == 2
+
+    # every copy of a target is reported as if aligned on its own
+    (targets, queries) = _random_library(44, n_targets=30, n_queries=40)
+    queries += ["GG" + q + "T" for q in queries[:10]]
+    n_targets = len(targets)
+    for use_trie in (False, True):
+        args = dict(rules=["MDI", "MM"], score_min=10, match_type=3, use_trie=use_trie)
+        single = batch_rows(AlignerCpu(targets=targets, **args).align_queries(queries))
+        copies = batch_rows(AlignerCpu(targets=targets * 3, **args).align_queries(queries))
+        expanded = [
+            (query, score, sorted(hit for hit in hits for _ in range(3)))
+            for (query, score, hits) in _row_summary(single)
+        ]
+        folded = [
+            (query, score, sorted((h[0], str(int(h[1]) % n_targets)) + h[2:] for h in hits))
+            for (query, score, hits) in _row_summary(copies)
+        ]
+        assert folded == expanded
+
+
+def test_45_multi_sample():
+    (targets, queries) = _random_library(45, n_targets=40, n_queries=60)
+    samples = {"S1": queries[:40], "S2": queries[20:] + queries[:5], "S3": []}
+    a = AlignerCpu(targets=targets, rules=["MDI"], score_min=10)
+    msr = MultiSampleRun(a, samples)
+    assert msr.n_queries == 85 and len(msr.distinct) == len(set(queries))
+    with pytest.raises(ValueError, match="align"):
+        list(msr.rows("S1"))
+    msr.align()
+    for (name, sample) in samples.items():
+        single = io.StringIO()
+        write_rows(batch_rows(AlignerCpu(targets=targets, rules=["MDI"], score_min=10).align_queries(sample)), single)
+        out = io.StringIO()
+        msr.write(name, out)
+        assert out.getvalue() == single.getvalue()
+
+    out = io.StringIO()
+    msr.write_counts(out, with_score=True)
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith("#query\tcount_S1\tcount_S2\tcount_S3\tscore\treversed")
+    assert len(lines) == len(msr.distinct) + 1
+    counts = {line.split("\t")[0]: [int(n) for n in line.split("\t")[1:4]] for line in lines[1:]}
+    assert counts[queries[0]] == [queries[:40].count(queries[0]), (queries[20:] + queries[:5]).count(queries[0]), 0]
+    assert sum(sum(n) for n in counts.values()) == msr.n_queries
+    assert [sample_name(path) for path in ["/a/S1.txt.gz", "S2.seq", "S3", "x.y.gz"]] == ["S1", "S2", "S3", "x.y"]
+
+
+def test_46_engine_planner():
+    (targets, queries) = _random_library(46, n_targets=60, n_queries=40)
+    a = AlignerCpu(targets=targets, rules=["MDI"], score_min=10, auto_plan=True)
+    plan = a.engine_plan
+    assert plan.profile.n_targets == len(targets) and plan.profile.n_distinct == len(set(targets))
+    assert plan.profile.lengths == a.library.length_counts and plan.profile.duplication > 0
+    assert set(plan.strategies) == set(plan.profile.lengths) == set(plan.timings)
+    for (q_len, strategy) in plan.strategies.items():
+        assert strategy in (STRATEGY_TRIE, STRATEGY_SCAN) and set(plan.timings[q_len]) == {STRATEGY_TRIE, STRATEGY_SCAN}
+        assert plan.timings[q_len][strategy] == min(plan.timings[q_len].values())
+    assert len(plan.describe()) == 1 + len(plan.strategies)
+
+    # every strategy gives the same result
+    expected = _row_summary(batch_rows(AlignerCpu(targets=targets, rules=["MDI"], score_min=10).align_queries(queries)))
+    assert _row_summary(batch_rows(a.align_queries(queries))) == expected
+    for strategy in (STRATEGY_TRIE, STRATEGY_SCAN):
+        forced = {q_len: strategy for q_len in plan.strategies}
+        assert _row_summary(batch_rows(a._align(queries, False, strategies=forced))) == expected
+
+    exact = AlignerCpu(targets=targets, rules=[], score_min=10, auto_plan=True)
+    assert set(exact.engine_plan.strategies.values()) == {STRATEGY_EXACT} and exact.library.trie is None
+    shared = AlignerCpu(targets=exact.library, rules=[], score_min=10, auto_plan=True)
+    assert shared.engine_plan.strategies == exact.engine_plan.strategies
+
+    sample = calibration_queries(a.library, 18, 10, random.Random(0))
+    assert len(sample) == 10 and all(len(q) == 18 for q in sample)
+    assert sum(1 for q in sample if q in targets) == 0, "Derived queries carry a substitution"
+    assert LibraryProfile(n_targets=0, n_distinct=0, lengths={}, has_trie=False).duplication == 0.0
+
+
+@pytest.mark.parametrize("max_memory", [1, 1 << 40])
+def test_47_spill(tmp_path, max_memory):
+    (targets, queries) = _random_library(47, n_queries=50)
+    a = AlignerCpu(targets=targets, rules=["MDI"], score_min=10, budget=200)
+    expected = io.StringIO()
+    write_rows(batch_rows(a.align_queries(queries)), expected, with_score=True, with_status=True)
+    progress = Progress(total=None)
+    with SpillRun(a, max_memory, chunk_size=7, with_score=True, with_status=True, directory=str(tmp_path)) as spill:
+        spill.run(iter(queries), progress=progress)
+        out = io.StringIO()
+        spill.write(out)
+        assert out.getvalue() == expected.getvalue()
+        assert spill.spills == (8 if max_memory == 1 else 0)
+        assert spill.n_queries == len(queries) and spill.budget_exceeded > 0
+    assert list(tmp_path.iterdir()) == []
+    assert "50/? queries" in format_report(progress.finish())
+    assert current_rss() > 0
+    assert parse_size("512") == 512 and parse_size("1.5k") == 1536 and parse_size("4GiB") == 4 << 30
+    with pytest.raises(ValueError, match="Invalid size"):
+        parse_size("lots")
+
+
+def test_48_result_store(tmp_path):
+    (targets, queries) = _random_library(48, n_queries=60)
+    queries += queries[:3]
+    rows = batch_rows(AlignerCpu(targets=targets, rules=["MDI"], score_min=10, budget=200).align_queries(queries))
+    path = str(tmp_path / "out.pgr")
+    assert write_store(rows, path) == len(rows)
+    with ResultStore(path) as rs:
+        assert len(rs) == len(rows) and rs.n_hits == sum(len(row.hits) for row in rows)
+        out = io.StringIO()
+        write_rows(rs.rows(), out, with_score=True, with_status=True)
+        expected = io.StringIO()
+        write_rows(rows, expected, with_score=True, with_status=True)
+        assert out.getvalue() == expected.getvalue()
+        assert any(row.budget_exceeded for row in rs.rows())
+        for row in rows:
+            assert rs.get(row.query) == row and row.query in rs
+        assert rs.get("ACGT") is None and "ACGT" not in rs
+        assert [q_idx for (q_idx, *_) in rs.hits()] == [i for (i, row) in enumerate(rows) for _ in row.hits]
+        assert [(str(rev), str(t_id), str(t_pos)) for (_, t_id, rev, t_pos, _) in rs.hits()] == [
+            tuple(hit[:3]) for row in rows for hit in row.hits
+        ]
+        with pytest.raises(IndexError):
+            rs.row(len(rows))
+    write_store([], path)
+    with ResultStore(path) as rs:
+        assert len(rs) == 0 and rs.get("ACGT") is None and list(rs.rows()) == []
+    (tmp_path / "bad.pgr").write_bytes(b"#query\n")
+    with pytest.raises(ValueError, match="not a pygas result store"):
+        ResultStore(str(tmp_path / "bad.pgr"))
+
+
+@pytest.mark.parametrize("use_trie", [True, False])
+def test_49_length_buckets(use_trie):
+    (targets, queries) = _random_library(49, n_queries=60)
+    library = TargetLibrary(targets, use_trie=use_trie)
+    library.remove([0, 3])
+    expected = {}
+    for (t_id, target) in enumerate(targets):
+        if t_id not in (0, 3):
+            expected.setdefault(len(target), []).append(t_id)
+    assert {t_len: list(t_ids) for (t_len, t_ids) in library.length_buckets.items()} == expected
+    assert library.length_counts == {t_len: len(expected[t_len]) for t_len in sorted(expected)}
+
+    args = dict(rules=["MDI"], score_min=10, rev_comp=True, use_trie=use_trie)
+    batch = AlignerCpu(targets=targets, **args).align_queries(queries)
+    for results in batch.mapped:
+        # only the best score, in t_id then orientation order whichever length was visited first
+        assert len({bt.sm.score for bt in results}) == 1
+        hits = [(bt.sm.target_id, bt.sm.reversed) for bt in results]
+        assert hits == sorted(hits)
+    # the hits don't depend on target order
+    shuffled = targets[::-1]
+    (unmapped, mapped) = _batch_summary(AlignerCpu(targets=shuffled, **args).align_queries(queries))
+    assert unmapped == batch.unmapped
+
+    def by_seq(summary, seqs):
+        return [sorted((seqs[hit[0]],) + hit[1:] for hit in results) for results in summary]
+
+    assert by_seq(mapped, shuffled) == by_seq(_batch_summary(batch)[1], targets)